@@ -0,0 +1,324 @@
+"""
+Benchmark suite for ingest, storage and the dashboard callbacks. Run from the root
+of the repository with:
+
+    python benchmarks/bench_suite.py --scale 10k
+
+Synthetic data is generated with a fixed seed, every benchmark runs against an
+isolated in-memory database (or --database <path> to measure an on-disk one) and
+the results are saved as JSON in benchmarks/results so runs can be compared over
+time:
+
+    python benchmarks/bench_suite.py --scale 10k --compare benchmarks/results/<old>.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from synthetic import PAGE_SIZE, SCALES, generate_accounts, iter_transactions, paginate
+from mock_api import MockUpAPI
+
+# Directory the results of each run are saved to
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+def timed(func: Callable[[], Any], repeat: int=5, setup: Callable[[], Any]|None=None) -> dict[str, float]:
+    """
+    Times a function.
+
+    Params:
+        func: The function to time, it is called with no arguments.
+        repeat: The number of times to call the function.
+        setup: A function called before each call of func which isn't timed.
+
+    Returns:
+        A dictionary of the minimum, median and mean time in seconds.
+    """
+
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'repeat': repeat
+    }
+
+def setup_environment(directory: str) -> None:
+    """
+    Points the application at a scratch database, cache and secrets file in a
+    directory and disables the cache, so nothing can touch the real database.
+    This must happen before the application reads its configuration.
+
+    Params:
+        directory: The directory to create the files in.
+    """
+
+    secrets_file = os.path.join(directory, 'secrets.json')
+    with open(secrets_file, 'w') as f:
+        json.dump({'Up': {'PAT': 'benchmark'}}, f)
+
+    os.environ['DB_FILE'] = os.path.join(directory, 'finance.db')
+    os.environ['CACHE_FILE'] = os.path.join(directory, 'cache.db')
+    os.environ['SECRETS_FILE'] = secrets_file
+    os.environ['CACHE_TIMEOUT'] = '0'
+
+def point_at_api(base_uri: str) -> None:
+    """
+    Points the application at a different Up API, e.g. a MockUpAPI.
+
+    Params:
+        base_uri: The base URI of the API.
+    """
+
+    from config import get_config
+
+    os.environ['UP_BASE_URI'] = base_uri
+    get_config.cache_clear()
+
+def reset_database() -> None:
+    """
+    Drops every table in the benchmark database and recreates the schema.
+    """
+
+    import database
+
+    tables = database.read_database(
+        '''SELECT name FROM sqlite_master WHERE type = "table" AND name NOT LIKE "sqlite_%"'''
+    )
+    for table in tables['name']:
+        database.execute_query(f'DROP TABLE IF EXISTS {table}')
+
+    database.db_init()
+
+def parallel_syncs(count: int) -> None:
+    """
+    Runs several syncs at once, each into its own in-memory database.
+
+    Params:
+        count: The number of syncs to run.
+    """
+
+    import api
+    from database import use_database
+
+    def sync(_):
+        with use_database(':memory:'):
+            api.update_dataset()
+
+    with ThreadPoolExecutor(count) as pool:
+        list(pool.map(sync, range(count)))
+
+def run_benchmarks(count: int, seed: int, only: list[str]|None) -> dict[str, dict[str, float]]:
+    """
+    Runs every benchmark.
+
+    Params:
+        count: The number of synthetic transactions.
+        seed: Seed for the synthetic data.
+        only: If given only benchmarks whose name starts with one of these are run.
+
+    Returns:
+        A dictionary of benchmark name to timing results.
+    """
+
+    import api
+    import balances
+    import dashboard
+    import database
+    import recurring
+
+    results = {}
+
+    def bench(name: str, func: Callable[[], Any], **kwargs: Any) -> None:
+        if only and not any(name.startswith(prefix) for prefix in only):
+            return
+
+        results[name] = timed(func, **kwargs)
+        print(f"{name:<45} {results[name]['median'] * 1000:>12.2f} ms")
+
+    accounts = generate_accounts(seed)
+    transactions = list(iter_transactions(count, accounts, seed))
+    pages = list(paginate(iter(transactions), PAGE_SIZE))
+
+    # Ingest
+    bench('parse_accounts_json', lambda: api.parse_accounts_json(accounts))
+    bench(
+        'parse_transactions_json',
+        lambda: [api.parse_transactions_json(page) for page in pages],
+        repeat=3
+    )
+    bench(
+        'parse_transaction_json',
+        lambda: [api.parse_transaction_json({'data': transaction}) for transaction in transactions[:1000]],
+        repeat=3
+    )
+
+    # Storage
+    accounts_df = api.parse_accounts_json(accounts)
+    transactions_df = api.parse_transactions_json({'data': transactions})
+    updated_df = transactions_df.sample(n=min(1000, len(transactions_df)), random_state=seed)
+
+    bench('upsert_accounts.new', lambda: database.upsert_accounts(accounts_df), repeat=1, setup=reset_database)
+    bench('upsert_accounts.existing', lambda: database.upsert_accounts(accounts_df))
+    bench(
+        'upsert_transactions.new',
+        lambda: database.upsert_transactions(transactions_df, True),
+        repeat=1,
+        setup=lambda: [database.execute_query(f'DELETE FROM {table}') for table in ['TransactionTags', 'TransactionChanges', 'Transactions']]
+    )
+    bench('upsert_transactions.existing_1000', lambda: database.upsert_transactions(updated_df, False), repeat=1)
+    bench('refresh_daily_totals', database.refresh_daily_totals)
+    bench('refresh_category_totals', database.refresh_category_totals)
+    bench('update_recurring.full', lambda: recurring.update_recurring(True))
+    bench('refresh_daily_balances.full', lambda: balances.refresh_daily_balances(True))
+    bench('refresh_daily_balances.incremental', balances.refresh_daily_balances)
+
+    # Callbacks, invoked directly against the database populated above, with
+    # their tab selected and nothing rendered yet. The callbacks read which input
+    # triggered them from the Dash callback context, which doesn't exist outside
+    # a request, so one is provided.
+    dashboard.callback_context = types.SimpleNamespace(triggered_id=None, triggered=[{'prop_id': '.'}])
+
+    bench('callback.get_layout', dashboard.get_layout)
+    bench('callback.income_pie_chart', lambda: dashboard.income_pie_chart(None, None, None, None, None, 0, None, 'overview', None))
+    bench('callback.spending_total_sunburst', lambda: dashboard.spending_total_sunburst(None, None, None, None, None, 0, None, 'overview', None))
+    for group in ['day', 'month']:
+        bench(
+            f'callback.cashflow_time_series.{group}',
+            lambda: dashboard.cashflow_time_series(None, None, None, None, group, None, 0, None, 'trends', None)
+        )
+    bench(
+        'callback.net_worth_time_series.month',
+        lambda: dashboard.net_worth_time_series(None, None, None, None, 'month', 0, None, 'trends', None)
+    )
+    bench(
+        'callback.transactions_table.first_page',
+        lambda: dashboard.transactions_table(0, 100, [], '', None, None, None, None, None, 0, None, 'transactions', None)
+    )
+    bench(
+        'callback.spending_total_sunburst.tagged',
+        lambda: dashboard.spending_total_sunburst(None, None, None, None, ['Holiday'], 0, None, 'overview', None)
+    )
+    bench(
+        'callback.cashflow_time_series.month.tagged',
+        lambda: dashboard.cashflow_time_series(None, None, None, None, 'month', ['Holiday'], 0, None, 'trends', None)
+    )
+    bench(
+        'callback.transactions_table.sorted_filtered',
+        lambda: dashboard.transactions_table(
+            0, 100, [{'column_id': 'amount', 'direction': 'asc'}],
+            '{description} contains Woolworths', None, None, None, None, None, 0, None, 'transactions', None
+        )
+    )
+    bench('callback.recurring_table', lambda: dashboard.recurring_table(0, None, 'recurring', None))
+    bench(
+        'callback.comparison_table.12_periods',
+        lambda: dashboard.comparison_table(None, None, None, None, None, 'previous', 12, 'merchant', 0, None, 'compare', None)
+    )
+    bench(
+        'callback.comparison_chart.year.tagged',
+        lambda: dashboard.comparison_chart(None, None, None, None, ['Holiday'], 'year', 3, 'category', 0, None, 'compare', None)
+    )
+    bench('callback.poll_sync_status', lambda: dashboard.poll_sync_status(1, None, -1))
+
+    # End to end sync against the local mock API, starting from an empty database.
+    # The rate limited run answers 5% of requests with a 429 to measure retries.
+    for name, rate_limit in [('sync', 0), ('sync_rate_limited', 0.05)]:
+        with MockUpAPI(accounts, transactions, rate_limit=rate_limit, retry_after=0, seed=seed) as server:
+            point_at_api(server.base_uri)
+            bench(f'{name}.update_dataset.initial', api.update_dataset, repeat=1, setup=reset_database)
+            bench(f'{name}.update_dataset.incremental', api.update_dataset, repeat=3)
+            bench(f'{name}.update_dataset.parallel_4', lambda: parallel_syncs(4), repeat=1)
+
+    return results
+
+def git_commit() -> str|None:
+    """
+    Gets the commit the benchmarks are being run against.
+    """
+
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(baseline: dict[str, Any], current: dict[str, Any]) -> None:
+    """
+    Prints the change in median time of every benchmark in both runs.
+
+    Params:
+        baseline: The saved results of an earlier run.
+        current: The results of this run.
+    """
+
+    print(f"\n{'benchmark':<45} {'baseline ms':>12} {'current ms':>12} {'ratio':>8}")
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+
+        old = baseline['results'][name]['median'] * 1000
+        new = result['median'] * 1000
+        print(f'{name:<45} {old:>12.2f} {new:>12.2f} {new / old if old else float("nan"):>8.2f}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='10k')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', help='Only run benchmarks starting with these names')
+    parser.add_argument('--database', default=':memory:', help='Database to benchmark against')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_environment(directory)
+
+        from database import use_database
+        with use_database(args.database):
+            results = run_benchmarks(SCALES[args.scale], args.seed, args.only)
+
+    run = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'seed': args.seed,
+        'database': args.database,
+        'results': results
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{args.scale}-{run['timestamp'].replace(':', '')}.json")
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=4)
+    print(f'\nResults saved to {path}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
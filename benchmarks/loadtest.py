@@ -0,0 +1,162 @@
+"""
+Load test for the production serving mode. Starts the app under gunicorn with an
+increasing number of workers and measures how many chart callback requests per
+second it can serve. Run from the root of the repository with:
+
+    python benchmarks/loadtest.py --workers 1 2 4
+
+The database in the current directory is used, the shared cache is disabled so
+that every request runs the callback, and no worker runs the sync scheduler.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def callback_payload(years: list[str]|None) -> bytes:
+    """
+    Builds the body of the request Dash sends to update the income-pie-chart.
+
+    Params:
+        years: The value of the year-select dropdown.
+
+    Returns:
+        bytes: The JSON request body.
+    """
+
+    return json.dumps({
+        'output': '..income-pie-chart.figure...income-pie-chart-rendered.data..',
+        'outputs': [
+            {'id': 'income-pie-chart', 'property': 'figure'},
+            {'id': 'income-pie-chart-rendered', 'property': 'data'}
+        ],
+        'inputs': [
+            {'id': 'year-select', 'property': 'value', 'value': years},
+            {'id': 'month-select', 'property': 'value', 'value': None},
+            {'id': 'date-range-select', 'property': 'start_date', 'value': None},
+            {'id': 'date-range-select', 'property': 'end_date', 'value': None},
+            {'id': 'tag-select', 'property': 'value', 'value': None},
+            {'id': 'data-version', 'property': 'data', 'value': 0},
+            {'id': 'profile-select', 'property': 'value', 'value': 'default'},
+            {'id': 'panel-tabs', 'property': 'value', 'value': 'overview'}
+        ],
+        'changedPropIds': ['year-select.value'],
+        'state': [
+            {'id': 'income-pie-chart-rendered', 'property': 'data', 'value': None}
+        ]
+    }).encode()
+
+def post(url: str, body: bytes) -> float:
+    """
+    Makes a single callback request.
+
+    Params:
+        url: The URL of the Dash callback route.
+        body: The JSON request body.
+
+    Returns:
+        float: The latency of the request in seconds.
+    """
+
+    start = time.perf_counter()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+def wait_until_ready(url: str, timeout: float=60) -> None:
+    """
+    Waits for the server to start responding.
+
+    Params:
+        url: The URL to poll.
+        timeout: The maximum number of seconds to wait.
+    """
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            time.sleep(0.5)
+
+    raise TimeoutError(f'Server at {url} did not start')
+
+def run(workers: int, threads: int, requests: int, concurrency: int, port: int) -> dict[str, float]:
+    """
+    Starts gunicorn with the given number of workers and fires requests at it.
+
+    Returns:
+        A dictionary of the measured throughput and latency percentiles.
+    """
+
+    env = dict(
+        os.environ,
+        WORKERS=str(workers),
+        THREADS=str(threads),
+        BIND=f'127.0.0.1:{port}',
+        CACHE_TIMEOUT='0'
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'src/gunicorn.conf.py', 'wsgi:server'],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    try:
+        base_url = f'http://127.0.0.1:{port}'
+        wait_until_ready(base_url + '/sync-status')
+
+        years = [None, ['2021'], ['2022'], ['2023'], ['2022', '2023']]
+        bodies = [callback_payload(random.choice(years)) for _ in range(requests)]
+        url = base_url + '/_dash-update-component'
+
+        # Warm up every worker before measuring
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(lambda body: post(url, body), bodies[:workers * 4]))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = sorted(pool.map(lambda body: post(url, body), bodies))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'workers': workers,
+        'requestsPerSecond': requests / elapsed,
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--port', type=int, default=8051)
+    args = parser.parse_args()
+
+    # Hold the scheduler lock so none of the workers start syncing with the API
+    lock_file = open(os.environ.get('SCHEDULER_LOCK_FILE', 'scheduler.lock'), 'w')
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    print(f"{'workers':>8} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for workers in args.workers:
+        result = run(workers, args.threads, args.requests, args.concurrency, args.port)
+        print(
+            f"{result['workers']:>8} {result['requestsPerSecond']:>10.1f} "
+            f"{result['p50']:>10.1f} {result['p95']:>10.1f}"
+        )
@@ -0,0 +1,437 @@
+"""
+Local stand-in for the Up banking API, serving synthetic or recorded data so the
+sync can be run and load tested without touching the real API. It implements
+accounts, paginated transactions with filter[since] and filter[until],
+transactions/{id}, categories, tags and webhooks, and can inject latency, rate
+limiting (429) and server errors (5xx). Start it with synthetic data with:
+
+    python benchmarks/mock_api.py serve --scale 10k --latency 0.05 --rate-limit 0.02
+
+and point the app at it by setting UP_BASE_URI to the printed base URI. A fixture
+can be recorded from the real API, using the PAT in the secrets file, with:
+
+    python benchmarks/mock_api.py record --out fixtures/recorded
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from bisect import bisect_left
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+
+from synthetic import PAGE_SIZE, SCALES, generate_accounts, generate_categories, iter_transactions, read_fixture
+
+class MockUpAPI:
+    """
+    Serves Up API responses on a background thread. The base URI to use in place
+    of the real API is available as base_uri once the server has been started.
+    """
+
+    def __init__(
+        self,
+        accounts: dict[str, Any],
+        transactions: list[dict[str, Any]],
+        categories: dict[str, Any]|None=None,
+        port: int=0,
+        latency: float=0,
+        jitter: float=0,
+        rate_limit: float=0,
+        error_rate: float=0,
+        retry_after: int=1,
+        seed: int=0
+    ):
+        """
+        Params:
+            accounts: An accounts response, e.g. from synthetic.generate_accounts.
+            transactions: A list of transaction resources, newest first.
+            categories: A categories response, defaults to
+                synthetic.generate_categories.
+            port: The port to listen on, 0 picks a free port.
+            latency: Seconds added to every response.
+            jitter: Maximum random seconds added to or removed from the latency.
+            rate_limit: Share of requests, between 0 and 1, answered with a 429.
+            error_rate: Share of requests answered with a 500, 502 or 503.
+            retry_after: Value of the Retry-After header sent with 429s.
+            seed: Seed for choosing which requests are delayed or fail.
+        """
+
+        self.accounts = accounts
+        self.categories = categories or generate_categories()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+
+        self.webhooks = {}
+        self.stats = {'requests': 0, 'rateLimited': 0, 'errors': 0, 'webhookDeliveries': 0}
+
+        self._rng = random.Random(seed)
+        self._lock = Lock()
+        self._set_transactions(transactions)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def base_uri(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/api/v1/'
+
+    def start(self) -> 'MockUpAPI':
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'MockUpAPI':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _set_transactions(self, transactions: list[dict[str, Any]]) -> None:
+        with self._lock:
+            self.transactions = transactions
+            self.by_id = {transaction['id']: transaction for transaction in transactions}
+
+            # Creation times oldest first, used to binary search the time filters
+            self._created = [transaction['attributes']['createdAt'] for transaction in reversed(transactions)]
+
+    def add_transactions(self, transactions: list[dict[str, Any]]) -> None:
+        """
+        Adds new transactions, as if they had just happened, and delivers a
+        TRANSACTION_CREATED event for each one to every registered webhook.
+
+        Params:
+            transactions: The transaction resources to add, newest first and
+                newer than every existing transaction.
+        """
+
+        self._set_transactions(transactions + self.transactions)
+
+        for transaction in transactions:
+            self.deliver_event('TRANSACTION_CREATED', transaction['id'])
+
+    def deliver_event(self, event_type: str, transaction_id: str|None=None) -> dict[str, Any]:
+        """
+        Sends a webhook event to the URL of every registered webhook. Delivery
+        failures are ignored.
+
+        Params:
+            event_type: The Up event type e.g. 'PING' or 'TRANSACTION_CREATED'.
+            transaction_id: The id of the transaction the event is about.
+
+        Returns:
+            dict: The event resource which was sent.
+        """
+
+        event = {
+            'data': {
+                'type': 'webhook-events',
+                'id': str(uuid.uuid4()),
+                'attributes': {
+                    'eventType': event_type,
+                    'createdAt': datetime.now().astimezone().isoformat(timespec='seconds')
+                },
+                'relationships': {
+                    'transaction': {'data': {'type': 'transactions', 'id': transaction_id}} if transaction_id else None
+                }
+            }
+        }
+
+        for webhook in list(self.webhooks.values()):
+            try:
+                request = Request(
+                    webhook['attributes']['url'],
+                    data=json.dumps(event).encode(),
+                    headers={'Content-Type': 'application/json'}
+                )
+                urlopen(request, timeout=5).read()
+                self.stats['webhookDeliveries'] += 1
+            except OSError:
+                pass
+
+        return event
+
+    def list_transactions(self, query: dict[str, list[str]]) -> dict[str, Any]:
+        """
+        Builds a page of the transactions list response.
+
+        Params:
+            query: The parsed query string of the request. filter[since] (at or
+                after), filter[until] (before), page[size] and page[after], the
+                cursor given in the next link, are supported.
+
+        Returns:
+            dict: The page of transactions.
+        """
+
+        size = min(int(query.get('page[size]', [PAGE_SIZE])[0]), PAGE_SIZE)
+        since = query.get('filter[since]', [None])[0]
+        until = query.get('filter[until]', [None])[0]
+
+        with self._lock:
+            transactions, created = self.transactions, self._created
+
+        # Transactions are newest first, so the filters select one slice
+        count = len(transactions)
+        first = count - bisect_left(created, until) if until is not None else 0
+        end = count - bisect_left(created, since) if since is not None else count
+
+        start = max(first, int(query.get('page[after]', [0])[0]))
+        stop = min(end, start + size)
+
+        next_link = None
+        if stop < end:
+            next_query = {key: values[0] for key, values in query.items()}
+            next_query['page[after]'] = stop
+            next_link = f'{self.base_uri}transactions?{urlencode(next_query)}'
+
+        return {'data': transactions[start:stop], 'links': {'prev': None, 'next': next_link}}
+
+    def list_tags(self) -> dict[str, Any]:
+        """
+        Builds the tags list response from the tags on every transaction.
+
+        Returns:
+            dict: The list of tags.
+        """
+
+        tags = sorted({
+            tag['id']
+            for transaction in self.transactions
+            for tag in transaction['relationships'].get('tags', {}).get('data', [])
+        })
+
+        return {
+            'data': [{'type': 'tags', 'id': tag, 'relationships': {'transactions': {'links': {}}}} for tag in tags],
+            'links': {'prev': None, 'next': None}
+        }
+
+    def create_webhook(self, body: dict[str, Any]) -> dict[str, Any]:
+        """
+        Registers a webhook.
+
+        Params:
+            body: The request body, containing data.attributes.url and optionally
+                data.attributes.description.
+
+        Returns:
+            dict: The created webhook resource, including its secretKey.
+        """
+
+        attributes = body['data']['attributes']
+        webhook = {
+            'type': 'webhooks',
+            'id': str(uuid.uuid4()),
+            'attributes': {
+                'url': attributes['url'],
+                'description': attributes.get('description'),
+                'secretKey': uuid.uuid4().hex,
+                'createdAt': datetime.now().astimezone().isoformat(timespec='seconds')
+            }
+        }
+        self.webhooks[webhook['id']] = webhook
+
+        return {'data': webhook}
+
+    def injected_failure(self) -> int|None:
+        """
+        Decides whether the current request should be rate limited or fail.
+
+        Returns:
+            int|None: The status code to fail with, or None to respond normally.
+        """
+
+        with self._lock:
+            roll = self._rng.random()
+            status = None
+
+            if roll < self.rate_limit:
+                status = 429
+                self.stats['rateLimited'] += 1
+            elif roll < self.rate_limit + self.error_rate:
+                status = self._rng.choice([500, 502, 503])
+                self.stats['errors'] += 1
+
+            delay = max(0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+        time.sleep(delay)
+        return status
+
+    def _handler(self) -> type:
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self, method: str) -> None:
+                api.stats['requests'] += 1
+                url = urlparse(self.path)
+                parts = url.path.removeprefix('/api/v1/').strip('/').split('/')
+                query = parse_qs(url.query)
+
+                failure = api.injected_failure()
+                if failure == 429:
+                    self.send_error_json(429, 'Too Many Requests', {'Retry-After': str(api.retry_after)})
+                    return
+                if failure is not None:
+                    self.send_error_json(failure, 'Server Error')
+                    return
+
+                if method == 'GET' and parts == ['accounts']:
+                    self.send_json(200, api.accounts)
+                elif method == 'GET' and parts == ['transactions']:
+                    self.send_json(200, api.list_transactions(query))
+                elif method == 'GET' and parts[0] == 'transactions' and len(parts) == 2 and parts[1] in api.by_id:
+                    self.send_json(200, {'data': api.by_id[parts[1]]})
+                elif method == 'GET' and parts == ['categories']:
+                    self.send_json(200, api.categories)
+                elif method == 'GET' and parts == ['tags']:
+                    self.send_json(200, api.list_tags())
+                elif method == 'GET' and parts == ['webhooks']:
+                    self.send_json(200, {'data': list(api.webhooks.values()), 'links': {'prev': None, 'next': None}})
+                elif method == 'POST' and parts == ['webhooks']:
+                    self.send_json(201, api.create_webhook(self.read_json()))
+                elif method == 'DELETE' and parts[0] == 'webhooks' and len(parts) == 2 and parts[1] in api.webhooks:
+                    del api.webhooks[parts[1]]
+                    self.send_json(204, None)
+                elif method == 'POST' and parts[0] == 'webhooks' and parts[2:] == ['ping'] and parts[1] in api.webhooks:
+                    self.send_json(201, api.deliver_event('PING'))
+                elif method == 'GET' and parts == ['util', 'ping']:
+                    self.send_json(200, {'meta': {'id': str(uuid.uuid4()), 'statusEmoji': '⚡️'}})
+                else:
+                    self.send_error_json(404, 'Not Found')
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def do_DELETE(self):
+                self.handle_request('DELETE')
+
+            def read_json(self) -> dict[str, Any]:
+                return json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+
+            def send_error_json(self, status: int, title: str, headers: dict[str, str]|None=None) -> None:
+                self.send_json(status, {'errors': [{'status': str(status), 'title': title}]}, headers)
+
+            def send_json(self, status: int, body: dict[str, Any]|None, headers: dict[str, str]|None=None) -> None:
+                data = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+def record_fixture(directory: str, base_uri: str, token: str) -> None:
+    """
+    Records the accounts, categories and every transaction from an Up API into a
+    fixture directory in the format read by synthetic.read_fixture.
+
+    Params:
+        directory: The directory to write to, created if it doesn't exist.
+        base_uri: The base URI of the API, e.g. "https://api.up.com.au/api/v1/".
+        token: The personal access token to authenticate with.
+    """
+
+    def get(url: str) -> dict[str, Any]:
+        request = Request(url, headers={'Authorization': f'Bearer {token}'})
+        with urlopen(request) as response:
+            return json.load(response)
+
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, 'accounts.json'), 'w') as f:
+        json.dump(get(base_uri + 'accounts'), f)
+
+    with open(os.path.join(directory, 'categories.json'), 'w') as f:
+        json.dump(get(base_uri + 'categories'), f)
+
+    with open(os.path.join(directory, 'transactions.jsonl'), 'w') as f:
+        url = f'{base_uri}transactions?page[size]={PAGE_SIZE}'
+        while url is not None:
+            page = get(url)
+            for transaction in page['data']:
+                f.write(json.dumps(transaction) + '\n')
+            url = page['links']['next']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Serve synthetic or recorded data')
+    serve.add_argument('--scale', choices=SCALES, default='10k')
+    serve.add_argument('--seed', type=int, default=0)
+    serve.add_argument('--fixture', help='Directory of a recorded or generated fixture to serve instead')
+    serve.add_argument('--port', type=int, default=8060)
+    serve.add_argument('--latency', type=float, default=0)
+    serve.add_argument('--jitter', type=float, default=0)
+    serve.add_argument('--rate-limit', type=float, default=0)
+    serve.add_argument('--error-rate', type=float, default=0)
+    serve.add_argument('--retry-after', type=int, default=1)
+
+    record = commands.add_parser('record', help='Record a fixture from the real API')
+    record.add_argument('--out', required=True)
+    record.add_argument('--base-uri', default='https://api.up.com.au/api/v1/')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+        from handleSecrets import get_secret
+        record_fixture(args.out, args.base_uri, get_secret('Up', 'PAT'))
+        sys.exit()
+
+    categories = None
+    if args.fixture:
+        accounts, transactions = read_fixture(args.fixture)
+        categories_file = os.path.join(args.fixture, 'categories.json')
+        if os.path.exists(categories_file):
+            with open(categories_file) as f:
+                categories = json.load(f)
+    else:
+        accounts = generate_accounts(args.seed)
+        transactions = list(iter_transactions(SCALES[args.scale], accounts, args.seed))
+
+    server = MockUpAPI(
+        accounts,
+        transactions,
+        categories,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+
+    print(f'Serving {len(transactions)} transactions at {server.base_uri}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
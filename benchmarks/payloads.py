@@ -0,0 +1,147 @@
+"""
+Measures the size of the chart callback responses and the time taken to build
+and serialise them, for increasingly large label sets. Each chart is measured
+as the whole figure sent when the page loads and as the patch sent when a filter
+changes, both uncompressed and gzipped. Run from the root of the repository with:
+
+    python benchmarks/payloads.py --labels 100 1000 10000 50000
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import tempfile
+import time
+import types
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from bench_suite import setup_environment
+
+def income_totals(count: int) -> pd.DataFrame:
+    """
+    Generates the income totals of a number of sources.
+    """
+
+    rng = np.random.default_rng(count)
+
+    return pd.DataFrame({
+        'description': [f'Income source {i}' for i in range(count)],
+        'totalAmount': np.sort(rng.uniform(1, 5000, count).round(2))[::-1]
+    })
+
+def spending_tree(count: int) -> pd.DataFrame:
+    """
+    Generates a sunburst tree with a number of merchants spread over 10 parent
+    categories of 5 categories each.
+    """
+
+    rng = np.random.default_rng(count)
+    parents = [f'parent-{i % 10}' for i in range(50)]
+    categories = [f'category-{i}' for i in range(50)]
+    merchant_categories = rng.integers(0, 50, count)
+
+    merchants = pd.DataFrame({
+        'id': [f'category-{c}/Merchant {i}' for i, c in enumerate(merchant_categories)],
+        'parent': [categories[c] for c in merchant_categories],
+        'label': [f'Merchant {i}' for i in range(count)],
+        'value': rng.uniform(1, 500, count).round(2)
+    })
+    category_values = merchants.groupby('parent')['value'].sum()
+    category_nodes = pd.DataFrame({
+        'id': categories,
+        'parent': parents,
+        'label': categories,
+        'value': category_values.reindex(categories).fillna(0).values
+    })
+    parent_nodes = category_nodes.groupby('parent')['value'].sum().reset_index()
+    parent_nodes = parent_nodes.rename(columns={'parent': 'id'}).assign(parent='', label=lambda df: df['id'])
+
+    return pd.concat([parent_nodes, category_nodes, merchants], ignore_index=True)
+
+def measure(build: Callable[[], Any], output: str, repeat: int=5) -> dict[str, float]:
+    """
+    Measures the response to a callback.
+
+    Params:
+        build: Calls the callback.
+        output: The id of the callback's output component.
+        repeat: The number of times to build and serialise the response.
+
+    Returns:
+        dict: The fastest build, serialise and gzip times in milliseconds and
+            the size of the response in bytes, uncompressed and gzipped.
+    """
+
+    from dash._utils import to_json
+
+    build_times, serialise_times, gzip_times = [], [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = build()
+        build_times.append(time.perf_counter() - start)
+
+        # The same body Dash sends for a single output callback
+        start = time.perf_counter()
+        body = to_json({'multi': True, 'response': {output: {'figure': value}}}).encode()
+        serialise_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        compressed = gzip.compress(body, compresslevel=5)
+        gzip_times.append(time.perf_counter() - start)
+
+    return {
+        'build_ms': min(build_times) * 1000,
+        'serialise_ms': min(serialise_times) * 1000,
+        'gzip_ms': min(gzip_times) * 1000,
+        'bytes': len(body),
+        'gzip_bytes': len(compressed)
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--labels', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    parser.add_argument('--engine', choices=['auto', 'json', 'orjson'], help='Plotly JSON engine to serialise with')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_environment(directory)
+
+        from plotly.io.json import config
+        import dashboard
+
+        if args.engine:
+            config.default_engine = args.engine
+
+        print(f'JSON engine: {config.default_engine}\n')
+        print(
+            f"{'chart':<26} {'labels':>7} {'response':>9} {'build ms':>9} {'json ms':>8} "
+            f"{'bytes':>10} {'gzip ms':>8} {'gzip bytes':>11}"
+        )
+
+        for count in args.labels:
+            income_df, tree_df = income_totals(count), spending_tree(count)
+            dashboard.get_income_totals = lambda *args: income_df
+            dashboard.get_spending_tree = lambda *args: tree_df
+
+            charts = [
+                ('income_pie_chart', 'income-pie-chart', dashboard.income_pie_chart),
+                ('spending_total_sunburst', 'spending-total-sunburst', dashboard.spending_total_sunburst)
+            ]
+            for name, output, chart in charts:
+                # The whole figure is sent on page load, a patch when a filter changes
+                for response, triggered_id in [('figure', None), ('patch', 'year-select')]:
+                    dashboard.callback_context = types.SimpleNamespace(triggered_id=triggered_id)
+                    result = measure(lambda: chart(None, None, None, None, None, 0, None, 'overview', None)[0], output)
+
+                    print(
+                        f"{name:<26} {count:>7} {response:>9} {result['build_ms']:>9.2f} "
+                        f"{result['serialise_ms']:>8.2f} {result['bytes']:>10} "
+                        f"{result['gzip_ms']:>8.2f} {result['gzip_bytes']:>11}"
+                    )
@@ -0,0 +1,120 @@
+"""
+Compares the SQLite and DuckDB query engines on the dashboard aggregations which
+scan the Transactions table, over the whole history and the last year, for
+increasingly long histories. Queries filtered on tags are always run on SQLite
+and are included to show they aren't slowed down. The time taken to export the
+database to Parquet for DuckDB, in full and after a sync which changes the
+newest 100 transactions, is measured too. Run from the root of the repository
+with:
+
+    python benchmarks/query_engines.py --rows 10000 100000 1000000
+
+DuckDB must be installed, e.g. with pip install duckdb.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from bench_suite import reset_database, setup_environment
+from synthetic import generate_accounts, iter_transactions
+
+def best(function: Callable[[], object], repeat: int=3) -> float:
+    """
+    Returns:
+        float: The fastest of repeat calls of function in milliseconds.
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times) * 1000
+
+def use_engine(engine: str) -> None:
+    """
+    Switches the configured query_engine.
+
+    Params:
+        engine: 'sqlite' or 'duckdb'.
+    """
+
+    from config import get_config
+
+    os.environ['QUERY_ENGINE'] = engine
+    get_config.cache_clear()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_environment(directory)
+        os.environ['EXPORT_DIR'] = os.path.join(directory, 'export')
+        use_engine('duckdb')
+
+        import api
+        import database
+        import dashboard
+        import engines
+
+        if not engines.duckdb_enabled():
+            sys.exit('DuckDB is not installed')
+
+        accounts = generate_accounts(0)
+        database.db_init()
+
+        print(f"{'query':<28} {'rows':>9} {'sqlite ms':>10} {'duckdb ms':>10} {'speedup':>8}")
+
+        for rows in args.rows:
+            reset_database()
+            shutil.rmtree(os.environ['EXPORT_DIR'], ignore_errors=True)
+
+            transactions = api.parse_transactions_json({'data': list(iter_transactions(rows, accounts, 0))})
+            database.upsert_accounts(api.parse_accounts_json(accounts))
+            database.upsert_transactions(transactions, True)
+            tags = database.read_database('SELECT tag FROM TransactionTags LIMIT 1')['tag'].tolist()
+
+            # Exports are timed once, as each changes what the next one does
+            start = time.perf_counter()
+            engines.export_tables()
+            full_ms = (time.perf_counter() - start) * 1000
+
+            # A sync mostly changes the newest transactions, e.g. as they settle.
+            # Without their rowHash every row is compared field by field
+            changed = transactions.sort_values('createdAt').tail(100).drop(columns='rowHash')
+            database.upsert_transactions(changed.assign(amount=changed['amount'] - 1), False)
+            start = time.perf_counter()
+            engines.export_tables()
+            incremental_ms = (time.perf_counter() - start) * 1000
+
+            print(f"{'export.full':<28} {rows:>9} {'':>10} {full_ms:>10.2f}")
+            print(f"{'export.incremental_100':<28} {rows:>9} {'':>10} {incremental_ms:>10.2f}")
+
+            min_date, max_date = database.read_database(
+                'SELECT MIN(settledAt), MAX(settledAt) FROM Transactions'
+            ).iloc[0]
+            year_ago = f'{int(max_date[:4]) - 1}{max_date[4:]}'
+            queries = [
+                ('income_by_merchant.all', lambda: dashboard.get_income_by_merchant(min_date, max_date, None)),
+                ('income_by_merchant.year', lambda: dashboard.get_income_by_merchant(year_ago, max_date, None)),
+                ('income_by_merchant.tagged', lambda: dashboard.get_income_by_merchant(min_date, max_date, tags))
+            ]
+
+            for name, query in queries:
+                use_engine('sqlite')
+                sqlite_ms = best(query)
+                use_engine('duckdb')
+                duckdb_ms = best(query)
+
+                print(f"{name:<28} {rows:>9} {sqlite_ms:>10.2f} {duckdb_ms:>10.2f} {sqlite_ms / duckdb_ms:>7.1f}x")
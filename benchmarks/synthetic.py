@@ -0,0 +1,404 @@
+"""
+Seeded generator of synthetic Up banking data. Everything is emitted in the same
+JSON shape as the Up API, so the output can be fed straight into the parsers in
+api.py or served by the mock API server. Write a fixture to disk with:
+
+    python benchmarks/synthetic.py --scale 10k --out fixtures/10k
+"""
+
+import argparse
+import json
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterator
+
+# Number of transactions generated at each named scale
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000
+}
+
+# Number of resources per page, this is the maximum page size of the Up API
+PAGE_SIZE = 100
+
+# All generated timestamps are in Up's local time
+TIMEZONE = timezone(timedelta(hours=10))
+
+# The latest transaction is always at this time so fixtures are reproducible
+END_DATE = datetime(2024, 1, 1, tzinfo=TIMEZONE)
+
+# Up's category hierarchy, parent category -> child categories
+CATEGORIES = {
+    'good-life': ['booze', 'restaurants-and-cafes', 'takeaway', 'games-and-software', 'hobbies', 'events-and-gigs'],
+    'home': ['groceries', 'rent-and-mortgage', 'internet', 'utilities', 'home-maintenance-and-improvements'],
+    'personal': ['clothing-and-accessories', 'health-and-medical', 'fitness-and-wellbeing', 'technology', 'gifts-and-charity'],
+    'transport': ['fuel', 'public-transport', 'car-insurance-and-maintenance', 'taxis-and-share-cars', 'parking']
+}
+
+# Merchants as (description, rawText variants, category, mean amount in cents,
+# days between payments for recurring merchants or None)
+MERCHANTS = [
+    ('Woolworths', ['WOOLWORTHS 1234 SYDNEY', 'WOOLWORTHS/ 88 GEORGE ST', 'WOOLWORTHS METRO 3321'], 'groceries', 6500, None),
+    ('Coles', ['COLES 0456 BRISBANE', 'COLES EXPRESS 1922'], 'groceries', 5500, None),
+    ('Aldi', ['ALDI STORES - MILTON'], 'groceries', 4500, None),
+    ('Netflix', ['NETFLIX.COM', 'Netflix.com LOS GATOS'], 'games-and-software', 1699, 30),
+    ('Spotify', ['Spotify P1A2B3C4D5', 'SPOTIFY STOCKHOLM'], 'games-and-software', 1299, 30),
+    ('Telstra', ['TELSTRA PREPAID'], 'internet', 8000, 30),
+    ('Energy Australia', ['ENERGYAUSTRALIA PTY LTD'], 'utilities', 25000, 91),
+    ('Anytime Fitness', ['ANYTIME FITNESS 223'], 'fitness-and-wellbeing', 2495, 14),
+    ('Shell', ['SHELL COLES EXPRESS 44', 'SHELL 1123 TOOWONG'], 'fuel', 7000, None),
+    ('Translink', ['TRANSLINK GO CARD'], 'public-transport', 3000, None),
+    ('Uber', ['UBER *TRIP', 'UBER   *TRIP HELP.UBER.COM'], 'taxis-and-share-cars', 2500, None),
+    ('Uber Eats', ['UBER *EATS', 'UBER* EATS PENDING'], 'takeaway', 3500, None),
+    ('Dan Murphy\'s', ['DAN MURPHYS 5123'], 'booze', 4500, None),
+    ('The Coffee Club', ['THE COFFEE CLUB QUEEN ST'], 'restaurants-and-cafes', 1200, None),
+    ('Steam', ['STEAM PURCHASE SEATTLE'], 'games-and-software', 4000, None),
+    ('JB Hi-Fi', ['JB HI FI CHERMSIDE'], 'technology', 20000, None),
+    ('Uniqlo', ['UNIQLO AUSTRALIA'], 'clothing-and-accessories', 6000, None),
+    ('Chemist Warehouse', ['CHEMIST WAREHOUSE 412'], 'health-and-medical', 2500, None),
+    ('Ticketek', ['TICKETEK PTY LTD'], 'events-and-gigs', 12000, None),
+    ('Bunnings', ['BUNNINGS 3345'], 'home-maintenance-and-improvements', 5000, None)
+]
+
+# Tags applied to a small share of transactions
+TAGS = ['Holiday', 'Work Expense', 'Shared', 'Gift', 'Tax Deductible']
+
+# Currencies used for foreign transactions
+CURRENCIES = ['USD', 'EUR', 'GBP', 'NZD', 'JPY']
+
+def money(value_in_base_units: int, currency: str='AUD') -> dict[str, Any]:
+    """
+    Builds an Up MoneyObject.
+
+    Params:
+        value_in_base_units: The amount in cents.
+        currency: The ISO 4217 currency code.
+
+    Returns:
+        dict: The MoneyObject.
+    """
+
+    return {
+        'currencyCode': currency,
+        'value': f'{value_in_base_units / 100:.2f}',
+        'valueInBaseUnits': value_in_base_units
+    }
+
+def relationship(resource_type: str, resource_id: str|None) -> dict[str, Any]:
+    """
+    Builds an Up to-one relationship object.
+
+    Params:
+        resource_type: The type of the related resource e.g. 'accounts'.
+        resource_id: The id of the related resource, or None if there is none.
+
+    Returns:
+        dict: The relationship object.
+    """
+
+    if resource_id is None:
+        return {'data': None}
+
+    return {'data': {'type': resource_type, 'id': resource_id}}
+
+def format_time(time: datetime) -> str:
+    """
+    Formats a datetime the way the Up API does, e.g. "2023-04-16T10:00:00+10:00".
+    """
+
+    return time.isoformat(timespec='seconds')
+
+def generate_accounts(seed: int=0) -> dict[str, Any]:
+    """
+    Generates an Up accounts response containing a spending account and several
+    saver accounts, some of which have emojis in their names.
+
+    Params:
+        seed: Seed for the random number generator.
+
+    Returns:
+        dict: The accounts response JSON.
+    """
+
+    rng = random.Random(seed)
+    names = [
+        ('Spending', 'TRANSACTIONAL'),
+        ('\U0001F3E0 House Deposit', 'SAVER'),
+        ('✈️ Travel', 'SAVER'),
+        ('Emergency Fund', 'SAVER'),
+        ('\U0001F4B8 Bills', 'SAVER')
+    ]
+
+    data = []
+    for name, account_type in names:
+        data.append({
+            'type': 'accounts',
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'attributes': {
+                'displayName': name,
+                'accountType': account_type,
+                'ownershipType': 'INDIVIDUAL',
+                'balance': money(rng.randint(0, 5_000_000)),
+                'createdAt': format_time(END_DATE - timedelta(days=5 * 365))
+            },
+            'relationships': {
+                'transactions': {'links': {'related': ''}}
+            },
+            'links': {'self': ''}
+        })
+
+    return {'data': data, 'links': {'prev': None, 'next': None}}
+
+def generate_categories() -> dict[str, Any]:
+    """
+    Generates an Up categories response from CATEGORIES.
+
+    Returns:
+        dict: The categories response JSON.
+    """
+
+    data = []
+    for parent, children in CATEGORIES.items():
+        for category, parent_id in [(parent, None)] + [(child, parent) for child in children]:
+            data.append({
+                'type': 'categories',
+                'id': category,
+                'attributes': {'name': category.replace('-', ' ').title()},
+                'relationships': {
+                    'parent': relationship('categories', parent_id),
+                    'children': {
+                        'data': [
+                            {'type': 'categories', 'id': child}
+                            for child in (children if parent_id is None else [])
+                        ]
+                    }
+                }
+            })
+
+    return {'data': data}
+
+def iter_transactions(count: int, accounts: dict[str, Any], seed: int=0) -> Iterator[dict[str, Any]]:
+    """
+    Generates transaction resources, newest first like the Up API returns them.
+
+    The mix includes card purchases with holds, round ups with boosts, cashback,
+    foreign currency purchases, transfers between accounts, salary, interest,
+    recurring subscriptions and tagged transactions. Roughly 1% are still HELD.
+
+    Params:
+        count: The number of transactions to generate.
+        accounts: An accounts response from generate_accounts.
+        seed: Seed for the random number generator.
+
+    Returns:
+        Iterator: An iterator of transaction resource dictionaries.
+    """
+
+    rng = random.Random(seed)
+    account_ids = [account['id'] for account in accounts['data']]
+    spending_id, saver_ids = account_ids[0], account_ids[1:]
+    parents = {child: parent for parent, children in CATEGORIES.items() for child in children}
+
+    # Spread the transactions evenly back from END_DATE, about 15 per day
+    span = timedelta(days=max(1, count // 15))
+    step = span / count
+    created = END_DATE
+
+    # Recurring merchants are charged on a fixed schedule rather than at random
+    recurring = [merchant for merchant in MERCHANTS if merchant[4] is not None]
+    one_off = [merchant for merchant in MERCHANTS if merchant[4] is None]
+    next_due = {merchant[0]: END_DATE - timedelta(days=rng.randint(0, merchant[4])) for merchant in recurring}
+
+    for i in range(count):
+        created -= step * rng.uniform(0.5, 1.5)
+        kind = rng.random()
+        due = next((merchant for merchant in recurring if created <= next_due[merchant[0]]), None)
+
+        description = None
+        raw_text = None
+        message = None
+        category = None
+        amount = 0
+        account = spending_id
+        transfer_account = None
+        is_categorizable = True
+        hold_info = None
+        round_up = None
+        cashback = None
+        foreign_amount = None
+        card_purchase_method = None
+        tags = []
+
+        if due is not None:
+            merchant, raw_texts, category, mean, period = due
+            next_due[merchant] -= timedelta(days=period)
+            description = merchant
+            raw_text = raw_texts[0]
+            amount = -mean
+        elif kind < 0.03:
+            # Salary, roughly fortnightly at this rate
+            description = 'Employer Pty Ltd'
+            raw_text = 'SALARY EMPLOYER PTY LTD'
+            amount = rng.randint(250_000, 350_000)
+        elif kind < 0.04:
+            description = 'Interest'
+            amount = rng.randint(100, 5_000)
+            account = rng.choice(saver_ids)
+            is_categorizable = False
+        elif kind < 0.12:
+            saver = rng.choice(saver_ids)
+            description = rng.choice(['Transfer to ', 'Quick save transfer to ', 'Auto Transfer to ']) + 'Savings'
+            amount = -rng.randint(1_000, 100_000)
+            transfer_account = saver
+            is_categorizable = False
+        elif kind < 0.15:
+            description = 'Round Up'
+            amount = rng.randint(1, 99)
+            account = rng.choice(saver_ids)
+            is_categorizable = False
+        else:
+            merchant, raw_texts, category, mean, period = rng.choice(one_off)
+            description = merchant
+            raw_text = rng.choice(raw_texts)
+            amount = -max(1, int(rng.gauss(mean, mean / 3)))
+
+        if amount < 0 and is_categorizable:
+            card_purchase_method = {
+                'method': rng.choice(['CARD_PIN', 'CARD_DETAILS', 'CONTACTLESS', 'APPLE_PAY']),
+                'cardNumberSuffix': '1234'
+            }
+
+            if rng.random() < 0.5:
+                hold_info = {'amount': money(amount), 'foreignAmount': None}
+            if rng.random() < 0.3:
+                boost = -rng.randint(1, 50) if rng.random() < 0.2 else None
+                round_up = {
+                    'amount': money(-rng.randint(1, 99) + (boost or 0)),
+                    'boostPortion': money(boost) if boost is not None else None
+                }
+            if rng.random() < 0.02:
+                cashback = {'description': 'Cashback promotion', 'amount': money(rng.randint(100, 1_000))}
+            if rng.random() < 0.03:
+                currency = rng.choice(CURRENCIES)
+                foreign_amount = money(int(amount * rng.uniform(0.5, 1.5)), currency)
+                raw_text += f' {currency}'
+            if rng.random() < 0.05:
+                tags = rng.sample(TAGS, rng.randint(1, 2))
+            if rng.random() < 0.01:
+                message = 'Thanks!'
+
+            # A small share of purchases are never categorised
+            if rng.random() < 0.005:
+                category = None
+
+        status = 'HELD' if i < count // 100 and rng.random() < 0.5 else 'SETTLED'
+        settled = created + timedelta(hours=rng.randint(1, 72))
+
+        yield {
+            'type': 'transactions',
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'attributes': {
+                'status': status,
+                'rawText': raw_text,
+                'description': description,
+                'message': message,
+                'isCategorizable': is_categorizable,
+                'holdInfo': hold_info,
+                'roundUp': round_up,
+                'cashback': cashback,
+                'amount': money(amount),
+                'foreignAmount': foreign_amount,
+                'cardPurchaseMethod': card_purchase_method,
+                'settledAt': format_time(min(settled, END_DATE)) if status == 'SETTLED' else None,
+                'createdAt': format_time(created)
+            },
+            'relationships': {
+                'account': relationship('accounts', account),
+                'transferAccount': relationship('accounts', transfer_account),
+                'category': relationship('categories', category),
+                'parentCategory': relationship('categories', parents.get(category)),
+                'tags': {'data': [{'type': 'tags', 'id': tag} for tag in tags]}
+            },
+            'links': {'self': ''}
+        }
+
+def paginate(resources: Iterator[dict[str, Any]], page_size: int=PAGE_SIZE) -> Iterator[dict[str, Any]]:
+    """
+    Groups resources into Up API list response pages. The next link of each page
+    is a relative "page:<n>" marker which a server should replace with its own URL.
+
+    Params:
+        resources: An iterator of resource dictionaries.
+        page_size: The number of resources per page.
+
+    Returns:
+        Iterator: An iterator of page dictionaries.
+    """
+
+    page = []
+    number = 0
+
+    for resource in resources:
+        page.append(resource)
+        if len(page) == page_size:
+            number += 1
+            yield {'data': page, 'links': {'prev': None, 'next': f'page:{number}'}}
+            page = []
+
+    yield {'data': page, 'links': {'prev': None, 'next': None}}
+
+def write_fixture(directory: str, count: int, seed: int=0) -> None:
+    """
+    Writes accounts.json, categories.json and transactions.jsonl, one
+    transaction resource per line, to a directory.
+
+    Params:
+        directory: The directory to write to, created if it doesn't exist.
+        count: The number of transactions to generate.
+        seed: Seed for the random number generator.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    accounts = generate_accounts(seed)
+
+    with open(os.path.join(directory, 'accounts.json'), 'w') as f:
+        json.dump(accounts, f)
+
+    with open(os.path.join(directory, 'categories.json'), 'w') as f:
+        json.dump(generate_categories(), f)
+
+    with open(os.path.join(directory, 'transactions.jsonl'), 'w') as f:
+        for transaction in iter_transactions(count, accounts, seed):
+            f.write(json.dumps(transaction) + '\n')
+
+def read_fixture(directory: str) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    """
+    Reads a fixture written by write_fixture.
+
+    Params:
+        directory: The directory containing the fixture.
+
+    Returns:
+        accounts: The accounts response JSON.
+        transactions: The list of transaction resources, newest first.
+    """
+
+    with open(os.path.join(directory, 'accounts.json')) as f:
+        accounts = json.load(f)
+
+    with open(os.path.join(directory, 'transactions.jsonl')) as f:
+        transactions = [json.loads(line) for line in f]
+
+    return accounts, transactions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='10k')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    write_fixture(args.out, SCALES[args.scale], args.seed)
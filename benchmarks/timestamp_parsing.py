@@ -0,0 +1,129 @@
+"""
+Compares the timestamp handling in src/timestamps.py with the strptime helpers
+it replaced, which are copied below. Scalars are timed one timestamp at a time
+and columns as a whole, on synthetic transaction timestamps. Run from the root
+of the repository with:
+
+    python benchmarks/timestamp_parsing.py --rows 10000 100000
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from bench_suite import setup_environment
+from synthetic import generate_accounts, iter_transactions
+
+def strptime_add_second(datetime_string: str) -> str:
+    """
+    The add_second helper which was in src/helpers.py.
+    """
+
+    datetime_object = datetime.strptime(datetime_string, "%Y-%m-%dT%H:%M:%S%z")
+    new_datetime_string = (datetime_object + timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%S%z")
+
+    return new_datetime_string[:-2] + ':' + new_datetime_string[-2:]
+
+def strptime_to_datetime(datetime_string: str) -> datetime:
+    """
+    The str_to_datetime helper which was in src/helpers.py.
+    """
+
+    return datetime.strptime(datetime_string, "%Y-%m-%dT%H:%M:%S%z")
+
+def best(function: Callable[[], object], repeat: int=3) -> float:
+    """
+    Returns:
+        float: The fastest of repeat calls of function in milliseconds.
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times) * 1000
+
+def sql_days(conn: sqlite3.Connection, expression: str) -> None:
+    """
+    Groups the settled transactions by day with an SQL expression.
+    """
+
+    conn.execute(f'SELECT {expression} AS day, SUM(amount) FROM Transactions GROUP BY day').fetchall()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_environment(directory)
+
+        import timestamps
+
+        accounts = generate_accounts(0)
+        print(f"Local time zone: {timestamps.get_config().local_tz}\n")
+        print(f"{'operation':<34} {'rows':>8} {'before ms':>10} {'after ms':>9} {'speedup':>8}")
+
+        for rows in args.rows:
+            created = [
+                transaction['attributes']['createdAt']
+                for transaction in iter_transactions(rows, accounts, 0)
+            ]
+            series = pd.Series(created)
+
+            conn = sqlite3.connect(':memory:')
+            timestamps.register_functions(conn)
+            conn.execute('CREATE TABLE Transactions (settledAt TEXT, amount INTEGER)')
+            conn.executemany('INSERT INTO Transactions VALUES (?, 1)', ((value,) for value in created))
+
+            # The parse cache is cleared first so only the repeated timestamps
+            # within a run are served from it
+            def parse_all() -> list:
+                timestamps.parse_timestamp.cache_clear()
+                return [timestamps.parse_timestamp(value) for value in created]
+
+            comparisons = [
+                (
+                    'add a second',
+                    lambda: [strptime_add_second(value) for value in created],
+                    lambda: [timestamps.add_seconds(value) for value in created]
+                ),
+                (
+                    'parse each timestamp',
+                    lambda: [strptime_to_datetime(value) for value in created],
+                    parse_all
+                ),
+                (
+                    'column to epoch days',
+                    lambda: pd.to_datetime(series, utc=True).astype('int64') / 86_400e9,
+                    lambda: timestamps.to_epoch_days(series)
+                ),
+                (
+                    'column to local dates',
+                    lambda: [strptime_to_datetime(value).astimezone().date().isoformat() for value in created],
+                    lambda: timestamps.to_local_dates(series)
+                ),
+                (
+                    'SQL group by local day',
+                    lambda: sql_days(conn, 'date(settledAt, "localtime")'),
+                    lambda: sql_days(conn, timestamps.local_date_sql('settledAt'))
+                )
+            ]
+
+            for name, before, after in comparisons:
+                before_ms, after_ms = best(before), best(after)
+                print(f"{name:<34} {rows:>8} {before_ms:>10.2f} {after_ms:>9.2f} {before_ms / after_ms:>7.1f}x")
+
+            conn.close()
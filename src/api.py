@@ -3,21 +3,54 @@ This file contains the logic for getting all of the data from the Up banking API
 and transforming it to be written to the database.
 """
 
-import requests
+import hashlib
+import json
 import pandas as pd
+import time
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Any
+
+from balances import refresh_daily_balances
+from config import get_config
+from database import (
+    UPDATE_FIELDS,
+    Connection,
+    get_connection,
+    get_sync_state,
+    read_database,
+    refresh_category_totals,
+    refresh_daily_totals,
+    replace_categories,
+    upsert_accounts,
+    upsert_transactions
+)
+from helpers import remove_emojis
+from profiles import DEFAULT_PROFILE, get_pat, get_profile
+from recurring import update_recurring
+from metrics import increment, timer
+from timestamps import add_seconds
+
+# Status codes which mean a request should be retried
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Longest number of seconds to wait before retrying a request
+MAX_BACKOFF = 30
+
+@lru_cache(maxsize=None)
+def get_auth_header(profile: str) -> dict[str, str]:
+    """
+    Gets the Authorization header for the Up API. The PAT is only read from the
+    secrets file the first time the API is used by each profile.
 
-from handleSecrets import *
-from database import *
-from helpers import remove_emojis, add_second
-
-# Base URI for the Up banking API
-BASE_URI = "https://api.up.com.au/api/v1/"
+    Params:
+        profile: The name of the profile whose PAT is used.
 
-# PAT for Up banking API
-PAT = get_secret('Up', 'PAT')
+    Returns:
+        dict: The Authorization header containing the PAT for the Up banking API.
+    """
 
-# Authorization header for Up API
-AUTH_HEADER = {'Authorization': f'Bearer {PAT}'}
+    return {'Authorization': f'Bearer {get_pat(profile)}'}
 
 def parse_accounts_json(res: dict[str, Any]) -> pd.DataFrame:
     """
@@ -55,6 +88,51 @@ def parse_accounts_json(res: dict[str, Any]) -> pd.DataFrame:
             'created'
         ])
 
+# Columns of the DataFrames parsed from transactions, the Transactions table's
+# columns plus the list of tag ids on each transaction
+TRANSACTION_COLUMNS = [
+    'id',
+    'status',
+    'rawText',
+    'description',
+    'message',
+    'isCategorizable',
+    'held',
+    'heldAmount',
+    'roundUpAmount',
+    'boostProportion',
+    'cashbackDesc',
+    'cashbackAmount',
+    'amount',
+    'foreignCurrency',
+    'foreignAmount',
+    'cardPurchaseMethod',
+    'cardNumberSuffix',
+    'settledAt',
+    'createdAt',
+    'account',
+    'transferAccount',
+    'category',
+    'parentCategory',
+    'tags'
+]
+
+def hash_transaction(transaction: dict[str, Any]) -> str:
+    """
+    Hashes the fields of a transaction which can change after it's created, so an
+    unchanged transaction can be recognised without comparing every field.
+
+    Params:
+        transaction: The parsed values of the transaction by column name.
+
+    Returns:
+        str: A 16 character hex digest.
+    """
+
+    values = [transaction[field] for field in UPDATE_FIELDS] + sorted(transaction['tags'])
+
+    return hashlib.blake2b(repr(values).encode(), digest_size=8).hexdigest()
+
 def parse_transactions_json(res: dict[str, Any]) -> pd.DataFrame:
     """
     Parses a JSON containing information about several transactions.
@@ -68,7 +146,8 @@ def parse_transactions_json(res: dict[str, Any]) -> pd.DataFrame:
 
     Returns:
         DataFrame: A pandas DataFrame with the same schema as the Transactions table
-            from the database. This DataFrame contains all of the information
+            from the database, plus a tags column containing the list of tag ids
+            on each transaction. This DataFrame contains all of the information
             extracted from the JSON response.
     """
 
@@ -87,7 +166,7 @@ def parse_transactions_json(res: dict[str, Any]) -> pd.DataFrame:
         transfer_account = transaction['relationships']['transferAccount']['data'] is not None
         has_category = transaction['relationships']['category']['data'] is not None
 
-        transactions.append([
+        row = [
             transaction['id'],
             transaction['attributes']['status'],
             transaction['attributes']['rawText'],
@@ -110,35 +189,12 @@ def parse_transactions_json(res: dict[str, Any]) -> pd.DataFrame:
             transaction['relationships']['account']['data']['id'],
             transaction['relationships']['transferAccount']['data']['id'] if transfer_account else None,
             transaction['relationships']['category']['data']['id'] if has_category else None,
-            transaction['relationships']['parentCategory']['data']['id'] if has_category else None
-        ])
+            transaction['relationships']['parentCategory']['data']['id'] if has_category else None,
+            [tag['id'] for tag in transaction['relationships']['tags']['data']]
+        ]
+        transactions.append(row + [hash_transaction(dict(zip(TRANSACTION_COLUMNS, row)))])
     
-    return pd.DataFrame(transactions, columns=[
-        'id',
-        'status',
-        'rawText',
-        'description',
-        'message',
-        'isCategorizable',
-        'held',
-        'heldAmount',
-        'roundUpAmount',
-        'boostProportion',
-        'cashbackDesc',
-        'cashbackAmount',
-        'amount',
-        'foreignCurrency',
-        'foreignAmount',
-        'cardPurchaseMethod',
-        'cardNumberSuffix',
-        'settledAt',
-        'createdAt',
-        'account',
-        'transferAccount',
-        'category',
-        'parentCategory'
-
-    ])
+    return pd.DataFrame(transactions, columns=TRANSACTION_COLUMNS + ['rowHash'])
 
 def parse_transaction_json(res: dict[str, Any]) -> pd.DataFrame:
     """
@@ -153,7 +209,8 @@ def parse_transaction_json(res: dict[str, Any]) -> pd.DataFrame:
 
     Returns:
         DataFrame: A pandas DataFrame with the same schema as the Transactions table
-            from the database. This DataFrame contains all of the information
+            from the database, plus a tags column containing the list of tag ids
+            on each transaction. This DataFrame contains all of the information
             extracted from the JSON response.
     """
 
@@ -175,7 +232,7 @@ def parse_transaction_json(res: dict[str, Any]) -> pd.DataFrame:
     transfer_account = transaction['relationships']['transferAccount']['data'] is not None
     has_category = transaction['relationships']['category']['data'] is not None
 
-    data.append([
+    row = [
         transaction['id'],
         transaction['attributes']['status'],
         transaction['attributes']['rawText'],
@@ -198,42 +255,98 @@ def parse_transaction_json(res: dict[str, Any]) -> pd.DataFrame:
         transaction['relationships']['account']['data']['id'],
         transaction['relationships']['transferAccount']['data']['id'] if transfer_account else None,
         transaction['relationships']['category']['data']['id'] if has_category else None,
-        transaction['relationships']['parentCategory']['data']['id'] if has_category else None
-    ])
+        transaction['relationships']['parentCategory']['data']['id'] if has_category else None,
+        [tag['id'] for tag in transaction['relationships']['tags']['data']]
+    ]
+    data.append(row + [hash_transaction(dict(zip(TRANSACTION_COLUMNS, row)))])
     
-    return pd.DataFrame(data, columns=[
-        'id',
-        'status',
-        'rawText',
-        'description',
-        'message',
-        'isCategorizable',
-        'held',
-        'heldAmount',
-        'roundUpAmount',
-        'boostProportion',
-        'cashbackDesc',
-        'cashbackAmount',
-        'amount',
-        'foreignCurrency',
-        'foreignAmount',
-        'cardPurchaseMethod',
-        'cardNumberSuffix',
-        'settledAt',
-        'createdAt',
-        'account',
-        'transferAccount',
-        'category',
-        'parentCategory'
-
-    ])
-
-def parse_tags_json(res: dict) -> pd.DataFrame:
+    return pd.DataFrame(data, columns=TRANSACTION_COLUMNS + ['rowHash'])
+
+def parse_categories_json(res: dict[str, Any]) -> pd.DataFrame:
     """
+    Parses the JSON response provided by the Up banking Categories API.
 
+    Params:
+        res: A dictionary representing the JSON response provided by the API.
+
+    Returns:
+        pd.DataFrame: A Pandas DataFrame with the same schema as the Categories
+            table from the database.
     """
 
-    return pd.DataFrame() # ToDo: this method
+    categories = []
+
+    for category in res['data']:
+        parent = category['relationships']['parent']['data']
+
+        categories.append([
+            category['id'],
+            category['attributes']['name'],
+            parent['id'] if parent is not None else None
+        ])
+
+    return pd.DataFrame(categories, columns=['id', 'name', 'parent'])
+
+def parse_tags_json(res: dict[str, Any]) -> pd.DataFrame:
+    """
+    Parses the JSON response provided by the Up banking Tags API. Tags are also
+    included in every transaction, which is how they are normally synced.
+
+    Params:
+        res: A dictionary representing the JSON response provided by the API.
+
+    Returns:
+        pd.DataFrame: A Pandas DataFrame with the same schema as the Tags table.
+    """
+
+    return pd.DataFrame([[tag['id']] for tag in res['data']], columns=['id'])
+
+def request_with_retry(url: str, payload: dict[str, str]):
+    """
+    Makes a GET request to the Up Banking API, retrying with exponential backoff
+    when the API is rate limiting (429), has a server error (5xx) or can't be
+    reached. The Retry-After header is respected when the API sends one.
+
+    Params:
+        url: The URL to request.
+        payload: A dictionary of parameters for the API request.
+
+    Returns:
+        requests.Response: The final response, this may still be an error if the
+            configured number of retries ran out.
+    """
+
+    # Importing requests is slow so it's left until the API is first used
+    import requests
+
+    retries = get_config().api_retries
+
+    # Metrics are recorded per endpoint, with transaction ids removed
+    endpoint = url.removeprefix(get_config().base_uri).split('?')[0]
+    if endpoint.startswith('transactions/'):
+        endpoint = 'transactions/{id}'
+
+    for attempt in range(retries + 1):
+        try:
+            with timer('api_request_seconds', endpoint):
+                response = requests.get(url, headers=get_auth_header(get_profile()), params=payload)
+        except requests.ConnectionError:
+            if attempt == retries:
+                raise
+            increment('api_retries_total', 'connection_error')
+            time.sleep(min(2 ** attempt, MAX_BACKOFF))
+            continue
+
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+
+        increment('api_retries_total', str(response.status_code))
+
+        retry_after = response.headers.get('Retry-After')
+        wait = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+        time.sleep(min(wait, MAX_BACKOFF))
+
+    return response
 
 def get_from_api(endpoint: str, payload: dict[str, str]={}) -> pd.DataFrame | None:
     """
@@ -260,12 +373,12 @@ def get_from_api(endpoint: str, payload: dict[str, str]={}) -> pd.DataFrame | No
             200 or if the provided endpoint is not one of the required values.
     """
 
-    url = BASE_URI+endpoint
+    url = get_config().base_uri+endpoint
     final_table = None
     
     while (url != None):
         # Make a GET request to the API using the URL
-        response = requests.get(url, headers=AUTH_HEADER, params=payload)
+        response = request_with_retry(url, payload)
 
         # API returned an error status code
         if response.status_code != 200:
@@ -306,36 +419,115 @@ def get_from_api(endpoint: str, payload: dict[str, str]={}) -> pd.DataFrame | No
 
     return final_table
 
+def get_pages(endpoint: str, payload: dict[str, str]={}) -> list[dict[str, Any]]:
+    """
+    Makes a GET request to the Up Banking API and follows the pagination links,
+    returning the unparsed response of every page. Unlike get_from_api an error
+    is raised if any request fails, so a partial result is never returned.
+
+    Params:
+        endpoint: The API endpoint that is being queried, without a leading "/".
+        payload: A dictionary of parameters for the first API request.
+
+    Returns:
+        list: The JSON response of each page.
+    """
+
+    url = get_config().base_uri+endpoint
+    pages = []
+
+    while url is not None:
+        response = request_with_retry(url, payload)
+        response.raise_for_status()
+
+        pages.append(response.json())
+
+        # The continuation url already contains the parameters
+        url, payload = pages[-1]['links']['next'], {}
+
+    return pages
+
+def update_categories(conn: Connection|None=None) -> None:
+    """
+    Updates the Categories table from the API. Categories rarely change, so the
+    table is only rewritten when the digest of the response differs from the one
+    recorded the last time it was written.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
+    """
+
+    response = request_with_retry(get_config().base_uri+'categories', {})
+    if response.status_code != 200:
+        print(
+            "There was an error when attempting to get the category information.\n"
+            f"Status: {response.status_code}\n"
+            f"Error: {response.reason}"
+        )
+        return
+
+    res = response.json()
+    digest = hashlib.sha256(json.dumps(res['data'], sort_keys=True).encode()).hexdigest()
 
-def update_dataset() -> None:
+    if digest != get_sync_state('categories-digest', conn):
+        replace_categories(parse_categories_json(res), digest, conn)
+
+def update_dataset(conn: Connection|None=None) -> dict[str, int]:
     """
     Updates the database to contain all of the most recent information available via
     the API.
+
+    Params:
+        conn: The connection to the database to update, defaults to
+            get_connection().
+
+    Returns:
+        dict: The number of transactions inserted, the number updated and the
+            number refetched which hadn't changed, so weren't written.
     """
 
+    # Update category information
+    with timer('sync_phase_seconds', 'categories'):
+        update_categories(conn)
+
     # Update account information
-    accounts = get_from_api('accounts')
-    if accounts is not None:
-        upsert_accounts(accounts)
+    with timer('sync_phase_seconds', 'accounts'):
+        accounts = get_from_api('accounts')
+        if accounts is not None:
+            upsert_accounts(accounts, conn)
 
     # Update transaction information
     # Check to see when the database was last synced and add 1 sec because API filter is inclusive
-    latest_trans_date = add_second(read_database("SELECT MAX(createdAt) FROM Transactions").iloc[0][0])
+    latest_trans_date = add_seconds(
+        read_database("SELECT MAX(createdAt) FROM Transactions", conn=conn, name='latest_transaction').iloc[0][0]
+    )
     
     if latest_trans_date is None: # If the database is empty
         latest_trans_date = "1900-01-01T00:00:00+10:00"
 
-    transactions = get_from_api(
-        'transactions',
-        {'filter[since]': latest_trans_date}
-    )
+    with timer('sync_phase_seconds', 'new_transactions'):
+        transactions = get_from_api(
+            'transactions',
+            {'filter[since]': latest_trans_date}
+        )
 
-    if transactions is not None and not transactions.empty:
-        upsert_transactions(transactions, True)
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        if transactions is not None and not transactions.empty:
+            stats['inserted'] = len(upsert_transactions(transactions, True, conn))
+
+    # Transactions inserted or updated by this sync
+    upserted = [transactions] if transactions is not None else []
+
+    # Older uncategorised spending is left to the reconciliation, rather than
+    # being refetched on every sync
+    recheck_days = get_config().category_recheck_days
+    recheck_since = ''
+    if recheck_days > 0:
+        recheck_since = str(date.fromisoformat(latest_trans_date[:10]) - timedelta(days=recheck_days))
 
     # Get all transactions that may have changed/updated
     change_ids = read_database(
-        f'''
+        '''
         SELECT id 
         FROM Transactions 
         WHERE (
@@ -343,6 +535,8 @@ def update_dataset() -> None:
                 OR (
                     amount < 0
                     AND category IS NULL
+                    AND isCategorizable = 1
+                    AND createdAt >= ?
                     AND id NOT IN (
                         SELECT id
                         FROM Transactions
@@ -356,33 +550,86 @@ def update_dataset() -> None:
                     )
                 )
             )
-            AND createdAt < "{latest_trans_date}"
-        '''
+            AND createdAt < ?
+        ''',
+        params=[recheck_since, latest_trans_date],
+        conn=conn,
+        name='changed_transaction_ids'
     )
 
-    for i, row in change_ids.iterrows():
-        change_trans = get_from_api(f"transactions/{row['id']}")
-
-        if change_trans is not None:
-            upsert_transactions(change_trans, False)
-
-    # ToDo: Update tag information
-
-def tables_to_csv() -> None:
+    with timer('sync_phase_seconds', 'changed_transactions'):
+        changed = []
+        for i, row in change_ids.iterrows():
+            change_trans = get_from_api(f"transactions/{row['id']}")
+
+            if change_trans is not None:
+                changed.append(change_trans)
+
+        # Written in one batch so the changes are compared and logged together,
+        # transactions which haven't changed are skipped
+        if changed:
+            changed = pd.concat(changed, ignore_index=True)
+            written = upsert_transactions(changed, False, conn)
+            stats['updated'] = len(written)
+            stats['unchanged'] = len(changed) - len(written)
+            upserted.append(changed[changed['id'].isin(written)])
+
+    # Only the days on which a transaction settled during this sync can have
+    # changed, a day of margin is left for the conversion to local time
+    settled = pd.concat(upserted)['settledAt'].dropna() if upserted else pd.Series(dtype=str)
+    since = str(date.fromisoformat(settled.min()[:10]) - timedelta(days=1)) if not settled.empty else str(date.today())
+
+    # The daily tables are keyed on days in the configured local_tz, so they're
+    # rebuilt in full when it changes
+    local_tz = get_config().local_tz
+    full = get_sync_state('local-tz', conn) != local_tz
+    if full:
+        since = None
+
+    # Rebuild the daily pre-aggregations used by the charts
+    with timer('sync_phase_seconds', 'daily_totals'):
+        refresh_daily_totals(since, conn)
+        refresh_category_totals(since, conn)
+
+    # Extend the balance history of each account
+    with timer('sync_phase_seconds', 'daily_balances'):
+        refresh_daily_balances(full, conn)
+
+    if full:
+        conn = conn or get_connection()
+        with conn.write_lock:
+            conn.execute('INSERT OR REPLACE INTO SyncState (key, value) VALUES ("local-tz", ?)', (local_tz,))
+            conn.commit()
+
+    # Add the new spending to the recurring payment statistics
+    with timer('sync_phase_seconds', 'recurring'):
+        update_recurring(conn=conn)
+
+    return stats
+
+def tables_to_csv(conn: Connection|None=None) -> None:
     """
     Writes all the tables in the database to separate .csv files, this is primarily
-    intended for debugging purposes.
+    intended for debugging purposes. The files of a profile other than the
+    default one have the profile's name appended.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
     """
 
+    suffix = '' if get_profile() == DEFAULT_PROFILE else f'-{get_profile()}'
+
     # Accounts
-    accounts_df = read_database('SELECT * FROM Accounts')
-    accounts_df.to_csv('./data/accounts.csv', index=False)
+    accounts_df = read_database('SELECT * FROM Accounts', conn=conn)
+    accounts_df.to_csv(f'./data/accounts{suffix}.csv', index=False)
 
     # Transactions
-    transactions_df = read_database('SELECT * FROM Transactions ORDER BY createdAt DESC')
-    transactions_df.to_csv('./data/transactions.csv', index=False)
+    transactions_df = read_database('SELECT * FROM Transactions ORDER BY createdAt DESC', conn=conn)
+    transactions_df.to_csv(f'./data/transactions{suffix}.csv', index=False)
 
-    # ToDo: Tags
+    # Tags
+    tags_df = read_database('SELECT * FROM TransactionTags ORDER BY tag', conn=conn)
+    tags_df.to_csv(f'./data/tags{suffix}.csv', index=False)
 
 
 # Get access token
@@ -5,18 +5,93 @@ Date: 16/04/2023
 Main file for FinanceTracker application, code should always be run from here.
 """
 
+import gzip
+import os
+import sys
+
 from dash import Dash
+from flask import Response, jsonify, request
 
 from database import db_init
-from api import update_dataset, tables_to_csv
 from dashboard import get_layout
+from metrics import render_metrics
+from scheduler import SCHEDULER
 
-if __name__ == '__main__':
+# Smallest response which is compressed, and the gzip level responses are
+# compressed with
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 5
+
+def compress_response(response: Response) -> Response:
+    """
+    Compresses a JSON response, such as a callback response, with gzip when the
+    browser accepts it. Figure payloads are mostly repeated keys and labels so
+    they compress to a fraction of their size.
+
+    Params:
+        response: The response to the request.
+
+    Returns:
+        Response: The response, compressed if it's worth compressing.
+    """
+
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.mimetype != 'application/json'
+        or 'Content-Encoding' in response.headers
+        or 'gzip' not in request.headers.get('Accept-Encoding', '')
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+def create_app() -> Dash:
+    """
+    Creates the Dash application. The sync scheduler is not started, this is left
+    to whatever is serving the app so that only one process ever syncs.
+
+    Returns:
+        Dash: The dashboard application.
+    """
 
     db_init()
-    update_dataset()
-    tables_to_csv()
 
     app = Dash(__name__)
     app.layout = get_layout
-    app.run_server(debug=True)
\ No newline at end of file
+    app.server.after_request(compress_response)
+
+    @app.server.route('/sync-status')
+    def sync_status():
+        return jsonify(SCHEDULER.status())
+
+    @app.server.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    return app
+
+if __name__ == '__main__':
+
+    # Report the import time of each module instead of running the app
+    if '--profile-startup' in sys.argv:
+        from profiling import print_import_profile
+        print_import_profile()
+        sys.exit()
+
+    app = create_app()
+
+    # When debugging the reloader runs this file in a parent and a child process,
+    # only the child which serves the app should sync
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        SCHEDULER.start()
+
+    app.run_server(debug=True)
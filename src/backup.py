@@ -0,0 +1,215 @@
+"""
+This file contains the backups of the database. Snapshots are taken with
+SQLite's online backup API a few pages at a time, so the app keeps running while
+the database is copied. Each step holds the write lock of the connection being
+backed up, and the lock is released and the thread sleeps between steps, so a
+sync is never held up for more than one step. The backup is taken through the
+app's own connection, so anything it writes during the backup is copied too
+rather than restarting the backup.
+
+Snapshots are compressed with gzip, written to the configured backup_dir and
+only the newest backup_keep of each profile are kept. Take a snapshot or restore
+one from the root of the repository with:
+
+    python src/backup.py
+    python src/backup.py --restore backups/finance-20240101T000000.db.gz
+    python src/backup.py --profile alice
+"""
+
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+from config import get_config
+from database import Connection, get_connection
+from metrics import enabled, increment, observe, timer
+from profiles import DEFAULT_PROFILE, get_db_file, use_profile
+
+# Number of pages copied in each step of a backup, and seconds slept between steps
+STEP_PAGES = 256
+STEP_SLEEP = 0.005
+
+def list_backups() -> list[str]:
+    """
+    Gets the snapshots of the current profile's database in the configured
+    backup_dir.
+
+    Returns:
+        list: The paths of the snapshots, oldest first.
+    """
+
+    backup_dir = get_config().backup_dir
+    if not os.path.isdir(backup_dir):
+        return []
+
+    stem = os.path.splitext(os.path.basename(get_db_file()))[0]
+
+    # The timestamp in each name sorts them by age, which also tells them apart
+    # from the snapshots of other profiles whose names start the same way
+    return sorted(
+        os.path.join(backup_dir, name)
+        for name in os.listdir(backup_dir)
+        if re.fullmatch(rf'{re.escape(stem)}-\d{{8}}T\d{{6}}\.db\.gz', name)
+    )
+
+def copy_database(source: sqlite3.Connection, target: sqlite3.Connection) -> None:
+    """
+    Copies one database into another with the online backup API, STEP_PAGES at a
+    time. The write lock of the source is held during each step and released
+    between them.
+
+    Params:
+        source: The connection to copy from.
+        target: The connection to copy into, its contents are replaced.
+    """
+
+    lock = getattr(source, 'write_lock', None)
+    acquired = time.perf_counter()
+    left = None
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal acquired, left
+
+        if enabled():
+            observe('backup_step_seconds', 'write_lock_held', time.perf_counter() - acquired)
+            increment('backup_pages_total', 'copied', (total if left is None else left) - remaining)
+        left = remaining
+
+        if lock is not None and remaining > 0:
+            lock.release()
+            time.sleep(STEP_SLEEP)
+            lock.acquire()
+
+        acquired = time.perf_counter()
+
+    if lock is None:
+        source.backup(target, pages=STEP_PAGES, progress=progress)
+        return
+
+    with lock:
+        acquired = time.perf_counter()
+        source.backup(target, pages=STEP_PAGES, progress=progress)
+
+def backup(conn: Connection|None=None) -> str:
+    """
+    Takes a compressed snapshot of the database in the configured backup_dir,
+    then deletes all but the newest backup_keep snapshots.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        str: The path of the snapshot.
+    """
+
+    config = get_config()
+    conn = conn or get_connection()
+
+    os.makedirs(config.backup_dir, exist_ok=True)
+
+    stem = os.path.splitext(os.path.basename(get_db_file()))[0]
+    path = os.path.join(config.backup_dir, f"{stem}-{datetime.now().strftime('%Y%m%dT%H%M%S')}.db.gz")
+
+    with timer('backup_seconds', 'snapshot'):
+        # The uncompressed copy is made next to the snapshot, then compressed
+        # into a temporary file which is renamed, so a snapshot is never partial
+        fd, copy_path = tempfile.mkstemp(suffix='.db', dir=config.backup_dir)
+        os.close(fd)
+        try:
+            target = sqlite3.connect(copy_path)
+            try:
+                copy_database(conn, target)
+            finally:
+                target.close()
+
+            with timer('backup_seconds', 'compress'):
+                with open(copy_path, 'rb') as src, gzip.open(f'{path}.partial', 'wb', compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(f'{path}.partial', path)
+        finally:
+            os.remove(copy_path)
+
+    for old in list_backups()[:-max(config.backup_keep, 1)]:
+        os.remove(old)
+
+    return path
+
+def backup_due() -> bool:
+    """
+    Checks whether the configured backup_interval has passed since the newest
+    snapshot was taken.
+
+    Returns:
+        bool: Whether a snapshot should be taken.
+    """
+
+    interval = get_config().backup_interval
+    if interval <= 0:
+        return False
+
+    backups = list_backups()
+    if not backups:
+        return True
+
+    return time.time() - os.path.getmtime(backups[-1]) >= interval
+
+def restore(path: str, database: str|None=None) -> None:
+    """
+    Replaces a database with a snapshot. The snapshot is checked for corruption
+    first and the database is left untouched if it's corrupt. The app should be
+    stopped while a database is restored.
+
+    Params:
+        path: The path of the snapshot.
+        database: The database file to restore into, defaults to the current
+            profile's database.
+
+    Raises:
+        sqlite3.DatabaseError: If the snapshot isn't a database.
+        ValueError: If the snapshot fails SQLite's integrity check.
+    """
+
+    database = database or get_db_file()
+
+    fd, copy_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(database)))
+    os.close(fd)
+    try:
+        with gzip.open(path, 'rb') as src, open(copy_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        source = sqlite3.connect(copy_path)
+        try:
+            result = source.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                raise ValueError(f'{path} is corrupt: {result}')
+
+            target = sqlite3.connect(database)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    finally:
+        os.remove(copy_path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--restore', metavar='SNAPSHOT', help='Restore the database from a snapshot')
+    parser.add_argument('--list', action='store_true', help='List the snapshots, oldest first')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, help='Profile whose database is used')
+    args = parser.parse_args()
+
+    with use_profile(args.profile):
+        if args.list:
+            print('\n'.join(list_backups()))
+        elif args.restore:
+            restore(args.restore)
+        else:
+            print(backup())
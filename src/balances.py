@@ -0,0 +1,239 @@
+"""
+This file contains the engine which reconstructs the daily balance history of
+every account. The API only provides the current balance of each account, so the
+history is worked out by walking the settled transactions backwards from it: the
+balance at the end of a day is the current balance minus everything that settled
+after that day.
+
+The result is stored in the DailyBalances table, which has a row for every day
+on which an account's balance changed. After each sync only the days since the
+last stored day are rebuilt.
+"""
+
+import pandas as pd
+from datetime import date, timedelta
+
+from database import Connection, get_connection, read_database
+from profiles import merge_profiles
+from timestamps import local_date_sql
+
+def get_settled_balances(conn: Connection|None=None) -> pd.Series:
+    """
+    Gets the settled balance of every account. The balance from the API already
+    includes held transactions, which have no settled date, so they are removed.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        pd.Series: The settled balance of each account in cents, indexed by
+            account id.
+    """
+
+    balances_df = read_database(
+        '''
+        SELECT Accounts.id AS account,
+            Accounts.balance - COALESCE(Held.amount, 0) AS balance
+        FROM Accounts
+        LEFT JOIN (
+            SELECT account, SUM(amount) AS amount
+            FROM Transactions
+            WHERE status = "HELD"
+            GROUP BY account
+        ) AS Held
+            ON Held.account = Accounts.id
+        ''',
+        conn=conn,
+        name='settled_balances'
+    )
+
+    return balances_df.set_index('account')['balance']
+
+def reconstruct_balances(
+    since: str|None=None,
+    settled: pd.Series|None=None,
+    conn: Connection|None=None
+) -> pd.DataFrame:
+    """
+    Reconstructs the end of day balance of every account on each day, on or
+    after since, that it had a settled transaction. Only transactions settled on
+    or after since are read.
+
+    Params:
+        since: A string in "YYYY-MM-DD" format, defaults to the whole history.
+        settled: The settled balance of each account, defaults to
+            get_settled_balances().
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        pd.DataFrame: A DataFrame with account, day, net and balance columns,
+            where net is the total settled on the day and balance is the balance
+            at the end of the day in cents.
+    """
+
+    # settledAt is compared as a string first, with a day of margin for time
+    # zones, so the settledAt index can skip most of the table
+    earliest = ''
+    if since is not None:
+        earliest = (date.fromisoformat(since) - timedelta(days=1)).isoformat()
+
+    since = since or ''
+
+    daily_df = read_database(
+        f'''
+        SELECT account, {local_date_sql('settledAt')} AS day, SUM(amount) AS net
+        FROM Transactions
+        WHERE status = "SETTLED"
+            AND settledAt >= ?
+            AND {local_date_sql('settledAt')} >= ?
+        GROUP BY account, day
+        ORDER BY account, day
+        ''',
+        params=[earliest, since],
+        conn=conn,
+        name='daily_account_totals'
+    )
+
+    # The balance at the end of a day is the current balance less the total of
+    # every later day, i.e. the current balance - total + running total
+    if settled is None:
+        settled = get_settled_balances(conn)
+
+    anchors = daily_df['account'].map(settled)
+    by_account = daily_df.groupby('account')['net']
+    daily_df['balance'] = anchors - by_account.transform('sum') + by_account.cumsum()
+
+    # Transactions of accounts which no longer exist can't be anchored
+    return daily_df.dropna(subset=['balance']).astype({'balance': 'int64'})
+
+def refresh_daily_balances(full: bool=False, conn: Connection|None=None) -> None:
+    """
+    Brings the DailyBalances table up to date. The days from the last stored day
+    onwards are rebuilt, unless the balances before then no longer agree with
+    the current balances, e.g. when a transaction settled on an earlier day was
+    synced late, in which case the whole table is rebuilt.
+
+    Params:
+        full: Whether to rebuild the whole table regardless.
+        conn: The connection to the database, defaults to get_connection().
+    """
+
+    conn = conn or get_connection()
+
+    since = None
+    if not full:
+        since = read_database(
+            'SELECT MAX(day) FROM DailyBalances', conn=conn, name='last_balance_day'
+        ).iloc[0][0]
+
+    settled = get_settled_balances(conn)
+    balances_df = reconstruct_balances(since, settled, conn)
+
+    if since is not None:
+        # The balance each account had going into since, according to the stored
+        # history and according to the current balance
+        stored = read_database(
+            '''
+            SELECT account, balance, MAX(day)
+            FROM DailyBalances
+            WHERE day < ?
+            GROUP BY account
+            ''',
+            params=[since],
+            conn=conn,
+            name='opening_balances'
+        ).set_index('account')['balance']
+
+        # Accounts with nothing settled since then went in with their current balance
+        opening = (balances_df['balance'] - balances_df['net']).groupby(balances_df['account']).first()
+        opening = opening.reindex(stored.index).fillna(settled)
+
+        if not opening.astype('int64').equals(stored.astype('int64')):
+            return refresh_daily_balances(True, conn)
+
+    with conn.write_lock:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM DailyBalances WHERE day >= ?', (since or '0000-00-00',))
+        cur.executemany(
+            'INSERT INTO DailyBalances (account, day, balance) VALUES (?, ?, ?)',
+            balances_df[['account', 'day', 'balance']].itertuples(index=False, name=None)
+        )
+        conn.commit()
+        cur.close()
+
+def merge_balance_histories(results: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Merges the get_balance_history of several profiles.
+
+    Params:
+        results: The balance history of each profile, over the same days.
+
+    Returns:
+        pd.DataFrame: The balances of every account of every profile, with the
+            name of the profile in front of each account's name.
+    """
+
+    return pd.concat(
+        [history_df.add_prefix(f'{profile}: ') for profile, history_df in results.items()],
+        axis=1
+    )
+
+@merge_profiles(merge_balance_histories)
+def get_balance_history(min_date: date|str|None, max_date: date|str|None, conn: Connection|None=None) -> pd.DataFrame:
+    """
+    Gets the end of day balance of every account for each day in a date range.
+
+    Params:
+        min_date: The first day of the range.
+        max_date: The last day of the range.
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        pd.DataFrame: A DataFrame indexed by day with a column of balances in
+            dollars for each account, named by the account's display name.
+            Empty if either date is None, e.g. before the first sync.
+    """
+
+    if min_date is None or max_date is None:
+        return pd.DataFrame(index=pd.DatetimeIndex([]))
+
+    min_date, max_date = str(min_date), str(max_date)
+
+    # The balance each account went into the range with, then the changes within it
+    history_df = read_database(
+        '''
+        SELECT account, ? AS day, balance
+        FROM (
+            SELECT account, balance, MAX(day)
+            FROM DailyBalances
+            WHERE day < ?
+            GROUP BY account
+        )
+        UNION ALL
+        SELECT account, day, balance
+        FROM DailyBalances
+        WHERE day BETWEEN ? AND ?
+        ''',
+        params=[min_date, min_date, min_date, max_date],
+        conn=conn,
+        name='balance_history'
+    )
+
+    names = read_database(
+        'SELECT id, displayName FROM Accounts', conn=conn, name='account_names'
+    ).set_index('id')['displayName']
+
+    days = pd.date_range(min_date, max_date, freq='D')
+    if history_df.empty:
+        return pd.DataFrame(index=days)
+
+    history_df['day'] = pd.to_datetime(history_df['day'])
+    balances_df = (
+        history_df.pivot_table(index='day', columns='account', values='balance', aggfunc='last')
+        .reindex(days)
+        .ffill()
+        .fillna(0)
+        / 100
+    )
+
+    return balances_df.rename(columns=names)
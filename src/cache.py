@@ -0,0 +1,127 @@
+"""
+This file contains a small key value cache backed by an SQLite3 file. Unlike an
+in-memory cache it is shared by every process serving the dashboard, so a
+result computed by one worker can be reused by all the others.
+"""
+
+import os
+import pickle
+import sqlite3
+import time
+from functools import wraps
+from threading import local
+from typing import Any, Callable
+
+from config import get_config
+from profiles import get_profile
+
+# Connections are per thread so workers and their threads never share one
+_CONNECTIONS = local()
+
+def get_cache_connection() -> sqlite3.Connection:
+    """
+    Gets the calling thread's connection to the cache, creating the connection
+    and the cache table if needed.
+
+    Returns:
+        sqlite3.Connection: A connection to the configured cache file.
+    """
+
+    conn = getattr(_CONNECTIONS, 'conn', None)
+    if conn is None or _CONNECTIONS.pid != os.getpid():
+        conn = sqlite3.connect(get_config().cache_file, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS Cache (
+                key TEXT,
+                value BLOB,
+                expires REAL,
+                PRIMARY KEY (key)
+            )
+            '''
+        )
+        conn.commit()
+        _CONNECTIONS.conn = conn
+        _CONNECTIONS.pid = os.getpid()
+
+    return conn
+
+def cache_get(key: str, default: Any=None) -> Any:
+    """
+    Gets a value from the cache.
+
+    Params:
+        key: The key the value was stored under.
+        default: The value to return if the key isn't in the cache or has expired.
+
+    Returns:
+        Any: The cached value or default.
+    """
+
+    row = get_cache_connection().execute(
+        'SELECT value, expires FROM Cache WHERE key = ?',
+        (key,)
+    ).fetchone()
+
+    if row is None or row[1] < time.time():
+        return default
+
+    return pickle.loads(row[0])
+
+def cache_set(key: str, value: Any, timeout: float|None=None) -> None:
+    """
+    Stores a value in the cache, replacing any value already stored under the key.
+
+    Params:
+        key: The key to store the value under.
+        value: Any picklable value.
+        timeout: The number of seconds until the value expires, defaults to
+            the configured cache_timeout.
+    """
+
+    timeout = get_config().cache_timeout if timeout is None else timeout
+
+    conn = get_cache_connection()
+    conn.execute(
+        'INSERT OR REPLACE INTO Cache (key, value, expires) VALUES (?, ?, ?)',
+        (key, pickle.dumps(value), time.time() + timeout)
+    )
+    conn.execute('DELETE FROM Cache WHERE expires < ?', (time.time(),))
+    conn.commit()
+
+def memoize(timeout: float|None=None) -> Callable:
+    """
+    Decorator which caches the return value of a function in the shared cache.
+    The cache key is made from the current profile, the function name and the
+    repr of its arguments, so every argument must have a stable repr.
+
+    Params:
+        timeout: The number of seconds results are cached for, defaults to
+            the configured cache_timeout. If this is 0 the function is never
+            cached.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            func_timeout = get_config().cache_timeout if timeout is None else timeout
+            if func_timeout <= 0:
+                return func(*args, **kwargs)
+
+            key = f'{get_profile()}:{func.__module__}.{func.__name__}:{args!r}:{sorted(kwargs.items())!r}'
+            missing = object()
+
+            value = cache_get(key, missing)
+            if value is missing:
+                value = func(*args, **kwargs)
+                cache_set(key, value, func_timeout)
+
+            return value
+
+        return wrapper
+
+    return decorator
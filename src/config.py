@@ -0,0 +1,104 @@
+"""
+This file contains the configuration of the application. Settings are read from
+environment variables once, the first time the configuration is needed.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+@dataclass(frozen=True)
+class Config:
+    """
+    The application settings, see the readme for a description of each one.
+    """
+
+    # SQLite3 database file name
+    db_file: str
+
+    # File containing the application secrets
+    secrets_file: str
+
+    # SQLite3 file of the cache shared by all processes
+    cache_file: str
+
+    # Default number of seconds an entry stays in the cache, 0 disables the cache
+    cache_timeout: float
+
+    # Base URI of the Up banking API, this can point at a mock of the API
+    base_uri: str
+
+    # Number of times a request to the API is retried after a 429, 5xx or
+    # connection error
+    api_retries: int
+
+    # Number of seconds between syncs with the API and the maximum random jitter
+    sync_interval: float
+    sync_jitter: float
+
+    # Number of profiles synced at the same time
+    sync_workers: int
+
+    # Number of days before the latest transaction in which uncategorised
+    # spending is refetched by each sync, 0 refetches all of it
+    category_recheck_days: int
+
+    # Number of seconds between reconciliations of every month with the API,
+    # 0 disables them
+    reconcile_interval: float
+
+    # Directory snapshots of the database are written to, the number of seconds
+    # between snapshots, 0 disables them, and the number of snapshots kept
+    backup_dir: str
+    backup_interval: float
+    backup_keep: int
+
+    # IANA time zone transactions are grouped into days in, e.g. the day a
+    # transaction settled on
+    local_tz: str
+
+    # Engine aggregations over the transactions are run on, 'sqlite' or
+    # 'duckdb', and the directory the Parquet export read by DuckDB is written to
+    query_engine: str
+    export_dir: str
+
+    # Whether query, callback, API and sync latencies are recorded for /metrics
+    metrics_enabled: bool
+
+    # Queries taking at least this many milliseconds are logged as slow and
+    # whether their query plan is captured
+    slow_query_ms: float
+    explain_slow_queries: bool
+
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    """
+    Gets the application configuration. The environment is only read on the
+    first call, every later call returns the same object.
+
+    Returns:
+        Config: The application configuration.
+    """
+
+    return Config(
+        db_file=os.environ.get('DB_FILE', 'finance.db'),
+        secrets_file=os.environ.get('SECRETS_FILE', './src/secrets.json'),
+        cache_file=os.environ.get('CACHE_FILE', 'cache.db'),
+        cache_timeout=float(os.environ.get('CACHE_TIMEOUT', 60 * 60)),
+        base_uri=os.environ.get('UP_BASE_URI', 'https://api.up.com.au/api/v1/'),
+        api_retries=int(os.environ.get('API_RETRIES', 5)),
+        sync_interval=float(os.environ.get('SYNC_INTERVAL', 15 * 60)),
+        sync_jitter=float(os.environ.get('SYNC_JITTER', 60)),
+        sync_workers=int(os.environ.get('SYNC_WORKERS', 4)),
+        category_recheck_days=int(os.environ.get('CATEGORY_RECHECK_DAYS', 14)),
+        reconcile_interval=float(os.environ.get('RECONCILE_INTERVAL', 7 * 24 * 60 * 60)),
+        backup_dir=os.environ.get('BACKUP_DIR', './backups'),
+        backup_interval=float(os.environ.get('BACKUP_INTERVAL', 24 * 60 * 60)),
+        backup_keep=int(os.environ.get('BACKUP_KEEP', 7)),
+        local_tz=os.environ.get('LOCAL_TZ', 'Australia/Brisbane'),
+        query_engine=os.environ.get('QUERY_ENGINE', 'sqlite').lower(),
+        export_dir=os.environ.get('EXPORT_DIR', './export'),
+        metrics_enabled=os.environ.get('METRICS', '0').lower() in ('1', 'true', 'yes'),
+        slow_query_ms=float(os.environ.get('SLOW_QUERY_MS', 100)),
+        explain_slow_queries=os.environ.get('EXPLAIN_SLOW_QUERIES', '0').lower() in ('1', 'true', 'yes')
+    )
@@ -2,17 +2,38 @@
 This file contains the logic for building the dash app and creating the dashboard.
 """
 
-import plotly.express as px
+import json
 import pandas as pd
+from functools import wraps
+from typing import Any, Callable
 
-from dash import html, callback, dcc, Input, Output
-from datetime import date
+from dash import html, callback, callback_context, clientside_callback, dash_table, dcc, no_update, Input, Output, Patch, State
+from dash.exceptions import PreventUpdate
 from plotly import graph_objects as go
-from typing import Callable
 
-from database import read_database
-from helpers import *
-from charts import *
+from balances import get_balance_history
+from cache import memoize
+from database import INCOME_CONDITION, SPENDING_CONDITION, read_database
+from engines import read_aggregate
+from helpers import (
+    build_sunburst_tree,
+    compare_periods,
+    get_comparison_periods,
+    get_date_bounds,
+    get_min_and_max_dates,
+    get_select_month,
+    get_select_tags,
+    get_select_years,
+    get_tag_filter,
+    lttb_downsample,
+    lttb_indices,
+    parse_table_filter
+)
+from metrics import increment, instrument_callback
+from profiles import ALL_PROFILES, DEFAULT_PROFILE, add_frames, get_profile, list_profiles, merge_profiles, use_profile
+from recurring import get_recurring_series
+from scheduler import SCHEDULER
+from timestamps import local_date_sql
 
 COLORS = {
     'bg-1': '#0c0c0c',
@@ -21,20 +42,65 @@ COLORS = {
     'text-1': '#ddd'
 }
 
-# ToDo remove this or move to helpers.py
-def create_table(df: pd.DataFrame, max_rows: int=10) -> html.Table:
-    """
+# Maximum number of points per trace sent to the browser by time-series charts
+MAX_CHART_POINTS = 500
 
-    """
+# Maximum number of merchants shown under each category of the spending sunburst
+MAX_SUNBURST_MERCHANTS = 15
 
-    return html.Table([
-        html.Thead(html.Tr([html.Th(col) for col in df.columns])),
-        html.Tbody([
-            html.Tr([
-                html.Td(df.iloc[i][col]) for col in df.columns
-            ]) for i in range(min(len(df), max_rows))
-        ])
-    ])
+# Milliseconds between each check of the sync scheduler for new data
+SYNC_POLL_INTERVAL = 30 * 1000
+
+# Number of rows per page of the transactions table
+TABLE_PAGE_SIZE = 100
+
+# Columns of the transactions table mapped to the SQL expression that produces
+# them, only these columns can be sorted and filtered on
+TABLE_COLUMNS = {
+    'createdAt': 'createdAt',
+    'description': 'description',
+    'amount': 'amount / 100.0',
+    'status': 'status',
+    'message': 'message',
+    'category': 'category'
+}
+
+# Tabs of the dashboard and the components in each, a component's callback only
+# runs while its tab is selected
+PANELS = {
+    'overview': ['income-pie-chart', 'spending-total-sunburst'],
+    'trends': ['cashflow-time-series', 'net-worth-time-series'],
+    'recurring': ['recurring-table'],
+    'transactions': ['transactions-table'],
+    'compare': ['comparison-chart', 'comparison-table']
+}
+
+# Style of the container of each tab's components
+PANEL_STYLE = {
+    'display': 'flex',
+    'flex-wrap': 'wrap',
+    'align-items': 'center',
+    'justify-content': 'space-evenly'
+}
+
+# SQL expressions of the spending rows each of the compare-group options
+# compares, over the CategoryTotals table joined to the names of its categories
+COMPARISON_GROUPS = {
+    'merchant': 'CategoryTotals.merchant',
+    'category': 'COALESCE(Categories.name, CategoryTotals.category)',
+    'parentCategory': 'COALESCE(Parents.name, CategoryTotals.parentCategory)'
+}
+
+# Maximum number of rows of the comparison shown in the comparison chart
+MAX_COMPARISON_BARS = 15
+
+# Pandas resample rules for each of the group-select options
+GROUP_RULES = {
+    'year': 'YS',
+    'quarter': 'QS',
+    'month': 'MS',
+    'day': 'D'
+}
 
 def get_layout() -> html.Div:
     """
@@ -45,12 +111,30 @@ def get_layout() -> html.Div:
             a descendant. 
     """
 
+    # Index of the first and last transaction date in each month, this is
+    # shipped to the browser once so the date picker can be validated clientside
+    date_bounds = get_date_bounds()
+    months = sorted(date_bounds)
+    min_date = date_bounds[months[0]][0] if months else None
+    max_date = date_bounds[months[-1]][1] if months else None
+
     return html.Div(
         style={
             'display': 'flex',
             'flex-direction': 'row'
         },
         children=[
+            dcc.Store(id='date-bounds', data=date_bounds),
+            # Version of the data the dashboard is showing, changes whenever the
+            # scheduler finishes a sync
+            dcc.Store(id='data-version', data=SCHEDULER.status()['version']),
+            dcc.Interval(id='sync-poll', interval=SYNC_POLL_INTERVAL),
+            # The inputs each lazily rendered component was last rendered with
+            *[
+                dcc.Store(id=f'{component}-rendered')
+                for components in PANELS.values()
+                for component in components
+            ],
             html.Div(
                 style={
                     'display': 'flex',
@@ -58,6 +142,21 @@ def get_layout() -> html.Div:
                     'min-width': '336px'
                 },
                 children=[
+                    # Profile select dropdown, only shown when there's more
+                    # than one profile to choose from
+                    html.Div([
+                        "Profile",
+                        dcc.Dropdown(
+                            id='profile-select',
+                            options=get_select_profiles(),
+                            value=DEFAULT_PROFILE,
+                            optionHeight=50,
+                            clearable=False
+                        )
+                    ], style={
+                        'padding': '5px 10px',
+                        'display': 'block' if len(list_profiles()) > 1 else 'none'
+                    }),
                     # Year select dropdown
                     html.Div([
                         "Filter Year",
@@ -88,27 +187,27 @@ def get_layout() -> html.Div:
                         dcc.DatePickerRange(
                             id='date-range-select',
                             clearable=True,
-                            min_date_allowed=str_to_datetime(
-                                read_database(
-                                    '''SELECT MIN(createdAt) FROM Transactions'''
-                                ).iloc[0][0]
-                            ).date(),
-                            max_date_allowed=str_to_datetime(
-                                read_database(
-                                    '''SELECT MAX(createdAt) FROM Transactions'''
-                                ).iloc[0][0]
-                            ).date(),
-                            initial_visible_month=str_to_datetime(
-                                read_database(
-                                    '''SELECT MAX(createdAt) FROM Transactions'''
-                                ).iloc[0][0]
-                            ).date(),
+                            min_date_allowed=min_date,
+                            max_date_allowed=max_date,
+                            initial_visible_month=max_date,
                             display_format='DD/MM/YYYY',
                             updatemode='bothdates'
                         )
                     ], style={
                         'padding': '5px 10px'
                     }),
+                    # Tag select dropdown
+                    html.Div([
+                        "Filter Tags",
+                        dcc.Dropdown(
+                            id='tag-select',
+                            options=get_select_tags(),
+                            multi=True,
+                            optionHeight=50
+                        )
+                    ], style={
+                        'padding': '5px 10px'
+                    }),
                     # Group by
                     html.Div([
                         "Group By",
@@ -127,50 +226,287 @@ def get_layout() -> html.Div:
                     ], style={
                         'padding': '5px 10px'
                     }),
+                    # Sync status
+                    html.Div(
+                        id='sync-status',
+                        children=format_sync_status(SCHEDULER.status()),
+                        style={
+                            'padding': '5px 10px',
+                            'font-size': 'small'
+                        }
+                    ),
                 ]
             ),
-            html.Div(
-                style = {
-                    'display': 'flex',
-                    'flex-wrap': 'wrap',
-                    'align-items': 'center',
-                    'justify-content': 'space-evenly'
-                },
+            # Each tab's components are only rendered while it's selected
+            dcc.Tabs(
+                id='panel-tabs',
+                value='overview',
+                style={'width': '100%'},
+                parent_style={'flex-grow': '1'},
                 children=[
-                    # Total income pie chart
-                    html.Div(
-                        style={
-                            'display': 'flex',
-                            'flex-direction': 'column',
-                            'align-items': 'center'
-                        },
-                        children=[
-                            html.H4('Income Total'),
-                            dcc.Graph(
-                                id='income-pie-chart'
-                            ),
-                        ]
+                    dcc.Tab(
+                        label='Overview',
+                        value='overview',
+                        children=html.Div(
+                            style=PANEL_STYLE,
+                            children=[
+                                # Total income pie chart
+                                html.Div(
+                                    style={
+                                        'display': 'flex',
+                                        'flex-direction': 'column',
+                                        'align-items': 'center'
+                                    },
+                                    children=[
+                                        html.H4('Income Total'),
+                                        dcc.Graph(
+                                            id='income-pie-chart'
+                                        ),
+                                    ]
+                                ),
+                                # Total spending pie chart
+                                html.Div(
+                                    style={
+                                        'display': 'flex',
+                                        'flex-direction': 'column',
+                                        'align-items': 'center'
+                                    },
+                                    children=[
+                                        html.H4('Spending Total'),
+                                        dcc.Graph(
+                                            id='spending-total-sunburst'
+                                        )
+                                    ]
+                                )
+                            ]
+                        )
                     ),
-                    # Total spending pie chart
-                    html.Div(
-                        style={
-                            'display': 'flex',
-                            'flex-direction': 'column',
-                            'align-items': 'center'
-                        },
-                        children=[
-                            html.H4('Spending Total'),
-                            dcc.Graph(
-                                id='spending-total-sunburst'
-                            )
-                        ]
+                    dcc.Tab(
+                        label='Trends',
+                        value='trends',
+                        children=html.Div(
+                            style=PANEL_STYLE,
+                            children=[
+                                # Cash flow time-series chart
+                                html.Div(
+                                    style={
+                                        'display': 'flex',
+                                        'flex-direction': 'column',
+                                        'align-items': 'center',
+                                        'width': '100%'
+                                    },
+                                    children=[
+                                        html.H4('Cash Flow'),
+                                        dcc.Graph(
+                                            id='cashflow-time-series',
+                                            style={'width': '100%'}
+                                        )
+                                    ]
+                                ),
+                                # Net worth time-series chart
+                                html.Div(
+                                    style={
+                                        'display': 'flex',
+                                        'flex-direction': 'column',
+                                        'align-items': 'center',
+                                        'width': '100%'
+                                    },
+                                    children=[
+                                        html.H4('Net Worth'),
+                                        dcc.Graph(
+                                            id='net-worth-time-series',
+                                            style={'width': '100%'}
+                                        )
+                                    ]
+                                )
+                            ]
+                        )
+                    ),
+                    dcc.Tab(
+                        label='Recurring Payments',
+                        value='recurring',
+                        children=html.Div(
+                            style=PANEL_STYLE,
+                            children=[
+                                # Recurring payments
+                                html.Div(
+                                    style={
+                                        'display': 'flex',
+                                        'flex-direction': 'column',
+                                        'width': '100%',
+                                        'padding': '0px 20px'
+                                    },
+                                    children=[
+                                        html.H4('Recurring Payments'),
+                                        dash_table.DataTable(
+                                            id='recurring-table',
+                                            columns=[
+                                                {'name': 'Merchant', 'id': 'description'},
+                                                {'name': 'Period', 'id': 'period'},
+                                                {'name': 'Every (days)', 'id': 'interval', 'type': 'numeric'},
+                                                {'name': 'Last Amount', 'id': 'amount', 'type': 'numeric'},
+                                                {'name': 'Last Paid', 'id': 'lastSeen'},
+                                                {'name': 'Next Expected', 'id': 'nextExpected'},
+                                                {'name': 'Expected Amount', 'id': 'expectedAmount', 'type': 'numeric'}
+                                            ],
+                                            sort_action='native',
+                                            style_cell={'textAlign': 'left', 'minWidth': '100px'}
+                                        )
+                                    ]
+                                )
+                            ]
+                        )
+                    ),
+                    dcc.Tab(
+                        label='Transactions',
+                        value='transactions',
+                        children=html.Div(
+                            style=PANEL_STYLE,
+                            children=[
+                                # Transactions explorer
+                                html.Div(
+                                    style={
+                                        'display': 'flex',
+                                        'flex-direction': 'column',
+                                        'width': '100%',
+                                        'padding': '0px 20px'
+                                    },
+                                    children=[
+                                        html.H4('Transactions'),
+                                        dash_table.DataTable(
+                                            id='transactions-table',
+                                            columns=[
+                                                {'name': 'Date', 'id': 'createdAt'},
+                                                {'name': 'Description', 'id': 'description'},
+                                                {'name': 'Amount', 'id': 'amount', 'type': 'numeric'},
+                                                {'name': 'Status', 'id': 'status'},
+                                                {'name': 'Message', 'id': 'message'},
+                                                {'name': 'Category', 'id': 'category'}
+                                            ],
+                                            page_action='custom',
+                                            page_current=0,
+                                            page_size=TABLE_PAGE_SIZE,
+                                            sort_action='custom',
+                                            sort_mode='single',
+                                            sort_by=[],
+                                            filter_action='custom',
+                                            filter_query='',
+                                            virtualization=True,
+                                            fixed_rows={'headers': True},
+                                            style_table={'height': '500px', 'overflowY': 'auto'},
+                                            style_cell={'textAlign': 'left', 'minWidth': '100px'}
+                                        )
+                                    ]
+                                )
+                            ]
+                        )
+                    ),
+                    dcc.Tab(
+                        label='Compare',
+                        value='compare',
+                        children=html.Div(
+                            style=PANEL_STYLE,
+                            children=[
+                                # Spending in the filtered period compared with
+                                # the periods before it
+                                html.Div(
+                                    style={
+                                        'display': 'flex',
+                                        'flex-direction': 'column',
+                                        'width': '100%',
+                                        'padding': '0px 20px'
+                                    },
+                                    children=[
+                                        html.H4('Spending Compared'),
+                                        html.Div(
+                                            style={'display': 'flex', 'flex-direction': 'row'},
+                                            children=[
+                                                html.Div([
+                                                    "Compare With",
+                                                    dcc.Dropdown(
+                                                        id='compare-mode',
+                                                        options=[
+                                                            {'label': 'Previous Periods', 'value': 'previous'},
+                                                            {'label': 'Previous Years', 'value': 'year'}
+                                                        ],
+                                                        value='previous',
+                                                        clearable=False
+                                                    )
+                                                ], style={'padding': '5px 10px', 'width': '200px'}),
+                                                html.Div([
+                                                    "Periods",
+                                                    dcc.Dropdown(
+                                                        id='compare-periods',
+                                                        options=[1, 2, 3, 6, 12],
+                                                        value=1,
+                                                        clearable=False
+                                                    )
+                                                ], style={'padding': '5px 10px', 'width': '100px'}),
+                                                html.Div([
+                                                    "Compare By",
+                                                    dcc.Dropdown(
+                                                        id='compare-group',
+                                                        options=[
+                                                            {'label': 'Merchant', 'value': 'merchant'},
+                                                            {'label': 'Category', 'value': 'category'},
+                                                            {'label': 'Parent Category', 'value': 'parentCategory'}
+                                                        ],
+                                                        value='category',
+                                                        clearable=False
+                                                    )
+                                                ], style={'padding': '5px 10px', 'width': '200px'})
+                                            ]
+                                        ),
+                                        dcc.Graph(
+                                            id='comparison-chart',
+                                            style={'width': '100%'}
+                                        ),
+                                        dash_table.DataTable(
+                                            id='comparison-table',
+                                            sort_action='native',
+                                            page_size=TABLE_PAGE_SIZE,
+                                            style_cell={'textAlign': 'left', 'minWidth': '100px'}
+                                        )
+                                    ]
+                                )
+                            ]
+                        )
                     )
                 ]
             )
         ]
     )
 
-@callback(
+clientside_callback(
+    """
+    function(years, months, start, end, bounds) {
+        const noUpdate = window.dash_clientside.no_update;
+        const keys = Object.keys(bounds || {}).sort();
+        if (keys.length === 0) {
+            return [noUpdate, noUpdate, noUpdate, noUpdate, noUpdate];
+        }
+
+        // No selection in a dropdown is the same as selecting everything
+        const allYears = keys.map(key => key.slice(0, 4));
+        const minYear = years && years.length ? Math.min(...years).toString() : allYears[0];
+        const maxYear = years && years.length ? Math.max(...years).toString() : allYears[allYears.length - 1];
+        const inMonths = key => !months || months.length === 0 || months.includes(key.slice(5, 7));
+
+        const minKeys = keys.filter(key => key.startsWith(minYear) && inMonths(key));
+        const maxKeys = keys.filter(key => key.startsWith(maxYear) && inMonths(key));
+        if (minKeys.length === 0 || maxKeys.length === 0) {
+            return [noUpdate, noUpdate, noUpdate, noUpdate, noUpdate];
+        }
+
+        const minDate = bounds[minKeys[0]][0];
+        const maxDate = bounds[maxKeys[maxKeys.length - 1]][1];
+
+        // Dates are "YYYY-MM-DD" strings so they can be compared directly
+        const clamp = date => date && date.slice(0, 10) >= minDate && date.slice(0, 10) <= maxDate ? date : null;
+
+        return [minDate, maxDate, maxDate, clamp(start), clamp(end)];
+    }
+    """,
     Output('date-range-select', 'min_date_allowed'),
     Output('date-range-select', 'max_date_allowed'),
     Output('date-range-select', 'initial_visible_month'),
@@ -179,141 +515,209 @@ def get_layout() -> html.Div:
     Input('year-select', 'value'),
     Input('month-select', 'value'),
     Input('date-range-select', 'start_date'),
-    Input('date-range-select', 'end_date')
+    Input('date-range-select', 'end_date'),
+    State('date-bounds', 'data')
 )
-def update_date_range(
-    years: list[str]|None,
-    months: list[str]|None,
-    start: str|None,
-    end: str|None
-) -> tuple[date, date, date, date|None, date|None]:
+
+@callback(
+    Output('data-version', 'data'),
+    Output('date-bounds', 'data'),
+    Output('year-select', 'options'),
+    Output('tag-select', 'options'),
+    Output('sync-status', 'children'),
+    Input('sync-poll', 'n_intervals'),
+    Input('profile-select', 'value'),
+    State('data-version', 'data')
+)
+@instrument_callback
+def poll_sync_status(
+    n_intervals: int|None,
+    profile: str|None,
+    data_version: int|None
+) -> tuple[int, dict[str, list[str]], list[dict[str, str]], list[dict[str, str]], str]:
     """
-    Updates the date-range-select component based on the input of the 
-    year-select and month-select dropdown components. This function ensures that
-    any date range selected is valid given the years and months selected in the
-    dropdowns and also changes the range of possible dates to select based on
-    the values of the dropdowns.
+    Checks the sync scheduler for new data. When a sync has finished since the
+    dashboard last loaded data the data-version store is updated, which causes
+    every chart to redraw without the page being reloaded. The filters are also
+    refreshed when a different profile is selected.
 
     Params:
-        years: A list of strings representing the years, in "YYYY" format, which
-            have been selected by the year-select dropdown. If the list is empty
-            or None then this is treated as if all years have been selected.
-        months: A list of strings representing the months, in "MM" format, which
-            have been selected by the month-select dropdown. If the list is empty
-            or None then this is treated as if all months have been selected.
-        start: The start date value of the date-range-select DatePickerRange,
-            represented as a string in "YYYY-MM-DD" format.
-        end: The end date value of the date-range-select DatePickerRange,
-            represented as a string in "YYYY-MM_DD" format.
-    
+        n_intervals: The number of times the sync-poll interval has fired.
+        profile: The profile selected in the profile-select dropdown.
+        data_version: The version of the data the dashboard is showing.
+
     Returns:
-        min_date: A datetime.date representing the earliest date inside
-            the restrictions set by the dropdowns on which there was a
-            transaction.
-        max_date: A datetime.date representing the latest date inside
-            the restrictions set by the dropdowns on which there was a
-            transaction.
-        max_date: A datetime.date representing the month the DatePickerRange
-            will initially display when clicked. This is set to the month of the
-            max_date.
-        start_date: A datetime.date to be displayed in the DatePickerRange. If
-            the start parameter was inside the min_date, max_date
-            range then start_date will be that date. Otherwise if start was None
-            or was outside the min_date, max_date range start_date will be None.
-        end_date: A datetime.date to be displayed in the DatePickerRange. If
-            the end parameter was inside the min_date, max_date
-            range then end_date will be that date. Otherwise if end was None
-            or was outside the min_date, max_date range end_date will be None.
-    """
-
-    # If the user hasn't provided a filter than use all the available years.
-    if years is None or len(years) == 0:
-        min_year = read_database(
-            '''
-            SELECT strftime("%Y", MIN(createdAt))
-            FROM Transactions
-            '''
-        ).iloc[0][0]
+        data_version: The version of the most recently synced data, or
+            no_update if it hasn't changed.
+        date_bounds: The new date-bounds index, or no_update.
+        year_options: The new year-select options, or no_update.
+        tag_options: The new tag-select options, or no_update.
+        sync_status: A description of the scheduler's status.
+    """
 
-        max_year = read_database(
-            '''
-            SELECT strftime("%Y", MAX(createdAt))
-            FROM Transactions
-            '''
-        ).iloc[0][0]
-    else:
-        min_year = min(map(int, years))
-        max_year = max(map(int, years))
+    status = SCHEDULER.status()
 
-    # If the user hasn't provided a filter than use all available months.
-    if months is None or len(months) == 0:
-        months = [month['value'] for month in get_select_month()]
-    
-    placeholders = ','.join(['?' for _ in range(len(months))])
+    if status['version'] == data_version and callback_context.triggered_id != 'profile-select':
+        return no_update, no_update, no_update, no_update, format_sync_status(status)
 
-    min_date = str_to_datetime(
-            read_database(
-            f'''
-            SELECT MIN(createdAt)
-            FROM Transactions
-            WHERE strftime("%Y", datetime(createdAt, "localtime")) = "{min_year}"
-                AND strftime("%m", datetime(createdAt, "localtime")) IN ({placeholders})
-            ''',
-            params=months
-        ).iloc[0][0]
-    ).date()
-
-    max_date = str_to_datetime(
-        read_database(
-            f'''
-            SELECT MAX(createdAt)
-            FROM Transactions
-            WHERE strftime("%Y", datetime(createdAt, "localtime")) = "{max_year}"
-                AND strftime("%m", datetime(createdAt, "localtime")) IN ({placeholders})
-            ''',
-            params=months
-        ).iloc[0][0]
-    ).date()
+    with use_profile(profile):
+        return (
+            status['version'],
+            get_date_bounds(),
+            get_select_years(),
+            get_select_tags(),
+            format_sync_status(status)
+        )
+
+def get_select_profiles() -> list[dict[str, str]]:
+    """
+    Gets the options of the profile-select dropdown, which is every profile and,
+    when there's more than one, every profile combined.
+
+    Returns:
+        list: A dictionary with the label and value of each option.
+    """
+
+    profiles = list_profiles()
+    options = [{'label': profile.title(), 'value': profile} for profile in profiles]
+    if len(profiles) > 1:
+        options.append({'label': 'All Profiles', 'value': ALL_PROFILES})
+
+    return options
+
+def format_sync_status(status: dict) -> str:
+    """
+    Formats the status of the sync scheduler to be displayed on the dashboard.
+
+    Params:
+        status: The dictionary returned by SyncScheduler.status.
+
+    Returns:
+        str: A short description of the sync status.
+    """
+
+    if status['state'] == 'syncing':
+        return 'Syncing...'
+
+    last_success = status['lastSuccess'].replace('T', ' ') if status['lastSuccess'] else 'never'
+    if status['state'] == 'error':
+        return f'Last sync failed, last successful sync: {last_success}'
+
+    return f'Last synced: {last_success}'
+
+def lazy_panel(panel: str) -> Callable:
+    """
+    Decorator for the callback of a component in one of the PANELS. The callback
+    is given three extra trailing arguments, the selected profile-select value,
+    the selected panel-tabs value and the component's -rendered store, and
+    returns the store as an extra last output. The callback is run in the
+    selected profile.
+
+    The callback only runs while its panel is selected. A component whose
+    inputs change while it's hidden is left stale and brought up to date when
+    its panel is next selected, and selecting a panel whose components are
+    already up to date runs nothing. instrument_callback goes below this
+    decorator, so only the runs which aren't skipped are timed.
+
+    Params:
+        panel: The value of the tab the component is in.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args: Any) -> tuple:
+            *inputs, profile, tab, rendered = args
+
+            # The inputs identify what the component is showing
+            signature = repr([*inputs, profile])
+            if tab != panel or signature == rendered:
+                increment('callback_skipped_total', func.__name__)
+                raise PreventUpdate
+
+            with use_profile(profile):
+                outputs = func(*inputs)
+            if not isinstance(outputs, tuple):
+                outputs = (outputs,)
+
+            return (*outputs, signature)
 
-    # Check that the current date-range-select values are withing the min_date, max_date range
-    start_date, end_date = check_date_range(start, end, min_date, max_date)
+        return wrapper
 
-    return min_date, max_date, max_date, start_date, end_date
+    return decorator
 
 ###############################################################################
 #################################CHARTS########################################
 ###############################################################################
 
-@callback(
-    Output('income-pie-chart', 'figure'),
-    Input('year-select', 'value'),
-    Input('month-select', 'value'),
-    Input('date-range-select', 'start_date'),
-    Input('date-range-select', 'end_date')
-)
-def income_pie_chart(
-    years: list[str]|None, 
+@merge_profiles(add_frames(['description', 'isCategorizable']))
+def get_income_by_merchant(min_date: str|None, max_date: str|None, tags: list[str]|None) -> pd.DataFrame:
+    """
+    Gets the total income from each merchant between two dates, aggregated by
+    the configured query engine unless tags are selected. In the merged view of
+    every profile the totals of the same merchant are added together.
+
+    Params:
+        min_date: The first date of the period.
+        max_date: The last date of the period.
+        tags: The tags selected in the tag-select dropdown.
+
+    Returns:
+        pd.DataFrame: A DataFrame with totalAmount (cents), description and
+            isCategorizable columns.
+    """
+
+    tag_where, tag_params = get_tag_filter(tags)
+
+    return read_aggregate(
+        lambda engine: f'''
+            SELECT SUM(amount) AS totalAmount, merchant AS description,
+                MAX(isCategorizable) AS isCategorizable
+            FROM Transactions
+            WHERE status = 'SETTLED'
+                AND {INCOME_CONDITION}
+                AND settledAt BETWEEN ? AND ?
+                AND {tag_where}
+            GROUP BY merchant
+            ORDER BY SUM(amount) DESC
+        ''',
+        params=[str(min_date), str(max_date)] + tag_params,
+        name='income_by_merchant',
+        scan=not tags
+    )
+
+@memoize()
+def get_income_totals(
+    years: list[str]|None,
     months: list[str]|None,
     date_select_start: str|None,
-    date_select_end: str|None
-) -> go.Figure:
+    date_select_end: str|None,
+    tags: list[str]|None,
+    data_version: int|None
+) -> pd.DataFrame:
     """
-    
+    Gets the total income from each source in the selected period, with every
+    interest payment combined into one source.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        tags: The tags selected in the tag-select dropdown.
+        data_version: The version of the data from the sync scheduler, this is
+            part of the cache key so a sync invalidates the cached totals.
+
+    Returns:
+        pd.DataFrame: A DataFrame with description and totalAmount (dollars)
+            columns, largest first.
     """
+
     min_date, max_date = get_min_and_max_dates(years, months, date_select_start, date_select_end)
 
-    income_df = read_database(
-        f'''
-            SELECT SUM(amount) as totalAmount, description, isCategorizable
-            FROM transactions
-            WHERE amount > 0
-                AND status = "SETTLED"
-                AND (isCategorizable = 1 OR description LIKE "%interest%")
-                AND settledAt BETWEEN "{min_date}" AND "{max_date}"
-            GROUP BY description
-            ORDER BY SUM(amount) DESC
-        '''
-    )
+    income_df = get_income_by_merchant(min_date, max_date, tags)
 
     # Combine all interest payments into a single sum
 
@@ -350,6 +754,59 @@ def income_pie_chart(
     income_df = income_df.sort_values(by='totalAmount', ascending=False).reset_index(drop=True)
     income_df['totalAmount'] = income_df['totalAmount'] / 100
 
+    return income_df
+
+@callback(
+    Output('income-pie-chart', 'figure'),
+    Output('income-pie-chart-rendered', 'data'),
+    Input('year-select', 'value'),
+    Input('month-select', 'value'),
+    Input('date-range-select', 'start_date'),
+    Input('date-range-select', 'end_date'),
+    Input('tag-select', 'value'),
+    Input('data-version', 'data'),
+    Input('profile-select', 'value'),
+    Input('panel-tabs', 'value'),
+    State('income-pie-chart-rendered', 'data')
+)
+@lazy_panel('overview')
+@instrument_callback
+def income_pie_chart(
+    years: list[str]|None, 
+    months: list[str]|None,
+    date_select_start: str|None,
+    date_select_end: str|None,
+    tags: list[str]|None,
+    data_version: int|None
+) -> go.Figure|Patch:
+    """
+    Creates a donut chart of income by source. The whole figure is only sent
+    when the page loads or the Overview tab is selected, after that only the
+    labels and values are sent.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        tags: The tags selected in the tag-select dropdown.
+        data_version: The version of the data from the sync scheduler, this
+            only triggers a redraw when new data has been synced.
+
+    Returns:
+        go.Figure|Patch: The chart, or a patch of its data.
+    """
+
+    income_df = get_income_totals(years, months, date_select_start, date_select_end, tags, data_version)
+
+    # Only the data changes once the chart has been drawn, it's drawn in full
+    # when the page loads or its tab is selected, in case it was never drawn
+    if callback_context.triggered_id not in (None, 'panel-tabs'):
+        patch = Patch()
+        patch['data'][0]['labels'] = income_df['description'].values
+        patch['data'][0]['values'] = income_df['totalAmount'].values
+        return patch
+
     # Create the chart
     fig = go.Figure(data=[
         go.Pie(
@@ -373,62 +830,806 @@ def income_pie_chart(
     return fig
 
 
+@merge_profiles(add_frames(['parentCategory', 'category', 'merchant']))
+def get_spending_totals(min_date: str|None, max_date: str|None, tags: list[str]|None) -> pd.DataFrame:
+    """
+    Gets the total spending on each merchant of each category between two
+    dates. The totals are read from the CategoryTotals pre-aggregation unless
+    tags are selected. In the merged view of every profile the totals of the
+    same merchant and category are added together.
+
+    Params:
+        min_date: The first date of the period.
+        max_date: The last date of the period.
+        tags: The tags selected in the tag-select dropdown.
+
+    Returns:
+        pd.DataFrame: A DataFrame with parentCategory, category, merchant and
+            amount (dollars) columns.
+    """
+
+    # Filtering on tags needs the individual transactions, which are aggregated
+    # in the same shape as the CategoryTotals table
+    source, tag_params = 'CategoryTotals', []
+    if tags:
+        tag_where, tag_params = get_tag_filter(tags)
+        source = f'''(
+            SELECT {local_date_sql('settledAt')} AS day, parentCategory, category,
+                merchant, amount
+            FROM Transactions
+            WHERE status = "SETTLED"
+                AND {SPENDING_CONDITION}
+                AND {tag_where}
+        ) AS CategoryTotals'''
+
+    return read_database(
+        f'''
+            SELECT COALESCE(Parents.name, CategoryTotals.parentCategory) AS parentCategory,
+                COALESCE(Categories.name, CategoryTotals.category) AS category,
+                CategoryTotals.merchant,
+                -SUM(CategoryTotals.amount) / 100.0 AS amount
+            FROM {source}
+            LEFT JOIN Categories ON Categories.id = CategoryTotals.category
+            LEFT JOIN Categories AS Parents ON Parents.id = CategoryTotals.parentCategory
+            WHERE CategoryTotals.day BETWEEN ? AND ?
+            GROUP BY CategoryTotals.parentCategory, CategoryTotals.category, CategoryTotals.merchant
+        ''',
+        params=tag_params + [str(min_date), str(max_date)],
+        name='spending_by_category'
+    )
+
+@memoize()
+def get_spending_tree(
+    years: list[str]|None,
+    months: list[str]|None,
+    date_select_start: str|None,
+    date_select_end: str|None,
+    tags: list[str]|None,
+    data_version: int|None
+) -> pd.DataFrame:
+    """
+    Gets the tree of spending by parent category, category and merchant in the
+    selected period.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        tags: The tags selected in the tag-select dropdown.
+        data_version: The version of the data from the sync scheduler, this is
+            part of the cache key so a sync invalidates the cached tree.
+
+    Returns:
+        pd.DataFrame: The nodes of the tree from build_sunburst_tree.
+    """
+
+    min_date, max_date = get_min_and_max_dates(years, months, date_select_start, date_select_end)
+
+    spending_df = get_spending_totals(min_date, max_date, tags)
+
+    tree_df = build_sunburst_tree(
+        spending_df,
+        ['parentCategory', 'category', 'merchant'],
+        MAX_SUNBURST_MERCHANTS
+    )
+
+    return tree_df
+
 @callback(
     Output('spending-total-sunburst', 'figure'),
+    Output('spending-total-sunburst-rendered', 'data'),
     Input('year-select', 'value'),
     Input('month-select', 'value'),
     Input('date-range-select', 'start_date'),
-    Input('date-range-select', 'end_date')
+    Input('date-range-select', 'end_date'),
+    Input('tag-select', 'value'),
+    Input('data-version', 'data'),
+    Input('profile-select', 'value'),
+    Input('panel-tabs', 'value'),
+    State('spending-total-sunburst-rendered', 'data')
 )
+@lazy_panel('overview')
+@instrument_callback
 def spending_total_sunburst(
     years: list[str]|None, 
     months: list[str]|None,
     date_select_start: str|None,
-    date_select_end: str|None
+    date_select_end: str|None,
+    tags: list[str]|None,
+    data_version: int|None
+) -> go.Figure|Patch:
+    """
+    Creates a sunburst chart of spending by parent category, category and
+    merchant. The whole tree is sent with the figure, so clicking to drill into
+    a category is handled by the browser without another callback. The whole
+    figure is only sent when the page loads or the Overview tab is selected,
+    after that only the tree is sent.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        tags: The tags selected in the tag-select dropdown.
+        data_version: The version of the data from the sync scheduler, this
+            only triggers a redraw when new data has been synced.
+
+    Returns:
+        go.Figure|Patch: A sunburst chart showing two levels at a time, or a
+            patch of its data.
+    """
+
+    tree_df = get_spending_tree(years, months, date_select_start, date_select_end, tags, data_version)
+
+    # Only the data changes once the chart has been drawn, it's drawn in full
+    # when the page loads or its tab is selected, in case it was never drawn
+    if callback_context.triggered_id not in (None, 'panel-tabs'):
+        patch = Patch()
+        for column, prop in [('id', 'ids'), ('parent', 'parents'), ('label', 'labels'), ('value', 'values')]:
+            patch['data'][0][prop] = tree_df[column].values
+        return patch
+
+    # Create the chart
+    fig = go.Figure(data=[
+        go.Sunburst(
+            ids=tree_df['id'],
+            parents=tree_df['parent'],
+            labels=tree_df['label'],
+            values=tree_df['value'],
+            branchvalues='total',
+            maxdepth=2,
+            hovertemplate='%{label}<br>$%{value:,.2f}<br>%{percentRoot:.1%}<extra></extra>'
+        )
+    ])
+    fig.update_layout(
+        uniformtext_minsize=12,
+        uniformtext_mode='hide',
+        height=600,
+        margin={'t': 0, 'l': 0, 'r': 0, 'b': 0}
+    )
+
+    return fig
+
+
+@merge_profiles(add_frames('day'))
+def get_daily_totals(min_date: str|None, max_date: str|None, tags: list[str]|None) -> pd.DataFrame:
+    """
+    Gets the total income and spending of each day between two dates. The
+    totals are read from the DailyTotals pre-aggregation unless tags are
+    selected. In the merged view of every profile the totals of the same day
+    are added together.
+
+    Params:
+        min_date: The first date of the period.
+        max_date: The last date of the period.
+        tags: The tags selected in the tag-select dropdown.
+
+    Returns:
+        pd.DataFrame: A DataFrame with day, income and spending (cents) columns,
+            in order of day.
+    """
+
+    # Filtering on tags needs the individual transactions, which are aggregated
+    # in the same shape as the DailyTotals table
+    source, tag_params = 'DailyTotals', []
+    if tags:
+        tag_where, tag_params = get_tag_filter(tags)
+        source = f'''(
+            SELECT {local_date_sql('settledAt')} AS day,
+                CASE WHEN {INCOME_CONDITION} THEN amount ELSE 0 END AS income,
+                CASE WHEN {SPENDING_CONDITION} THEN amount ELSE 0 END AS spending
+            FROM Transactions
+            WHERE status = "SETTLED"
+                AND {tag_where}
+        )'''
+
+    return read_database(
+        f'''
+            SELECT day, SUM(income) AS income, SUM(spending) AS spending
+            FROM {source}
+            WHERE day BETWEEN ? AND ?
+            GROUP BY day
+            ORDER BY day
+        ''',
+        params=tag_params + [str(min_date), str(max_date)],
+        name='daily_totals'
+    )
+
+@callback(
+    Output('cashflow-time-series', 'figure'),
+    Output('cashflow-time-series-rendered', 'data'),
+    Input('year-select', 'value'),
+    Input('month-select', 'value'),
+    Input('date-range-select', 'start_date'),
+    Input('date-range-select', 'end_date'),
+    Input('group-select', 'value'),
+    Input('tag-select', 'value'),
+    Input('data-version', 'data'),
+    Input('profile-select', 'value'),
+    Input('panel-tabs', 'value'),
+    State('cashflow-time-series-rendered', 'data')
+)
+@lazy_panel('trends')
+@instrument_callback
+@memoize()
+def cashflow_time_series(
+    years: list[str]|None,
+    months: list[str]|None,
+    date_select_start: str|None,
+    date_select_end: str|None,
+    group: str,
+    tags: list[str]|None,
+    data_version: int|None
 ) -> go.Figure:
     """
-    
+    Creates a time-series chart of income, spending and net cash flow. The data
+    is read from the DailyTotals pre-aggregation and resampled on the server to
+    the granularity selected in the group-select dropdown. Series longer than
+    MAX_CHART_POINTS are downsampled with LTTB so the payload stays bounded
+    regardless of how much history is selected.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        group: The granularity selected in the group-select dropdown, one of
+            the keys of GROUP_RULES.
+        tags: The tags selected in the tag-select dropdown.
+        data_version: The version of the data from the sync scheduler, this
+            only triggers a redraw when new data has been synced.
+
+    Returns:
+        go.Figure: A line chart with an income, spending and net trace.
     """
 
     min_date, max_date = get_min_and_max_dates(years, months, date_select_start, date_select_end)
 
-    # ToDo: Think of a better way to filter out payments to investment account
-    spending_df = read_database(
+    daily_df = get_daily_totals(min_date, max_date, tags)
+
+    # Resample the daily totals to the selected granularity
+    daily_df['day'] = pd.to_datetime(daily_df['day'])
+    grouped_df = daily_df.set_index('day').resample(GROUP_RULES.get(group, 'D')).sum()
+    grouped_df['net'] = grouped_df['income'] + grouped_df['spending']
+    grouped_df['spending'] = grouped_df['spending'].abs()
+    grouped_df = grouped_df / 100
+
+    fig = go.Figure()
+    x = grouped_df.index.values
+
+    for col, name in [('income', 'Income'), ('spending', 'Spending'), ('net', 'Net')]:
+        trace_x, trace_y = lttb_downsample(x, grouped_df[col].values, MAX_CHART_POINTS)
+        fig.add_trace(go.Scatter(x=trace_x, y=trace_y, mode='lines', name=name))
+
+    fig.update_layout(
+        height=500,
+        hovermode='x unified'
+    )
+
+    return fig
+
+
+@callback(
+    Output('net-worth-time-series', 'figure'),
+    Output('net-worth-time-series-rendered', 'data'),
+    Input('year-select', 'value'),
+    Input('month-select', 'value'),
+    Input('date-range-select', 'start_date'),
+    Input('date-range-select', 'end_date'),
+    Input('group-select', 'value'),
+    Input('data-version', 'data'),
+    Input('profile-select', 'value'),
+    Input('panel-tabs', 'value'),
+    State('net-worth-time-series-rendered', 'data')
+)
+@lazy_panel('trends')
+@instrument_callback
+@memoize()
+def net_worth_time_series(
+    years: list[str]|None,
+    months: list[str]|None,
+    date_select_start: str|None,
+    date_select_end: str|None,
+    group: str,
+    data_version: int|None
+) -> go.Figure:
+    """
+    Creates a time-series chart of the balance of each account, stacked so the
+    top of the stack is the total net worth. The balances are read from the
+    DailyBalances history and the balance at the end of each group-select period
+    is shown.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        group: The granularity selected in the group-select dropdown, one of
+            the keys of GROUP_RULES.
+        data_version: The version of the data from the sync scheduler, this
+            only triggers a redraw when new data has been synced.
+
+    Returns:
+        go.Figure: A stacked area chart with a trace for each account and a net
+            worth line.
+    """
+
+    min_date, max_date = get_min_and_max_dates(years, months, date_select_start, date_select_end)
+
+    fig = go.Figure()
+
+    # There is no history to draw before the first sync
+    if min_date is None or max_date is None:
+        fig.update_layout(height=500)
+        return fig
+
+    balances_df = get_balance_history(min_date, max_date)
+    grouped_df = balances_df.resample(GROUP_RULES.get(group, 'D')).last()
+
+    # The points are picked once on the net worth and taken from every account,
+    # as stacked traces with different x values would be stacked on zeros
+    x = grouped_df.index.values
+    net_worth = grouped_df.sum(axis=1).values
+    selected = lttb_indices(x, net_worth, MAX_CHART_POINTS)
+
+    for account in grouped_df.columns:
+        fig.add_trace(go.Scatter(
+            x=x[selected], y=grouped_df[account].values[selected], mode='lines', name=account, stackgroup='accounts'
+        ))
+
+    fig.add_trace(go.Scatter(x=x[selected], y=net_worth[selected], mode='lines', name='Net Worth', line={'color': 'black'}))
+
+    fig.update_layout(
+        height=500,
+        hovermode='x unified'
+    )
+
+    return fig
+
+
+@callback(
+    Output('recurring-table', 'data'),
+    Output('recurring-table-rendered', 'data'),
+    Input('data-version', 'data'),
+    Input('profile-select', 'value'),
+    Input('panel-tabs', 'value'),
+    State('recurring-table-rendered', 'data')
+)
+@lazy_panel('recurring')
+@instrument_callback
+@memoize()
+def recurring_table(data_version: int|None) -> list[dict]:
+    """
+    Lists the recurring payments detected in the spending history.
+
+    Params:
+        data_version: The version of the data from the sync scheduler, this
+            only triggers a requery when new data has been synced.
+
+    Returns:
+        list[dict]: A row for each recurring series.
+    """
+
+    return get_recurring_series().to_dict('records')
+
+
+@callback(
+    Output('transactions-table', 'data'),
+    Output('transactions-table', 'page_count'),
+    Output('transactions-table', 'page_current'),
+    Output('transactions-table-rendered', 'data'),
+    Input('transactions-table', 'page_current'),
+    Input('transactions-table', 'page_size'),
+    Input('transactions-table', 'sort_by'),
+    Input('transactions-table', 'filter_query'),
+    Input('year-select', 'value'),
+    Input('month-select', 'value'),
+    Input('date-range-select', 'start_date'),
+    Input('date-range-select', 'end_date'),
+    Input('tag-select', 'value'),
+    Input('data-version', 'data'),
+    Input('profile-select', 'value'),
+    Input('panel-tabs', 'value'),
+    State('transactions-table-rendered', 'data')
+)
+@lazy_panel('transactions')
+@instrument_callback
+def transactions_table(
+    page_current: int,
+    page_size: int,
+    sort_by: list[dict[str, str]],
+    filter_query: str,
+    years: list[str]|None,
+    months: list[str]|None,
+    date_select_start: str|None,
+    date_select_end: str|None,
+    tags: list[str]|None,
+    data_version: int|None
+) -> tuple[list[dict], int, int]:
+    """
+    Queries a single page of the transactions table. Paging, sorting and
+    filtering are all done by the database so only the rows on the visible page
+    are ever sent to the browser. In the merged view of every profile the pages
+    of each profile are merged.
+
+    Params:
+        page_current: The index of the page being displayed.
+        page_size: The number of rows per page.
+        sort_by: The sort_by property of the DataTable, a list containing at
+            most one dictionary with a column_id and direction.
+        filter_query: The filter_query property of the DataTable.
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        tags: The tags selected in the tag-select dropdown.
+        data_version: The version of the data from the sync scheduler, this
+            only triggers a requery when new data has been synced.
+
+    Returns:
+        data: A list of dictionaries, one per row on the page.
+        page_count: The total number of pages, or no_update if only the page
+            changed.
+        page_current: The first page whenever anything other than the page
+            changed, as the page being displayed may no longer exist, otherwise
+            no_update.
+    """
+
+    page_changed = callback_context.triggered_id == 'transactions-table' and \
+        callback_context.triggered[0]['prop_id'] == 'transactions-table.page_current'
+    if not page_changed:
+        page_current = 0
+
+    min_date, max_date = get_min_and_max_dates(years, months, date_select_start, date_select_end)
+
+    where, params = parse_table_filter(filter_query, TABLE_COLUMNS)
+    tag_where, tag_params = get_tag_filter(tags)
+    where = f'createdAt BETWEEN ? AND ? AND {tag_where} AND {where}'
+    params = [str(min_date), f'{max_date}T23:59:59'] + tag_params + params
+
+    # Default to newest first which is served by the createdAt index
+    sort_column, ascending = 'createdAt', False
+    if sort_by and sort_by[0]['column_id'] in TABLE_COLUMNS:
+        sort_column, ascending = sort_by[0]['column_id'], sort_by[0]['direction'] == 'asc'
+
+    if get_profile() != ALL_PROFILES:
+        page_df = get_transactions_page(where, params, sort_column, ascending, page_size, page_current * page_size)
+    else:
+        # Rows from any profile could be on the page, so the rows up to the end
+        # of the page are read from each profile and the page is taken from
+        # those. SQLite sorts NULLs first, so pandas is told to as well
+        pages = []
+        for profile in list_profiles():
+            with use_profile(profile):
+                pages.append(get_transactions_page(where, params, sort_column, ascending, (page_current + 1) * page_size, 0))
+
+        page_df = pd.concat(pages, ignore_index=True)
+        if sort_column != 'createdAt':
+            page_df = page_df.sort_values('createdAt', ascending=False, kind='stable')
+        page_df = page_df.sort_values(
+            sort_column,
+            ascending=ascending,
+            na_position='first' if ascending else 'last',
+            kind='stable'
+        ).iloc[page_current * page_size:(page_current + 1) * page_size]
+
+    # Only recount the matching rows when the page itself isn't what changed
+    if page_changed:
+        return page_df.to_dict('records'), no_update, no_update
+
+    total = count_transactions(where, params)
+
+    return page_df.to_dict('records'), max(1, -(-int(total) // page_size)), 0
+
+def get_transactions_page(
+    where: str,
+    params: list,
+    sort_column: str,
+    ascending: bool,
+    limit: int,
+    offset: int
+) -> pd.DataFrame:
+    """
+    Queries a page of the transactions matching a filter.
+
+    Params:
+        where: The SQL condition the transactions must meet.
+        params: The parameters of the condition.
+        sort_column: The column of TABLE_COLUMNS to sort by, ties are broken by
+            newest first.
+        ascending: Whether to sort in ascending order.
+        limit: The number of rows on the page.
+        offset: The number of rows before the page.
+
+    Returns:
+        pd.DataFrame: The rows on the page, with the columns of TABLE_COLUMNS.
+    """
+
+    order_by = f"{TABLE_COLUMNS[sort_column]} {'ASC' if ascending else 'DESC'}"
+    if sort_column != 'createdAt':
+        order_by += ', createdAt DESC'
+
+    columns = ', '.join(f'{expr} AS {col}' for col, expr in TABLE_COLUMNS.items())
+
+    return read_database(
         f'''
-            SELECT SUM(amount) as totalAmount, description
-            FROM transactions
-            WHERE amount < 0
-                AND status = "SETTLED"
-                AND settledAt BETWEEN "{min_date}" AND "{max_date}"
-                AND isCategorizable = 1
-                AND description != "CMC Investment Accnt"
-            GROUP BY description
-            ORDER BY SUM(amount) ASC
-        '''
+            SELECT {columns}
+            FROM Transactions
+            WHERE {where}
+            ORDER BY {order_by}
+            LIMIT ? OFFSET ?
+        ''',
+        params=params + [limit, offset],
+        name='transactions_page'
     )
 
-    # Format DataFrame for chart
-    spending_df['totalAmount'] = spending_df['totalAmount'].abs() / 100
+@merge_profiles(lambda results: sum(results.values()))
+def count_transactions(where: str, params: list) -> int:
+    """
+    Counts the transactions matching a filter. In the merged view of every
+    profile the counts of each profile are added together.
+
+    Params:
+        where: The SQL condition the transactions must meet.
+        params: The parameters of the condition.
 
+    Returns:
+        int: The number of matching transactions.
+    """
 
-    # Create the chart
+    return int(read_database(
+        f'''
+            SELECT COUNT(*)
+            FROM Transactions
+            WHERE {where}
+        ''',
+        params=params,
+        name='transactions_count'
+    ).iloc[0][0])
+
+
+@merge_profiles(add_frames(['period', 'name']))
+def get_period_totals(periods: list[list[str]], group: str, tags: list[str]|None) -> pd.DataFrame:
+    """
+    Gets the total spending in each of several periods in one query. The
+    periods are bound as a single JSON parameter and joined to the spending
+    rows on their dates, so every period is aggregated in the same pass however
+    many there are. The totals are read from the CategoryTotals pre-aggregation
+    unless tags are selected. In the merged view of every profile the totals of
+    the same period and name are added together.
+
+    Params:
+        periods: The first and last day of each period, from
+            get_comparison_periods.
+        group: The key of COMPARISON_GROUPS to total the spending by.
+        tags: The tags selected in the tag-select dropdown.
+
+    Returns:
+        pd.DataFrame: A DataFrame with period (the index into periods), name
+            and amount (dollars) columns.
+    """
+
+    column = COMPARISON_GROUPS[group]
+
+    # Filtering on tags needs the individual transactions, which are aggregated
+    # in the same shape as the CategoryTotals table
+    source, tag_params = 'CategoryTotals', []
+    if tags:
+        tag_where, tag_params = get_tag_filter(tags)
+        source = f'''(
+            SELECT {local_date_sql('settledAt')} AS day, parentCategory, category,
+                merchant, amount
+            FROM Transactions
+            WHERE status = "SETTLED"
+                AND {SPENDING_CONDITION}
+                AND {tag_where}
+        ) AS CategoryTotals'''
+
+    return read_database(
+        f'''
+            WITH Periods AS (
+                SELECT CAST(key AS INTEGER) AS period,
+                    json_extract(value, '$[0]') AS firstDay,
+                    json_extract(value, '$[1]') AS lastDay
+                FROM json_each(?)
+            )
+            SELECT Periods.period, {column} AS name,
+                -SUM(CategoryTotals.amount) / 100.0 AS amount
+            FROM Periods
+            JOIN {source} ON CategoryTotals.day BETWEEN Periods.firstDay AND Periods.lastDay
+            LEFT JOIN Categories ON Categories.id = CategoryTotals.category
+            LEFT JOIN Categories AS Parents ON Parents.id = CategoryTotals.parentCategory
+            GROUP BY Periods.period, {column}
+        ''',
+        params=[json.dumps(periods)] + tag_params,
+        name='period_totals'
+    )
+
+@memoize()
+def get_period_comparison(
+    years: list[str]|None,
+    months: list[str]|None,
+    date_select_start: str|None,
+    date_select_end: str|None,
+    tags: list[str]|None,
+    mode: str,
+    count: int,
+    group: str,
+    data_version: int|None
+) -> tuple[list[list[str]], pd.DataFrame]:
+    """
+    Compares the spending in the selected period with the equivalent periods
+    before it.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        tags: The tags selected in the tag-select dropdown.
+        mode: The value of the compare-mode dropdown.
+        count: The number of earlier periods from the compare-periods dropdown.
+        group: The value of the compare-group dropdown.
+        data_version: The version of the data from the sync scheduler, this is
+            part of the cache key so a sync invalidates the cached comparison.
+
+    Returns:
+        periods: The first and last day of each period, the selected one first.
+        pd.DataFrame: The comparison from compare_periods, empty if there are
+            no transactions.
+    """
+
+    min_date, max_date = get_min_and_max_dates(years, months, date_select_start, date_select_end)
+    if min_date is None or max_date is None:
+        return [], pd.DataFrame(columns=['name', 'change'])
+
+    periods = get_comparison_periods(min_date, max_date, mode, count)
+    totals = get_period_totals(periods, group, tags)
+
+    return periods, compare_periods(totals, count)
+
+@callback(
+    Output('comparison-chart', 'figure'),
+    Output('comparison-chart-rendered', 'data'),
+    Input('year-select', 'value'),
+    Input('month-select', 'value'),
+    Input('date-range-select', 'start_date'),
+    Input('date-range-select', 'end_date'),
+    Input('tag-select', 'value'),
+    Input('compare-mode', 'value'),
+    Input('compare-periods', 'value'),
+    Input('compare-group', 'value'),
+    Input('data-version', 'data'),
+    Input('profile-select', 'value'),
+    Input('panel-tabs', 'value'),
+    State('comparison-chart-rendered', 'data')
+)
+@lazy_panel('compare')
+@instrument_callback
+def comparison_chart(
+    years: list[str]|None,
+    months: list[str]|None,
+    date_select_start: str|None,
+    date_select_end: str|None,
+    tags: list[str]|None,
+    mode: str,
+    count: int,
+    group: str,
+    data_version: int|None
+) -> go.Figure:
+    """
+    Creates a bar chart of the spending in the selected period next to the
+    periods before it, for the rows which changed the most.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        tags: The tags selected in the tag-select dropdown.
+        mode: The value of the compare-mode dropdown.
+        count: The number of earlier periods from the compare-periods dropdown.
+        group: The value of the compare-group dropdown.
+        data_version: The version of the data from the sync scheduler, this
+            only triggers a redraw when new data has been synced.
+
+    Returns:
+        go.Figure: A horizontal bar chart with a bar per period for each row.
+    """
+
+    periods, comparison_df = get_period_comparison(
+        years, months, date_select_start, date_select_end, tags, mode, count, group, data_version
+    )
+
+    # The largest change is drawn at the top
+    top_df = comparison_df.head(MAX_COMPARISON_BARS).iloc[::-1]
+
+    # The selected period is drawn last so it's the top bar of each row
     fig = go.Figure(data=[
-        go.Pie(
-            labels=spending_df['description'],
-            values=spending_df['totalAmount'],
-            hole=0.5
+        go.Bar(
+            y=top_df['name'],
+            x=top_df[f'period{i}'],
+            name=f'{first} to {last}',
+            orientation='h',
+            hovertemplate='%{y}<br>$%{x:,.2f}'
         )
+        for i, (first, last) in reversed(list(enumerate(periods)))
     ])
-    fig.update_traces(
-        hoverinfo='label+value+percent',
-        textinfo='label+value',
-        textposition='inside',
-    )
     fig.update_layout(
-        uniformtext_minsize=12,
-        uniformtext_mode='hide',
-        height=600,
-        showlegend=False
+        barmode='group',
+        height=max(400, 40 * len(top_df) * len(periods) ** 0.5),
+        legend={'traceorder': 'reversed'},
+        margin={'t': 20}
     )
 
-    return fig
\ No newline at end of file
+    return fig
+
+@callback(
+    Output('comparison-table', 'data'),
+    Output('comparison-table', 'columns'),
+    Output('comparison-table-rendered', 'data'),
+    Input('year-select', 'value'),
+    Input('month-select', 'value'),
+    Input('date-range-select', 'start_date'),
+    Input('date-range-select', 'end_date'),
+    Input('tag-select', 'value'),
+    Input('compare-mode', 'value'),
+    Input('compare-periods', 'value'),
+    Input('compare-group', 'value'),
+    Input('data-version', 'data'),
+    Input('profile-select', 'value'),
+    Input('panel-tabs', 'value'),
+    State('comparison-table-rendered', 'data')
+)
+@lazy_panel('compare')
+@instrument_callback
+def comparison_table(
+    years: list[str]|None,
+    months: list[str]|None,
+    date_select_start: str|None,
+    date_select_end: str|None,
+    tags: list[str]|None,
+    mode: str,
+    count: int,
+    group: str,
+    data_version: int|None
+) -> tuple[list[dict], list[dict]]:
+    """
+    Lists the spending of every row in the selected period and the periods
+    before it, with how much it changed.
+
+    Params:
+        years: The years selected in the year-select dropdown.
+        months: The months selected in the month-select dropdown.
+        date_select_start: The start date of the date-range-select picker.
+        date_select_end: The end date of the date-range-select picker.
+        tags: The tags selected in the tag-select dropdown.
+        mode: The value of the compare-mode dropdown.
+        count: The number of earlier periods from the compare-periods dropdown.
+        group: The value of the compare-group dropdown.
+        data_version: The version of the data from the sync scheduler, this
+            only triggers a requery when new data has been synced.
+
+    Returns:
+        list[dict]: A row for each name.
+        list[dict]: The columns of the table, named after the dates of the
+            periods.
+    """
+
+    periods, comparison_df = get_period_comparison(
+        years, months, date_select_start, date_select_end, tags, mode, count, group, data_version
+    )
+
+    columns = [{'name': 'Name', 'id': 'name'}]
+    columns += [
+        {'name': f'{first} to {last}', 'id': f'period{i}', 'type': 'numeric'}
+        for i, (first, last) in enumerate(periods)
+    ]
+    columns += [
+        {'name': 'Average Before', 'id': 'average', 'type': 'numeric'},
+        {'name': 'Change', 'id': 'change', 'type': 'numeric'},
+        {'name': 'Change %', 'id': 'changePercent', 'type': 'numeric'}
+    ]
+
+    return comparison_df.to_dict('records'), columns
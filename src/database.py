@@ -3,26 +3,146 @@ This file contains the code which is used to setup and manipulate the SQLite3
 database used to store all of the financial data for the dashboard.
 """
 
+import os
 import sqlite3
 import pandas as pd
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, timedelta
 from threading import Lock
+from typing import Iterator
 
-# SQLite3 database file name
-DB_FILE = "finance.db"
+from config import get_config
+from merchants import get_merchants
+from metrics import increment, query_timer, timer
+from timestamps import local_date_sql, register_functions
 
-# Create a connection to the database
-DB_CONN = sqlite3.connect(DB_FILE, check_same_thread=False)
+class Connection(sqlite3.Connection):
+    """
+    An SQLite3 connection with its own write lock, so writes to different
+    databases never wait on each other.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_lock = Lock()
+
+def connect(database: str) -> Connection:
+    """
+    Opens a connection to a database.
+
+    Params:
+        database: A file path, ":memory:" for a private in-memory database, or an
+            SQLite URI such as "file:bench?mode=memory&cache=shared" for an
+            in-memory database shared by every connection using the same URI.
+
+    Returns:
+        Connection: The connection to the database.
+    """
+
+    # Wait up to timeout seconds for another connection's write lock
+    conn = sqlite3.connect(
+        database,
+        check_same_thread=False,
+        timeout=30,
+        uri=database.startswith('file:'),
+        factory=Connection
+    )
+
+    # Write ahead logging lets other processes keep reading while one is writing,
+    # it isn't available for in-memory databases
+    if database != ':memory:' and 'mode=memory' not in database:
+        conn.execute('PRAGMA journal_mode=WAL')
+
+    # Lets queries group by the day in the configured local time zone
+    register_functions(conn)
+
+    return conn
+
+# Connection to the configured database and the id of the process which opened it
+_CONNECTION = None
+_CONNECTION_PID = None
+
+# Connection set by use_database, this overrides the configured database
+_CURRENT = ContextVar('current_connection', default=None)
+
+def get_connection() -> Connection:
+    """
+    Gets the connection to use when one isn't passed explicitly. This is the
+    connection set by use_database if there is one, otherwise the connection to
+    the configured database, which is opened on first use. Every process serving
+    the app has its own connection, so a connection inherited from a parent
+    process is never reused.
+
+    Returns:
+        Connection: The connection to the database.
+    """
+
+    current = _CURRENT.get()
+    if current is not None:
+        return current
+
+    return get_default_connection()
+
+def get_default_connection() -> Connection:
+    """
+    Gets the connection to the configured database, regardless of use_database.
+
+    Returns:
+        Connection: The connection to the database.
+    """
+
+    global _CONNECTION, _CONNECTION_PID
+
+    if _CONNECTION is None or _CONNECTION_PID != os.getpid():
+        _CONNECTION, _CONNECTION_PID = connect(get_config().db_file), os.getpid()
+        _CONNECTION.write_lock = WRITE
+
+    return _CONNECTION
+
+@contextmanager
+def use_database(database: str|Connection) -> Iterator[Connection]:
+    """
+    Context manager which makes every database function called inside it, in the
+    same thread, use a different database. This is how tests and benchmarks run
+    against isolated databases, several of which can be used at once from
+    different threads.
+
+    Params:
+        database: A connection, or anything accepted by connect. A connection
+            opened here is closed on exit and has the tables created.
+
+    Returns:
+        Connection: The connection being used.
+    """
+
+    conn = connect(database) if isinstance(database, str) else database
+    if isinstance(database, str):
+        db_init(conn)
 
-# Write lock
+    token = _CURRENT.set(conn)
+    try:
+        yield conn
+    finally:
+        _CURRENT.reset(token)
+        if isinstance(database, str):
+            conn.close()
+
+# Write lock of the configured database
 WRITE = Lock()
 
-def db_init():
+def db_init(conn: Connection|None=None):
     """
     Creates the database tables if they don't already exist.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
     """
 
-    with WRITE:
-        cur = DB_CONN.cursor()
+    conn = conn or get_connection()
+
+    with conn.write_lock:
+        cur = conn.cursor()
 
         # Create the Accounts table
         cur.execute(
@@ -67,6 +187,8 @@ def db_init():
                 transferAccount TEXT,
                 category TEXT,
                 parentCategory TEXT,
+                rowHash TEXT,
+                merchant TEXT,
                 PRIMARY KEY (id),
                 FOREIGN KEY (account) REFERENCES Accounts(id),
                 FOREIGN KEY (transferAccount) REFERENCES Accounts(id)
@@ -74,23 +196,244 @@ def db_init():
             '''
         )
 
+        # Databases created before the hash of each transaction's mutable fields
+        # was stored
+        columns = [column[1] for column in cur.execute('PRAGMA table_info(Transactions)')]
+        if 'rowHash' not in columns:
+            cur.execute('ALTER TABLE Transactions ADD COLUMN rowHash TEXT')
+
+        # Databases created before descriptions were normalised into merchants,
+        # whose merchants are filled in below once every table exists
+        backfill_merchants = 'merchant' not in columns
+        if backfill_merchants:
+            cur.execute('ALTER TABLE Transactions ADD COLUMN merchant TEXT')
+
+        # Index used to page through transactions in date order
+        cur.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_createdAt
+            ON Transactions (createdAt)
+            '''
+        )
+
+        # Index used to read only the recently settled transactions
+        cur.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_settledAt
+            ON Transactions (settledAt)
+            '''
+        )
+
+        # Index used to group transactions by merchant
+        cur.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_merchant
+            ON Transactions (merchant)
+            '''
+        )
+
+        # Partial index of only the held transactions of each account
+        cur.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_transactions_held
+            ON Transactions (account, amount)
+            WHERE status = "HELD"
+            '''
+        )
+
+        # Create the DailyTotals table, a daily pre-aggregation of Transactions
+        # used by the time-series charts
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS DailyTotals (
+                day TEXT,
+                income INTEGER,
+                spending INTEGER,
+                PRIMARY KEY (day)
+            )
+            '''
+        )
+
+        # Create the DailyBalances table, the end of day balance of each account
+        # on every day its balance changed
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS DailyBalances (
+                account TEXT,
+                day TEXT,
+                balance INTEGER,
+                PRIMARY KEY (account, day),
+                FOREIGN KEY (account) REFERENCES Accounts(id)
+            )
+            '''
+        )
+
+        # Create the Categories table, the Up category hierarchy
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS Categories (
+                id TEXT,
+                name TEXT,
+                parent TEXT,
+                PRIMARY KEY (id),
+                FOREIGN KEY (parent) REFERENCES Categories(id)
+            )
+            '''
+        )
+
+        # Create the CategoryTotals table, a daily pre-aggregation of spending by
+        # parent category, category and merchant used by the spending sunburst
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS CategoryTotals (
+                day TEXT,
+                parentCategory TEXT,
+                category TEXT,
+                merchant TEXT,
+                amount INTEGER
+            )
+            '''
+        )
+        cur.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_category_totals_day
+            ON CategoryTotals (day)
+            '''
+        )
+
+        # Create the SyncState table, values which need to persist between syncs
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS SyncState (
+                key TEXT,
+                value TEXT,
+                PRIMARY KEY (key)
+            )
+            '''
+        )
+
+        # Create the RecurringMerchants table, running statistics of the payments
+        # to each merchant used to detect recurring payments
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS RecurringMerchants (
+                merchant TEXT,
+                description TEXT,
+                firstSeen TEXT,
+                lastSeen TEXT,
+                lastDay REAL,
+                lastAmount INTEGER,
+                payments INTEGER,
+                amountMean REAL,
+                amountM2 REAL,
+                intervals INTEGER,
+                intervalMean REAL,
+                intervalM2 REAL,
+                PRIMARY KEY (merchant)
+            )
+            '''
+        )
+
+        # Create the TransactionChanges table, an append-only log of every insert
+        # into and field changed in Transactions, in the order they happened
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS TransactionChanges (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                transactionId TEXT,
+                operation TEXT,
+                field TEXT,
+                oldValue,
+                newValue,
+                changedAt TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+            )
+            '''
+        )
+
+        # Create the MonthDigests table, a digest of the transactions created in
+        # each month used to find months which differ from the API
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS MonthDigests (
+                month TEXT,
+                digest TEXT,
+                transactions INTEGER,
+                seq INTEGER,
+                PRIMARY KEY (month)
+            )
+            '''
+        )
+
+        # Create the Merchants table, the canonical merchant of every description
+        # seen, indexed by the normalised key descriptions are matched on
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS Merchants (
+                description TEXT,
+                key TEXT,
+                merchant TEXT,
+                PRIMARY KEY (description)
+            )
+            '''
+        )
+        cur.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_merchants_key
+            ON Merchants (key)
+            '''
+        )
+
         # Create the Tags table
-        # DB_CONN.execute(
-        #     '''
-        #     CREATE TABLE IF NOT EXISTS Tags (
-        #         id TEXT,
-        #         transaction TEXT,
-        #         PRIMARY KEY (id),
-        #         FOREIGN KEY (transaction) REFERENCES Transactions(id)
-        #     )
-        #     '''
-        # )
-
-        DB_CONN.commit()
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS Tags (
+                id TEXT,
+                PRIMARY KEY (id)
+            )
+            '''
+        )
+
+        # Create the TransactionTags table joining transactions to their tags,
+        # indexed both ways so either can be looked up from the other
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS TransactionTags (
+                transactionId TEXT,
+                tag TEXT,
+                PRIMARY KEY (transactionId, tag),
+                FOREIGN KEY (transactionId) REFERENCES Transactions(id),
+                FOREIGN KEY (tag) REFERENCES Tags(id)
+            )
+            '''
+        )
+        cur.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_transaction_tags_tag
+            ON TransactionTags (tag, transactionId)
+            '''
+        )
+
+        if backfill_merchants:
+            backfill = pd.DataFrame(
+                cur.execute('SELECT id, description FROM Transactions').fetchall(),
+                columns=['id', 'description']
+            )
+            cur.executemany(
+                'UPDATE Transactions SET merchant = ? WHERE id = ?',
+                zip(get_merchants(cur, backfill['description']), backfill['id'])
+            )
+
+            # The spending and recurring summaries were grouped on descriptions,
+            # so they are rebuilt on the next sync
+            cur.execute('DELETE FROM CategoryTotals')
+            cur.execute('DELETE FROM RecurringMerchants')
+            cur.execute('DELETE FROM SyncState WHERE key = "recurring-watermark"')
+
+        conn.commit()
         cur.close()
 
 
-def write_to_db(table:str, data: pd.DataFrame):
+def write_to_db(table:str, data: pd.DataFrame, conn: Connection|None=None):
     """
     Performs a database insert operation on a specified table.
 
@@ -103,11 +446,15 @@ def write_to_db(table:str, data: pd.DataFrame):
         data: A Pandas DataFrame or Series containing the data to be inserted into
             the specified table. The data should be formatted with the same schema
             as the table it is being inserted into.
+
+        conn: The connection to the database, defaults to get_connection().
     """
-    with WRITE:
-        data.to_sql(table, DB_CONN, index=False, if_exists='append')
+    conn = conn or get_connection()
 
-def read_database(query:str, params: list|None=None) -> pd.DataFrame:
+    with conn.write_lock:
+        data.to_sql(table, conn, index=False, if_exists='append')
+
+def read_database(query:str, params: list|None=None, conn: Connection|None=None, name: str|None=None) -> pd.DataFrame:
     """
     Executes an SQL SELECT query on the database and returns the result as a Pandas
     DataFrame. Expects the query to be a part of the DQL.
@@ -115,37 +462,47 @@ def read_database(query:str, params: list|None=None) -> pd.DataFrame:
     Params:
         query: A string representing the SQL query to be performed on the database.
         params: A list of parameter values to be inserted into the SQL query.
+        conn: The connection to the database, defaults to get_connection().
+        name: The name the query's latency is recorded under in the metrics.
 
     Returns:
         pd.DataFrame: Result of the SQL query.
     """
 
-    return pd.read_sql_query(query, DB_CONN, params=params)
+    conn = conn or get_connection()
+
+    with query_timer(name, query, params, conn):
+        return pd.read_sql_query(query, conn, params=params)
 
-def execute_query(query: str) -> None:
+def execute_query(query: str, conn: Connection|None=None, name: str|None=None) -> None:
     """
     Executes a DML or DDL SQL query on the database.
 
     Params:
         query: A string representing the SQL query to be performed on the database.
+        conn: The connection to the database, defaults to get_connection().
+        name: The name the query's latency is recorded under in the metrics.
     """
-    
-    with WRITE:
-        cur = DB_CONN.cursor()
+
+    conn = conn or get_connection()
+
+    with conn.write_lock, query_timer(name, query, None, conn):
+        cur = conn.cursor()
         cur.execute(query)
-        DB_CONN.commit()
+        conn.commit()
         cur.close()
 
-def upsert_accounts(data: pd.DataFrame):
+def upsert_accounts(data: pd.DataFrame, conn: Connection|None=None):
     """
     Changes the Accounts table to reflect the provided state.
 
     Params:
         data: A Pandas DataFrame with the same schema as the Accounts table. This
             DataFrame should reflect the most current state of accounts.
+        conn: The connection to the database, defaults to get_connection().
     """
 
-    existing_accnts = read_database('SELECT id FROM Accounts')
+    existing_accnts = read_database('SELECT id FROM Accounts', conn=conn, name='account_ids')
 
     for i, row in data.iterrows():
         # If the account is already in the database we need to update
@@ -156,7 +513,8 @@ def upsert_accounts(data: pd.DataFrame):
                 SET displayName = "{row['displayName']}",
                     balance = {row['balance']}
                 WHERE id = "{row['id']}"
-                '''
+                ''',
+                conn=conn
             )
 
             # Drop the existing account so we can check for deleted accounts
@@ -171,7 +529,8 @@ def upsert_accounts(data: pd.DataFrame):
             f'''
             INSERT INTO Accounts (id, displayName, accountType, ownershipType, balance, created)
             VALUES ("{row['id']}", "{row['displayName']}", "{row['accountType']}", "{row['ownershipType']}", {row['balance']}, "{row['created']}")
-            '''
+            ''',
+            conn=conn
         )
 
     # Any accounts left in existing_accounts must have been deleted
@@ -182,13 +541,21 @@ def upsert_accounts(data: pd.DataFrame):
             SET deleted = 1,
                 balance = 0
             WHERE id = "{row['id']}"
-            '''
+            ''',
+            conn=conn
         )
 
-def upsert_transactions(data: pd.DataFrame, new: bool) -> None:
+# Fields of a transaction which can change after it's created
+UPDATE_FIELDS = ['status', 'amount', 'cashbackDesc', 'cashbackAmount', 'settledAt', 'category', 'parentCategory']
+
+# Most parameters bound in a single query
+MAX_PARAMS = 900
+
+def upsert_transactions(data: pd.DataFrame, new: bool, conn: Connection|None=None) -> pd.Series:
     """
     Upserts the Transaction table in the database to reflect changes to transactions
-    in the provided DataFrame.
+    in the provided DataFrame. Existing transactions whose rowHash is the same as
+    the stored one haven't changed, so they aren't written at all.
 
     Params:
         data: A DataFrame containing the transactions to be upserted to the
@@ -198,27 +565,408 @@ def upsert_transactions(data: pd.DataFrame, new: bool) -> None:
             transactions which don't already exist in the Transactions table and
             False if all the transactions provided already exist in the table.
 
+        conn: The connection to the database, defaults to get_connection().
+
     Require:
         data: Must contain only new or not new transactions, there cannot be a
             mixture of transactions which do and don't exist in the database.
+
+    Returns:
+        pd.Series: The ids of the transactions written.
     """
 
-    # New transactions we can simply insert
-    if new:
-        write_to_db('Transactions', data)
-        return
-    
-    # If the transactions are existing we need to update
-    for i, row in data.iterrows():
-        execute_query(
+    conn = conn or get_connection()
+
+    # Tags are stored in the TransactionTags table rather than Transactions
+    tags = data['tags'] if 'tags' in data.columns else None
+    data = data.drop(columns='tags', errors='ignore')
+
+    # Missing values are written as NULL
+    rows = data.astype(object).where(data.notna(), None)
+
+    with conn.write_lock, timer('query_seconds', 'upsert_transactions'):
+        cur = conn.cursor()
+
+        if not new and 'rowHash' in rows.columns:
+            changed = (rows['rowHash'] != rows['id'].map(get_row_hashes(cur, rows['id']))).values
+            increment('transaction_writes_avoided_total', 'upsert_transactions', int((~changed).sum()))
+
+            rows = rows[changed]
+            if tags is not None:
+                tags = tags[changed]
+
+            if rows.empty:
+                cur.close()
+                return rows['id']
+
+        # New transactions we can simply insert
+        if new:
+            rows = rows.assign(merchant=get_merchants(cur, rows['description']).values)
+            cur.executemany(
+                f'''
+                INSERT INTO Transactions ({', '.join(rows.columns)})
+                VALUES ({', '.join('?' for _ in rows.columns)})
+                ''',
+                rows.itertuples(index=False, name=None)
+            )
+
+            cur.executemany(
+                'INSERT INTO TransactionChanges (transactionId, operation) VALUES (?, "insert")',
+                ((transaction_id,) for transaction_id in rows['id'])
+            )
+
+        # If the transactions are existing we need to update
+        else:
+            changes = diff_transactions(cur, rows)
+
+            fields = UPDATE_FIELDS + (['rowHash'] if 'rowHash' in rows.columns else [])
+            cur.executemany(
+                f'''
+                UPDATE Transactions
+                SET {', '.join(f'{field} = ?' for field in fields)}
+                WHERE id = ?
+                ''',
+                rows[fields + ['id']].itertuples(index=False, name=None)
+            )
+            cur.executemany(
+                '''
+                INSERT INTO TransactionChanges (transactionId, operation, field, oldValue, newValue)
+                VALUES (?, "update", ?, ?, ?)
+                ''',
+                changes.itertuples(index=False, name=None)
+            )
+
+        if tags is not None:
+            write_transaction_tags(cur, rows['id'], tags, new)
+
+        conn.commit()
+        cur.close()
+
+    return rows['id']
+
+def delete_transactions(ids: list[str], conn: Connection|None=None) -> None:
+    """
+    Deletes transactions, along with their tags, and logs the deletions in the
+    TransactionChanges table.
+
+    Params:
+        ids: The ids of the transactions to delete.
+        conn: The connection to the database, defaults to get_connection().
+    """
+
+    conn = conn or get_connection()
+
+    with conn.write_lock:
+        cur = conn.cursor()
+        for table, column in [('TransactionTags', 'transactionId'), ('Transactions', 'id')]:
+            cur.executemany(
+                f'DELETE FROM {table} WHERE {column} = ?',
+                ((transaction_id,) for transaction_id in ids)
+            )
+        cur.executemany(
+            'INSERT INTO TransactionChanges (transactionId, operation) VALUES (?, "delete")',
+            ((transaction_id,) for transaction_id in ids)
+        )
+        conn.commit()
+        cur.close()
+
+def get_row_hashes(cur: sqlite3.Cursor, ids: pd.Series) -> pd.Series:
+    """
+    Gets the stored rowHash of some transactions.
+
+    Params:
+        cur: A cursor of the connection being written to.
+        ids: The ids of the transactions.
+
+    Returns:
+        pd.Series: The rowHash of each transaction which exists, indexed by id.
+            Transactions stored before hashes were added have a NULL hash.
+    """
+
+    ids = ids.tolist()
+    hashes = []
+    for i in range(0, len(ids), MAX_PARAMS):
+        chunk = ids[i:i + MAX_PARAMS]
+        cur.execute(
             f'''
-            UPDATE Transactions
-            SET status = "{row['status']}",
-                cashbackDesc = "{row['cashbackDesc']}",
-                cashbackAmount = "{row['cashbackAmount']}",
-                settledAt = "{row['settledAt']}",
-                category = "{row['category']}",
-                parentCategory = "{row['parentCategory']}"
-            WHERE id = "{row['id']}"
+            SELECT id, rowHash
+            FROM Transactions
+            WHERE id IN ({','.join('?' for _ in chunk)})
+            ''',
+            chunk
+        )
+        hashes += cur.fetchall()
+
+    return pd.DataFrame(hashes, columns=['id', 'rowHash']).set_index('id')['rowHash']
+
+def diff_transactions(cur: sqlite3.Cursor, rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    Finds the fields of some existing transactions which differ from their new
+    values.
+
+    Params:
+        cur: A cursor of the connection being written to.
+        rows: The new values of the transactions, with an id column and a
+            column for each of UPDATE_FIELDS.
+
+    Returns:
+        pd.DataFrame: A DataFrame with transactionId, field, oldValue and
+            newValue columns, one row per changed field.
+    """
+
+    ids = rows['id'].tolist()
+    old = []
+    for i in range(0, len(ids), MAX_PARAMS):
+        chunk = ids[i:i + MAX_PARAMS]
+        cur.execute(
+            f'''
+            SELECT id, {', '.join(UPDATE_FIELDS)}
+            FROM Transactions
+            WHERE id IN ({','.join('?' for _ in chunk)})
+            ''',
+            chunk
+        )
+        old += cur.fetchall()
+
+    old_df = pd.DataFrame(old, columns=['id'] + UPDATE_FIELDS).set_index('id')
+    old_df = old_df.reindex(rows['id']).melt(ignore_index=False, var_name='field', value_name='oldValue')
+    new_df = rows.set_index('id')[UPDATE_FIELDS].melt(ignore_index=False, var_name='field', value_name='newValue')
+
+    diff_df = old_df.reset_index()
+    diff_df['newValue'] = new_df['newValue'].values
+
+    # Missing values are equal to each other
+    missing = diff_df['oldValue'].isna() & diff_df['newValue'].isna()
+    changed = diff_df[(diff_df['oldValue'] != diff_df['newValue']) & ~missing]
+
+    changed = changed.rename(columns={'id': 'transactionId'})[
+        ['transactionId', 'field', 'oldValue', 'newValue']
+    ]
+
+    return changed.astype(object).where(changed.notna(), None)
+
+def get_changes_since(seq: int, limit: int|None=None, conn: Connection|None=None) -> pd.DataFrame:
+    """
+    Gets the changes made to the Transactions table after a point in the
+    TransactionChanges log. A consumer remembers the seq of the last change it
+    processed and asks for the changes since then.
+
+    Params:
+        seq: The seq of the last change already processed, 0 for every change.
+        limit: The most changes to return.
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        pd.DataFrame: The changes in the order they were made, with seq,
+            transactionId, operation, field, oldValue, newValue and changedAt
+            columns. field, oldValue and newValue are NULL for inserts and
+            deletes.
+    """
+
+    return read_database(
+        '''
+        SELECT *
+        FROM TransactionChanges
+        WHERE seq > ?
+        ORDER BY seq
+        LIMIT ?
+        ''',
+        params=[seq, -1 if limit is None else limit],
+        conn=conn,
+        name='changes_since'
+    )
+
+def get_latest_change_seq(conn: Connection|None=None) -> int:
+    """
+    Gets the seq of the most recent change in the TransactionChanges log.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        int: The seq of the latest change, or 0 if there are none.
+    """
+
+    return int(read_database(
+        'SELECT COALESCE(MAX(seq), 0) FROM TransactionChanges', conn=conn, name='latest_change_seq'
+    ).iloc[0][0])
+
+def write_transaction_tags(cur: sqlite3.Cursor, ids: pd.Series, tags: pd.Series, new: bool) -> None:
+    """
+    Replaces the tags of some transactions. This is part of the transaction of
+    the caller, which is responsible for locking and committing.
+
+    Params:
+        cur: A cursor of the connection being written to.
+        ids: The ids of the transactions.
+        tags: The list of tag ids of each transaction, in the same order as ids.
+        new: Whether the transactions are new, so have no existing tags.
+    """
+
+    pairs = pd.DataFrame({'transactionId': ids.values, 'tag': tags.values}).explode('tag').dropna()
+
+    if not new:
+        cur.executemany(
+            'DELETE FROM TransactionTags WHERE transactionId = ?',
+            ((transaction_id,) for transaction_id in ids)
+        )
+
+    cur.executemany(
+        'INSERT OR IGNORE INTO Tags (id) VALUES (?)',
+        ((tag,) for tag in pairs['tag'].unique())
+    )
+    cur.executemany(
+        'INSERT OR IGNORE INTO TransactionTags (transactionId, tag) VALUES (?, ?)',
+        pairs.itertuples(index=False, name=None)
+    )
+
+    # Tags which are no longer on any transaction
+    if not new:
+        cur.execute(
             '''
-        )
\ No newline at end of file
+            DELETE FROM Tags
+            WHERE NOT EXISTS (
+                SELECT 1 FROM TransactionTags WHERE TransactionTags.tag = Tags.id
+            )
+            '''
+        )
+
+def get_sync_state(key: str, conn: Connection|None=None) -> str|None:
+    """
+    Gets a value from the SyncState table.
+
+    Params:
+        key: The key of the value.
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        str|None: The value, or None if it hasn't been set.
+    """
+
+    state_df = read_database(
+        'SELECT value FROM SyncState WHERE key = ?', params=[key], conn=conn, name='sync_state'
+    )
+
+    return None if state_df.empty else state_df.iloc[0][0]
+
+def replace_categories(data: pd.DataFrame, digest: str, conn: Connection|None=None) -> None:
+    """
+    Replaces the contents of the Categories table and records the digest of the
+    API response they came from, in a single transaction.
+
+    Params:
+        data: A DataFrame with the same schema as the Categories table.
+        digest: The digest of the categories response.
+        conn: The connection to the database, defaults to get_connection().
+    """
+
+    conn = conn or get_connection()
+
+    with conn.write_lock:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM Categories')
+        cur.executemany(
+            'INSERT INTO Categories (id, name, parent) VALUES (?, ?, ?)',
+            data[['id', 'name', 'parent']].itertuples(index=False, name=None)
+        )
+        cur.execute(
+            'INSERT OR REPLACE INTO SyncState (key, value) VALUES ("categories-digest", ?)',
+            (digest,)
+        )
+        conn.commit()
+        cur.close()
+
+# Conditions a settled transaction must meet to be counted as income or spending,
+# these are also run by DuckDB so only use SQL valid in both
+# ToDo: Think of a better way to filter out payments to investment account
+INCOME_CONDITION = "(amount > 0 AND (isCategorizable = 1 OR lower(description) LIKE '%interest%'))"
+SPENDING_CONDITION = "(amount < 0 AND isCategorizable = 1 AND description != 'CMC Investment Accnt')"
+
+def refresh_daily_totals(since: str|None=None, conn: Connection|None=None) -> None:
+    """
+    Rebuilds the DailyTotals table from the Transactions table. Only settled
+    transactions are counted, using the same rules as the income and spending
+    charts on the dashboard.
+
+    Params:
+        since: A string in "YYYY-MM-DD" format. If provided only the days on or
+            after this date are rebuilt, otherwise the whole table is rebuilt.
+            The whole table is also rebuilt if it's empty.
+        conn: The connection to the database, defaults to get_connection().
+    """
+
+    conn = conn or get_connection()
+
+    if read_database('SELECT 1 FROM DailyTotals LIMIT 1', conn=conn, name='daily_totals_exist').empty:
+        since = None
+
+    # settledAt is compared as a string first, with a day of margin for time
+    # zones, so the settledAt index can skip most of the table
+    earliest = str(date.fromisoformat(since) - timedelta(days=1)) if since else ''
+    since = since or ''
+
+    with conn.write_lock, timer('query_seconds', 'refresh_daily_totals'):
+        cur = conn.cursor()
+        cur.execute('DELETE FROM DailyTotals WHERE day >= ?', (since,))
+        cur.execute(
+            f'''
+            INSERT INTO DailyTotals (day, income, spending)
+            SELECT {local_date_sql('settledAt')} AS day,
+                SUM(CASE WHEN {INCOME_CONDITION} THEN amount ELSE 0 END),
+                SUM(CASE WHEN {SPENDING_CONDITION} THEN amount ELSE 0 END)
+            FROM Transactions
+            WHERE status = "SETTLED"
+                AND settledAt >= ?
+                AND {local_date_sql('settledAt')} >= ?
+            GROUP BY day
+            ''',
+            (earliest, since)
+        )
+        conn.commit()
+        cur.close()
+
+def refresh_category_totals(since: str|None=None, conn: Connection|None=None) -> None:
+    """
+    Rebuilds the CategoryTotals table from the Transactions table. Only settled
+    spending is counted, using the same rules as the spending chart on the
+    dashboard.
+
+    Params:
+        since: A string in "YYYY-MM-DD" format. If provided only the days on or
+            after this date are rebuilt, otherwise the whole table is rebuilt.
+            The whole table is also rebuilt if it's empty.
+        conn: The connection to the database, defaults to get_connection().
+    """
+
+    conn = conn or get_connection()
+
+    if read_database('SELECT 1 FROM CategoryTotals LIMIT 1', conn=conn, name='category_totals_exist').empty:
+        since = None
+
+    # settledAt is compared as a string first, with a day of margin for time
+    # zones, so the settledAt index can skip most of the table
+    earliest = str(date.fromisoformat(since) - timedelta(days=1)) if since else ''
+    since = since or ''
+
+    with conn.write_lock, timer('query_seconds', 'refresh_category_totals'):
+        cur = conn.cursor()
+        cur.execute('DELETE FROM CategoryTotals WHERE day >= ?', (since,))
+        cur.execute(
+            f'''
+            INSERT INTO CategoryTotals (day, parentCategory, category, merchant, amount)
+            SELECT {local_date_sql('settledAt')} AS day,
+                parentCategory,
+                category,
+                merchant,
+                SUM(amount)
+            FROM Transactions
+            WHERE status = "SETTLED"
+                AND {SPENDING_CONDITION}
+                AND settledAt >= ?
+                AND {local_date_sql('settledAt')} >= ?
+            GROUP BY day, parentCategory, category, merchant
+            ''',
+            (earliest, since)
+        )
+        conn.commit()
+        cur.close()
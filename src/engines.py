@@ -0,0 +1,493 @@
+"""
+This file contains the query engines the dashboard's aggregations are run on.
+SQLite reads a row at a time, which is what point lookups and writes need but is
+slow when summing years of transactions. When query_engine is 'duckdb' the
+aggregations which scan the Transactions table are run by DuckDB instead, which
+is columnar and vectorised, over a Parquet export of the tables they read.
+Everything else, including every write, still uses SQLite.
+
+The export of each profile is written to its own directory in export_dir after
+each sync. Transactions are partitioned by the year they were created in, which
+keeps the number of files DuckDB opens per query low, and only the years with
+changes in the TransactionChanges log since the last export are rewritten. The
+local day of each timestamp is worked out when exporting, as DuckDB has no
+local_date function.
+
+Each export writes its partitions as new files and then lists every current
+file in a manifest, which is replaced in one step. DuckDB only reads the files
+in the manifest, so a query sees either the whole of one export or the whole of
+the next, never a year missing part way through a swap.
+
+DuckDB is optional, and is only imported once the DuckDB engine is enabled.
+Without it installed, or before the first export, every query is run on SQLite. A query which fails on DuckDB, e.g. because a newer
+export removed a file it was about to read, is rerun on SQLite.
+
+Every export is written with the types declared in the SQLite schema, as pandas
+can't tell an INTEGER column with NULLs from a REAL one or type an empty column.
+"""
+
+import json
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+from functools import lru_cache
+from threading import Lock
+from types import ModuleType
+from typing import TYPE_CHECKING, Callable
+
+import pandas as pd
+
+if TYPE_CHECKING:
+    import duckdb
+
+from config import get_config
+from database import (
+    Connection, get_changes_since, get_connection, get_latest_change_seq, get_sync_state, read_database
+)
+from metrics import increment, query_timer, timer
+from profiles import get_db_file
+from timestamps import local_date_sql, to_local_dates
+
+logger = logging.getLogger(__name__)
+
+# Tables exported whole, alongside the partitioned Transactions table
+EXPORT_TABLES = ['TransactionTags', 'Categories']
+
+# Timestamp columns whose local day is exported as <column>Date
+DATE_COLUMNS = ['settledAt', 'createdAt']
+
+# File in the export directory listing the Parquet files of the Transactions
+# table, relative to the directory
+MANIFEST = 'Transactions.json'
+
+# DuckDB engine of each export directory and the id of the process which
+# opened them
+_ENGINES = {}
+_ENGINES_PID = None
+_ENGINES_LOCK = Lock()
+
+class SQLiteEngine:
+    """
+    Runs queries on the SQLite database of the current profile.
+    """
+
+    name = 'sqlite'
+
+    def local_date_sql(self, column: str) -> str:
+        """
+        Params:
+            column: The name of a timestamp column.
+
+        Returns:
+            str: The SQL expression of the local day the column falls on.
+        """
+
+        return local_date_sql(column)
+
+    def read(self, query: str, params: list|None=None, name: str|None=None) -> pd.DataFrame:
+        """
+        Runs a query.
+
+        Params:
+            query: The SQL SELECT query.
+            params: The parameter values of the query.
+            name: The name the query's latency is recorded under in the metrics.
+
+        Returns:
+            pd.DataFrame: The result of the query.
+        """
+
+        return read_database(query, params=params, name=name)
+
+class DuckDBEngine:
+    """
+    Runs queries with DuckDB on the Parquet export of a profile's database. The
+    exported tables are views with the same names as the SQLite tables.
+    """
+
+    name = 'duckdb'
+
+    def __init__(self, directory: str):
+        """
+        Params:
+            directory: The export directory of the profile.
+        """
+
+        self.directory = directory
+        self.conn = get_duckdb().connect()
+
+        # Files the Transactions view currently reads
+        self.files = None
+        self.lock = Lock()
+
+        for table in EXPORT_TABLES:
+            path = quote_path(os.path.join(directory, f'{table}.parquet'))
+            self.conn.execute(f'CREATE VIEW {table} AS SELECT * FROM read_parquet({path})')
+
+    def local_date_sql(self, column: str) -> str:
+        """
+        Params:
+            column: The name of one of the DATE_COLUMNS.
+
+        Returns:
+            str: The exported column of the local day the column falls on.
+        """
+
+        return f'{column}Date'
+
+    def refresh(self) -> None:
+        """
+        Points the Transactions view at the files in the manifest, if they've
+        changed since the view was created.
+        """
+
+        files = read_manifest(self.directory) or []
+
+        with self.lock:
+            if files != self.files:
+                paths = ', '.join(quote_path(os.path.join(self.directory, file)) for file in files)
+                self.conn.execute(f'''
+                    CREATE OR REPLACE VIEW Transactions AS
+                    SELECT * FROM read_parquet(
+                        [{paths}]::VARCHAR[],
+                        hive_partitioning = true,
+                        hive_types_autocast = false
+                    )
+                ''')
+                self.files = files
+
+    def read(self, query: str, params: list|None=None, name: str|None=None) -> pd.DataFrame:
+        """
+        Runs a query on a cursor of its own, as a DuckDB connection can't be
+        shared between threads. The view of the Transactions table is brought
+        up to date with the latest export first.
+
+        Params:
+            query: The SQL SELECT query.
+            params: The parameter values of the query.
+            name: The name the query's latency is recorded under in the metrics.
+
+        Returns:
+            pd.DataFrame: The result of the query.
+        """
+
+        self.refresh()
+
+        cur = self.conn.cursor()
+        try:
+            with query_timer(f'duckdb.{name or "unnamed"}', query, params, None):
+                return cur.execute(query, params or []).fetchdf()
+        finally:
+            cur.close()
+
+SQLITE = SQLiteEngine()
+
+def quote_path(path: str) -> str:
+    """
+    Params:
+        path: A file or directory path.
+
+    Returns:
+        str: The path as a DuckDB string literal.
+    """
+
+    return "'" + path.replace("'", "''") + "'"
+
+def select_sql(table: str, columns: list[str], conn: Connection) -> str:
+    """
+    Builds the columns of a DuckDB SELECT which casts each column of a
+    DataFrame read from a table to the type it's declared as.
+
+    Params:
+        table: The name of the table.
+        columns: The columns of the DataFrame, any not in the table are text.
+        conn: The connection to the database.
+
+    Returns:
+        str: The cast columns, separated by commas.
+    """
+
+    types = {
+        column: 'BIGINT' if declared.upper() == 'INTEGER' else 'VARCHAR'
+        for column, declared in conn.execute('SELECT name, type FROM pragma_table_info(?)', (table,)).fetchall()
+    }
+
+    return ', '.join(f'CAST("{column}" AS {types.get(column, "VARCHAR")}) AS "{column}"' for column in columns)
+
+def read_manifest(directory: str) -> list[str]|None:
+    """
+    Params:
+        directory: The export directory of the profile.
+
+    Returns:
+        list: The Parquet files of the exported Transactions table, relative to
+            the directory, or None if it hasn't been exported.
+    """
+
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def get_export_dir() -> str:
+    """
+    Returns:
+        str: The export directory of the current profile, which is named after
+            its database file.
+    """
+
+    stem = os.path.splitext(os.path.basename(get_db_file()))[0]
+
+    return os.path.join(get_config().export_dir, stem)
+
+@lru_cache(maxsize=None)
+def get_duckdb() -> ModuleType|None:
+    """
+    Imports DuckDB. Importing it is slow so it's left until the DuckDB engine
+    is first used.
+
+    Returns:
+        module: The duckdb module, or None if it isn't installed.
+    """
+
+    try:
+        import duckdb
+    except ImportError:
+        return None
+
+    return duckdb
+
+def duckdb_enabled() -> bool:
+    """
+    Returns:
+        bool: Whether query_engine is 'duckdb' and DuckDB is installed.
+    """
+
+    return get_config().query_engine == 'duckdb' and get_duckdb() is not None
+
+def get_engine() -> SQLiteEngine|DuckDBEngine:
+    """
+    Gets the engine aggregations of the current profile are run on.
+
+    Returns:
+        SQLiteEngine|DuckDBEngine: The DuckDB engine if it's enabled and the
+            profile has been exported, otherwise SQLite.
+    """
+
+    global _ENGINES, _ENGINES_PID
+
+    if not duckdb_enabled():
+        return SQLITE
+
+    directory = get_export_dir()
+    if not os.path.isfile(os.path.join(directory, MANIFEST)):
+        return SQLITE
+
+    with _ENGINES_LOCK:
+        if _ENGINES_PID != os.getpid():
+            _ENGINES, _ENGINES_PID = {}, os.getpid()
+
+        if directory not in _ENGINES:
+            _ENGINES[directory] = DuckDBEngine(directory)
+
+        return _ENGINES[directory]
+
+def read_aggregate(
+    query: Callable[[SQLiteEngine|DuckDBEngine], str],
+    params: list|None=None,
+    name: str|None=None,
+    scan: bool=True
+) -> pd.DataFrame:
+    """
+    Runs an aggregation over the Transactions table on the configured engine.
+    The query must be valid in both SQLite and DuckDB, so strings are quoted
+    with single quotes and bare columns aren't allowed in a GROUP BY.
+
+    Params:
+        query: Builds the SQL of the query for an engine, which gives the local
+            day of a timestamp column with its local_date_sql method.
+        params: The parameter values of the query.
+        name: The name the query's latency is recorded under in the metrics.
+        scan: Whether the query reads most of the table. Queries which an index
+            narrows down to a few rows, e.g. filtering on tags, are faster on
+            SQLite and are always run there.
+
+    Returns:
+        pd.DataFrame: The result of the query.
+    """
+
+    engine = get_engine() if scan else SQLITE
+    if engine is not SQLITE:
+        try:
+            return engine.read(query(engine), params, name)
+        except get_duckdb().Error as e:
+            logger.warning('Query %s failed on DuckDB, rerunning on SQLite: %s', name or 'unnamed', e)
+            increment('engine_fallback_total', name or 'unnamed')
+
+    return SQLITE.read(query(SQLITE), params, name)
+
+def write_transactions(db: 'duckdb.DuckDBPyConnection', directory: str, years: list[str]|None, conn: Connection) -> None:
+    """
+    Exports the transactions created in some years. The new partitions are
+    written to new files and swapped in all at once by replacing the manifest,
+    after which the files it no longer lists are removed. The manifest is
+    removed instead if there are no transactions.
+
+    Params:
+        db: The DuckDB connection to write with.
+        directory: The export directory of the profile.
+        years: The years in "YYYY" format, or None for every year.
+        conn: The connection to the database.
+    """
+
+    where, params = '1', []
+    if years is not None:
+        where = 'substr(createdAt, 1, 4) IN (SELECT value FROM json_each(?))'
+        params = [json.dumps(years)]
+
+    rows = read_database(f'SELECT * FROM Transactions WHERE {where}', params=params, conn=conn, name='export_transactions')
+    for column in DATE_COLUMNS:
+        present = rows[column].notna()
+        rows[f'{column}Date'] = None
+        rows.loc[present, f'{column}Date'] = to_local_dates(rows.loc[present, column]).values
+    rows['year'] = rows['createdAt'].str[:4]
+
+    transactions_dir = os.path.join(directory, 'Transactions')
+    os.makedirs(transactions_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=directory)
+    try:
+        if not rows.empty:
+            db.register('rows', rows)
+            db.execute(f'''
+                COPY (SELECT {select_sql('Transactions', rows.columns, conn)} FROM rows)
+                TO {quote_path(staging)} (FORMAT parquet, PARTITION_BY (year))
+            ''')
+            db.unregister('rows')
+
+        # The files of the years which aren't being rewritten are kept
+        files = []
+        if years is not None:
+            files = [
+                file for file in read_manifest(directory) or []
+                if os.path.basename(os.path.dirname(file)).removeprefix('year=') not in years
+            ]
+
+        # Each export's files have a name of their own, so none of the files
+        # in the current manifest are overwritten
+        version = secrets.token_hex(8)
+        for partition in os.listdir(staging):
+            os.makedirs(os.path.join(transactions_dir, partition), exist_ok=True)
+            for i, name in enumerate(sorted(os.listdir(os.path.join(staging, partition)))):
+                file = os.path.join('Transactions', partition, f'{version}-{i}.parquet')
+                os.rename(os.path.join(staging, partition, name), os.path.join(directory, file))
+                files.append(file)
+
+        manifest = os.path.join(directory, MANIFEST)
+        if files:
+            with open(f'{manifest}.tmp', 'w') as f:
+                json.dump(sorted(files), f)
+            os.replace(f'{manifest}.tmp', manifest)
+        elif os.path.exists(manifest):
+            os.remove(manifest)
+
+        for partition in os.listdir(transactions_dir):
+            for name in os.listdir(os.path.join(transactions_dir, partition)):
+                if os.path.join('Transactions', partition, name) not in files:
+                    os.remove(os.path.join(transactions_dir, partition, name))
+            if not os.listdir(os.path.join(transactions_dir, partition)):
+                os.rmdir(os.path.join(transactions_dir, partition))
+    finally:
+        shutil.rmtree(staging)
+
+def write_table(db: 'duckdb.DuckDBPyConnection', directory: str, table: str, conn: Connection) -> None:
+    """
+    Exports a whole table to a single Parquet file, replacing the previous
+    export of it.
+
+    Params:
+        db: The DuckDB connection to write with.
+        directory: The export directory of the profile.
+        table: The name of the table.
+        conn: The connection to the database.
+    """
+
+    rows = read_database(f'SELECT * FROM {table}', conn=conn, name=f'export_{table.lower()}')
+    path = os.path.join(directory, f'{table}.parquet')
+
+    db.register('rows', rows)
+    db.execute(f'COPY (SELECT {select_sql(table, rows.columns, conn)} FROM rows) TO {quote_path(path + ".tmp")} (FORMAT parquet)')
+    db.unregister('rows')
+    os.replace(f'{path}.tmp', path)
+
+def export_tables(full: bool=False, conn: Connection|None=None) -> None:
+    """
+    Brings the current profile's Parquet export up to date with its database.
+    Nothing is exported unless the DuckDB engine is enabled.
+
+    Params:
+        full: Whether to rewrite every year, rather than only the years with
+            changes since the last export. Every year is also rewritten on the
+            first export or when the local_tz has changed.
+        conn: The connection to the database, defaults to get_connection().
+    """
+
+    if not duckdb_enabled():
+        return
+
+    conn = conn or get_connection()
+    directory = get_export_dir()
+    local_tz = get_config().local_tz
+
+    # Changes made while exporting are picked up by the next export
+    seq = get_latest_change_seq(conn)
+    exported_seq = get_sync_state('export-seq', conn)
+    full = (
+        full
+        or exported_seq is None
+        or get_sync_state('export-local-tz', conn) != local_tz
+        or read_manifest(directory) is None
+    )
+
+    with timer('sync_phase_seconds', 'export'), get_duckdb().connect() as db:
+        years = None
+        if not full:
+            ids = get_changes_since(int(exported_seq), conn=conn)['transactionId'].unique().tolist()
+
+            # Deleted transactions are only in the export, so their years are
+            # found there
+            years = set(read_database(
+                '''
+                SELECT DISTINCT substr(createdAt, 1, 4) AS year
+                FROM Transactions
+                WHERE id IN (SELECT value FROM json_each(?))
+                ''',
+                params=[json.dumps(ids)],
+                conn=conn,
+                name='export_changed_years'
+            )['year'])
+            if ids:
+                paths = ', '.join(quote_path(os.path.join(directory, file)) for file in read_manifest(directory))
+                years.update(row[0] for row in db.execute(
+                    f'''
+                    SELECT DISTINCT year
+                    FROM read_parquet([{paths}], hive_partitioning = true, hive_types_autocast = false)
+                    WHERE id IN (SELECT unnest(?::VARCHAR[]))
+                    ''',
+                    [ids]
+                ).fetchall())
+
+        os.makedirs(directory, exist_ok=True)
+        if years is None or years:
+            write_transactions(db, directory, None if years is None else sorted(years), conn)
+        for table in EXPORT_TABLES:
+            write_table(db, directory, table, conn)
+
+    with conn.write_lock:
+        conn.executemany(
+            'INSERT OR REPLACE INTO SyncState (key, value) VALUES (?, ?)',
+            [('export-seq', str(seq)), ('export-local-tz', local_tz)]
+        )
+        conn.commit()
@@ -0,0 +1,56 @@
+"""
+Gunicorn configuration for serving the FinanceTracker application in production.
+Run from the root of the repository with:
+
+    gunicorn --config src/gunicorn.conf.py wsgi:server
+
+Each setting can be overridden with the environment variable named next to it.
+"""
+
+import fcntl
+import multiprocessing
+import os
+
+# Load the app from the src directory
+pythonpath = 'src'
+
+bind = os.environ.get('BIND', '127.0.0.1:8050')
+
+# Dash callbacks are mostly CPU bound (pandas and figure serialisation) so one
+# worker process per core is used to get past the GIL. Each worker also runs a
+# few threads so slow database reads don't leave a core idle.
+workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('THREADS', 4))
+worker_class = 'gthread'
+
+# The app must be loaded in each worker rather than in the master, otherwise
+# every worker would share the master's SQLite connection after forking
+preload_app = False
+
+timeout = 60
+
+# Lock file held by the worker which runs the sync scheduler
+SCHEDULER_LOCK_FILE = os.environ.get('SCHEDULER_LOCK_FILE', 'scheduler.lock')
+
+def post_worker_init(worker):
+    """
+    Starts the sync scheduler in exactly one worker. Every worker tries to take
+    an exclusive lock on SCHEDULER_LOCK_FILE and only the one that gets it syncs.
+    The lock is released when that worker exits, so the next worker started in
+    its place takes over.
+    """
+
+    lock_file = open(SCHEDULER_LOCK_FILE, 'w')
+
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return
+
+    # Keep the file open for the life of the worker to hold the lock
+    worker.scheduler_lock = lock_file
+
+    from scheduler import SCHEDULER
+    SCHEDULER.start()
+    worker.log.info('Worker %s is running the sync scheduler', worker.pid)
@@ -1,11 +1,27 @@
 """
-This file contains functions used for handling secrets stored in 
+This file contains functions used for handling secrets stored in
 ./src/secrets.json.
 """
 
 import json
+from functools import lru_cache
 from typing import Any
 
+from config import get_config
+
+@lru_cache(maxsize=None)
+def load_secrets() -> dict[str, Any]:
+    """
+    Reads the secrets file. The file is only read on the first call, every later
+    call returns the same dictionary.
+
+    Returns:
+        dict: The contents of the secrets file.
+    """
+
+    with open(get_config().secrets_file) as f:
+        return json.load(f)
+
 def get_secret(key: str, sub_key: str) -> Any:
     """
     Retrieves a secret from the secrets.json file.
@@ -19,6 +35,4 @@ def get_secret(key: str, sub_key: str) -> Any:
         any: Returns the value of the specified secret from the .json file.
     """
 
-    with open('./src/secrets.json') as f:
-        data = json.load(f)
-    return data[key][sub_key]
\ No newline at end of file
+    return load_secrets()[key][sub_key]
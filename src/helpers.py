@@ -3,10 +3,14 @@ This file contains miscellaneous helper functions that don't belong in any of
 the other files.
 """
 
-import re
-from datetime import datetime, date, timedelta
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
 
 from database import read_database
+from merchants import EMOJI
+from profiles import merge_profiles
+from timestamps import local_datetime_sql, parse_timestamp
 
 def remove_emojis(text: str) -> str:
     """
@@ -20,96 +24,93 @@ def remove_emojis(text: str) -> str:
             removed.
     """
 
-    emoji = re.compile("["
-    u"\U0001F600-\U0001F64F"  # emoticons
-    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-    u"\U0001F680-\U0001F6FF"  # transport & map symbols
-    u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-    u"\U00002500-\U00002BEF"  # chinese char
-    u"\U00002702-\U000027B0"
-    u"\U00002702-\U000027B0"
-    u"\U000024C2-\U0001F251"
-    u"\U0001f926-\U0001f937"
-    u"\U00010000-\U0010ffff"
-    u"\u2640-\u2642" 
-    u"\u2600-\u2B55"
-    u"\u200d"
-    u"\u23cf"
-    u"\u23e9"
-    u"\u231a"
-    u"\ufe0f"  # dingbats
-    u"\u3030"
-                    "]+", re.UNICODE)
-
-    return re.sub(emoji, '', text).strip()
-
-def add_second(datetime_string: str|None) -> str|None:
-  """
-Adds 1 second to the given datetime string and returns it as a string.
-
-Params:
-    datetime_string: The datetime string to add 1 second to. It should be of the
-        format "%Y-%m-%dT%H:%M:%S%z".
-
-Returns:
-    str|None: The datetime string with 1 second added or None if datetime_string
-        is None.
-"""
+    return EMOJI.sub('', text).strip()
+
+def merge_date_bounds(results: dict[str, dict[str, list[str]]]) -> dict[str, list[str]]:
+    """
+    Merges the get_date_bounds of several profiles.
+
+    Params:
+        results: The date bounds of each profile.
+
+    Returns:
+        dict: The first and last transaction dates of each month in any profile.
+    """
 
-  if datetime_string is None:
-     return None
-  
-  datetime_object = datetime.strptime(datetime_string, "%Y-%m-%dT%H:%M:%S%z")
-  new_datetime_object = datetime_object + timedelta(seconds=1)
-  new_datetime_string = new_datetime_object.strftime("%Y-%m-%dT%H:%M:%S%z")
-  new_datetime_string = new_datetime_string[:-2] + ':' + new_datetime_string[-2:]
+    bounds = {}
+    for profile_bounds in results.values():
+        for month, (first, last) in profile_bounds.items():
+            if month in bounds:
+                first, last = min(first, bounds[month][0]), max(last, bounds[month][1])
+            bounds[month] = [first, last]
 
-  return new_datetime_string
+    return dict(sorted(bounds.items()))
 
-def str_to_datetime(datetime_string:str) -> datetime:
+def merge_options(results: dict[str, list[dict[str, str]]]) -> list[dict[str, str]]:
     """
-    Takes a datetime string in "%Y-%m-%dT%H:%M:%S%z" format and converts it to a
-    datetime.datetime object.
+    Merges the dropdown options of several profiles.
 
     Params:
-        datetime_string: The string representing the datetime object which
-            will be created and returned by the function. It must be of the
-            format "%Y-%m-%dT%H:%M:%S%z".
-    
+        results: The options of each profile.
+
     Returns:
-        datetime: A datetime object with the same time properties dictated by
-            the string.
+        list: Every option in any profile once, in the order they're first seen.
     """
 
-    return datetime.strptime(datetime_string, "%Y-%m-%dT%H:%M:%S%z")
+    options = {}
+    for profile_options in results.values():
+        for option in profile_options:
+            options.setdefault(option['value'], option)
 
-def check_date_range(start: str|None, end: str|None, min_date: date, max_date: date) -> tuple[date|None, date|None]:
+    return list(options.values())
+
+def merge_date_range(results: dict[str, tuple]) -> tuple:
     """
-    Checks if start and end are between min_date and max_date.
+    Merges the get_min_and_max_dates of several profiles.
 
     Params:
-        start: A string in "YYYY-MM-DD" format representing the start date.
-        end: A string in "YYYY-MM-DD" format representing the end date.
-        min_date: A datetime.date representing the minimum possible date.
-        max_date: A datetime.date representing the maximum possible date.
-    
+        results: The min and max dates of each profile.
+
     Returns:
-        start_date: The start string as a datetime.date if start was not None
-            and it was after the minimum date. None otherwise.
-        end_date: The end string as a datetime.date if the end was not None
-            and it was before the maximum date. None otherwise.
+        tuple: The earliest min date and the latest max date, ignoring profiles
+            without any transactions.
     """
-    start_date = datetime.strptime(start, "%Y-%m-%d").date() if start else None
-    end_date = datetime.strptime(end, "%Y-%m-%d").date() if end else None
 
-    if start_date and (start_date < min_date or start_date > max_date):
-        start_date = None
+    min_dates = [str(min_date) for min_date, _ in results.values() if min_date is not None]
+    max_dates = [str(max_date) for _, max_date in results.values() if max_date is not None]
 
-    if end_date and (end_date > max_date or end_date < min_date):
-        end_date = None
-    
-    return start_date, end_date
+    return min(min_dates, default=None), max(max_dates, default=None)
+
+@merge_profiles(merge_date_bounds)
+def get_date_bounds() -> dict[str, list[str]]:
+    """
+    Gets the first and last date on which there was a transaction for every
+    month in the database. This is a small index which lets the date-range-select
+    picker be validated in the browser without querying the database.
 
+    Returns:
+        A dictionary with a key for each month in "YYYY-MM" format, the value of
+        which is a list containing the first and last transaction dates in that
+        month in "YYYY-MM-DD" format.
+    """
+
+    bounds_df = read_database(
+        '''
+        SELECT substr(createdAt, 1, 7) AS month,
+            substr(MIN(createdAt), 1, 10) AS minDate,
+            substr(MAX(createdAt), 1, 10) AS maxDate
+        FROM Transactions
+        GROUP BY substr(createdAt, 1, 7)
+        ''',
+        name='date_bounds'
+    )
+
+    return {
+        row['month']: [row['minDate'], row['maxDate']]
+        for i, row in bounds_df.iterrows()
+    }
+
+@merge_profiles(lambda results: sorted(merge_options(results), key=lambda option: option['value'], reverse=True))
 def get_select_years() -> list[dict[str, str]]:
     """
     Gets all of the possible year values for the year-select dropdown. Any year
@@ -130,7 +131,8 @@ def get_select_years() -> list[dict[str, str]]:
         FROM Transactions
         GROUP BY strftime("%Y", createdAt)
         ORDER BY strftime("%Y", createdAt) DESC
-        '''
+        ''',
+        name='select_years'
     )
 
     for i, row in years_df.iterrows():
@@ -160,6 +162,44 @@ def get_select_month() -> list[dict[str, str]]:
 
     return res
 
+@merge_profiles(lambda results: sorted(merge_options(results), key=lambda option: option['value']))
+def get_select_tags() -> list[dict[str, str]]:
+    """
+    Gets all of the possible tag values for the tag-select dropdown, which is
+    every tag on at least one transaction.
+
+    Returns:
+        A list of dictionaries, with each dictionary containing as keys the
+        label and value of the tag, which is the tag itself for both.
+    """
+
+    tags_df = read_database('SELECT id FROM Tags ORDER BY id', name='select_tags')
+
+    return [{'label': tag, 'value': tag} for tag in tags_df['id']]
+
+def get_tag_filter(tags: list[str]|None) -> tuple[str, list]:
+    """
+    Creates an SQL condition which is only true for transactions with at least
+    one of the given tags. The condition is served by the index of the
+    TransactionTags table on tag, so it can be added to any query of the
+    Transactions table.
+
+    Params:
+        tags: The tags selected in the tag-select dropdown.
+
+    Returns:
+        where: An SQL condition on the id column, or "1" if no tags are given.
+        params: A list of the parameter values for the placeholders in where.
+    """
+
+    if not tags:
+        return '1', []
+
+    placeholders = ','.join(['?' for _ in range(len(tags))])
+
+    return f'id IN (SELECT transactionId FROM TransactionTags WHERE tag IN ({placeholders}))', list(tags)
+
+@merge_profiles(merge_date_range)
 def get_min_and_max_dates(
     years: list[str]|None,
     months: list[str]|None,
@@ -181,14 +221,16 @@ def get_min_and_max_dates(
             '''
             SELECT strftime("%Y", MIN(createdAt))
             FROM Transactions
-            '''
+            ''',
+            name='min_year'
         ).iloc[0][0]
 
         max_year = read_database(
             '''
             SELECT strftime("%Y", MAX(createdAt))
             FROM Transactions
-            '''
+            ''',
+            name='max_year'
         ).iloc[0][0]
     else:
         min_year = min(map(int, years))
@@ -202,30 +244,317 @@ def get_min_and_max_dates(
 
     # Get min_date if it wasn't provided.
     if min_date is None:
-        min_date = str_to_datetime(
-            read_database(
-                f'''
-                SELECT MIN(createdAt)
-                FROM Transactions
-                WHERE strftime("%Y", datetime(createdAt, "localtime")) = "{min_year}"
-                    AND strftime("%m", datetime(createdAt, "localtime")) IN ({placeholders})
-                ''',
-                params=months
-            ).iloc[0][0]
-        ).date()
+        min_date = read_database(
+            f'''
+            SELECT MIN(createdAt)
+            FROM Transactions
+            WHERE strftime("%Y", {local_datetime_sql('createdAt')}) = "{min_year}"
+                AND strftime("%m", {local_datetime_sql('createdAt')}) IN ({placeholders})
+            ''',
+            params=months,
+            name='min_month_date'
+        ).iloc[0][0]
+        min_date = parse_timestamp(min_date).date() if min_date else None
 
     # Get max_date if it wasn't provided.
     if max_date is None:
-        max_date = str_to_datetime(
-            read_database(
-                f'''
-                SELECT MAX(createdAt)
-                FROM Transactions
-                WHERE strftime("%Y", datetime(createdAt, "localtime")) = "{max_year}"
-                    AND strftime("%m", datetime(createdAt, "localtime")) IN ({placeholders})
-                ''',
-                params=months
-            ).iloc[0][0]
-        ).date()
-
-    return min_date, max_date
\ No newline at end of file
+        max_date = read_database(
+            f'''
+            SELECT MAX(createdAt)
+            FROM Transactions
+            WHERE strftime("%Y", {local_datetime_sql('createdAt')}) = "{max_year}"
+                AND strftime("%m", {local_datetime_sql('createdAt')}) IN ({placeholders})
+            ''',
+            params=months,
+            name='max_month_date'
+        ).iloc[0][0]
+        max_date = parse_timestamp(max_date).date() if max_date else None
+
+    return min_date, max_date
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Picks the points of a series to keep using the Largest-Triangle-Three-Buckets
+    algorithm. The same points can then be taken from other series with the same
+    x values, e.g. the stacked traces which add up to y.
+
+    Params:
+        x: A 1D numeric or datetime64 array of the x values, sorted in
+            ascending order.
+        y: A 1D numeric array of the y values, the same length as x.
+        threshold: The maximum number of points to keep.
+
+    Returns:
+        np.ndarray: The indices of the kept points, in ascending order.
+    """
+
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Datetime x values are compared as nanoseconds since the epoch
+    x_float = np.asarray(x)
+    if np.issubdtype(x_float.dtype, np.datetime64):
+        x_float = x_float.astype('int64')
+    x_float = x_float.astype(float)
+    y_float = np.asarray(y, dtype=float)
+
+    # The first and last points are always kept, the rest are split into buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average point of the next bucket, the last point for the final bucket
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x_float[next_start:next_end].mean()
+        avg_y = y_float[next_start:next_end].mean()
+
+        # Pick the point in this bucket forming the largest triangle
+        areas = np.abs(
+            (x_float[a] - avg_x) * (y_float[start:end] - y_float[a]) -
+            (x_float[a] - x_float[start:end]) * (avg_y - y_float[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, threshold: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Downsamples a series of points using the Largest-Triangle-Three-Buckets
+    algorithm. This keeps the visual shape of the series (peaks and troughs)
+    while reducing the number of points which need to be sent to the browser.
+
+    Params:
+        x: A 1D numeric or datetime64 array of the x values, sorted in
+            ascending order.
+        y: A 1D numeric array of the y values, the same length as x.
+        threshold: The maximum number of points to return.
+
+    Returns:
+        x: The x values of the selected points.
+        y: The y values of the selected points.
+    """
+
+    if threshold >= len(x) or threshold < 3:
+        return x, y
+
+    selected = lttb_indices(x, y, threshold)
+
+    return x[selected], y[selected]
+
+def build_sunburst_tree(
+    totals: pd.DataFrame,
+    path: list[str],
+    max_leaves: int
+) -> pd.DataFrame:
+    """
+    Builds the nodes of a sunburst chart from totals at the deepest level of a
+    hierarchy. Every node has an id which is the path to it joined by "/", so the
+    whole tree can be sent to the browser at once and drilled into there.
+
+    Params:
+        totals: A DataFrame with a column for each level of path and an amount
+            column. Missing values are shown as "Uncategorised".
+        path: The columns of the hierarchy from the root down.
+        max_leaves: The maximum number of leaves kept under each node, the
+            smallest of the rest are combined into an "Other" leaf.
+
+    Returns:
+        pd.DataFrame: A DataFrame with id, parent, label and value columns, one
+            row per node, with each node's value being the total of its leaves.
+    """
+
+    totals = totals.fillna({level: 'Uncategorised' for level in path})
+    leaves = totals.groupby(path, as_index=False)['amount'].sum()
+
+    # Combine the smallest leaves under each node into "Other"
+    rank = leaves.groupby(path[:-1])['amount'].rank(method='first', ascending=False)
+    leaves.loc[rank > max_leaves, path[-1]] = 'Other'
+    leaves = leaves.groupby(path, as_index=False)['amount'].sum()
+
+    nodes = []
+    for depth in range(1, len(path) + 1):
+        level = leaves.groupby(path[:depth], as_index=False)['amount'].sum()
+        ids, parents = level[path[0]], ''
+        for column in path[1:depth]:
+            ids, parents = ids + '/' + level[column], ids
+
+        nodes.append(pd.DataFrame({
+            'id': ids,
+            'parent': parents,
+            'label': level[path[depth - 1]],
+            'value': level['amount']
+        }))
+
+    return pd.concat(nodes, ignore_index=True)
+
+# DataTable filter operators and their SQL equivalents, "<=" style operators
+# must come before "<" so the longest operator is matched
+FILTER_OPERATORS = [
+    ('ge ', '>='), ('>=', '>='),
+    ('le ', '<='), ('<=', '<='),
+    ('ne ', '!='), ('!=', '!='),
+    ('lt ', '<'), ('<', '<'),
+    ('gt ', '>'), ('>', '>'),
+    ('eq ', '='), ('=', '='),
+    ('contains ', 'LIKE'),
+    ('datestartswith ', 'LIKE')
+]
+
+def parse_table_filter(filter_query: str|None, columns: dict[str, str]) -> tuple[str, list]:
+    """
+    Converts the filter_query of a Dash DataTable into an SQL WHERE clause so
+    that filtering can be done by the database rather than on a DataFrame.
+
+    Params:
+        filter_query: The filter_query property of the DataTable, e.g.
+            '{description} contains "coles" && {amount} < 0'.
+        columns: A dictionary mapping the column ids which may be filtered on to
+            the SQL expression for that column. Filters on any other column are
+            ignored.
+
+    Returns:
+        where: A string of SQL conditions joined by AND, or "1" if there are no
+            valid filters.
+        params: A list of the parameter values for the placeholders in where.
+    """
+
+    conditions = []
+    params = []
+
+    for part in (filter_query or '').split(' && '):
+        name = part[part.find('{') + 1: part.find('}')]
+        expression = part[part.find('}') + 1:].strip()
+
+        if name not in columns:
+            continue
+
+        # Drop the case sensitivity prefix of symbolic operators, e.g. "s<"
+        if len(expression) > 1 and expression[0] in 'si' and expression[1] in '<>=!':
+            expression = expression[1:]
+
+        for operator, sql_operator in FILTER_OPERATORS:
+            if not expression.startswith(operator):
+                continue
+
+            value = expression[len(operator):].strip()
+            if value == '':
+                break
+
+            # Strip the quotes DataTable puts around string values
+            if value[0] == value[-1] and value[0] in ('"', "'", '`') and len(value) > 1:
+                value = value[1:-1]
+
+            if operator == 'contains ':
+                value = f'%{value}%'
+            elif operator == 'datestartswith ':
+                value = f'{value}%'
+            else:
+                # Numbers must be bound as numbers for SQLite to compare them
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+
+            conditions.append(f'{columns[name]} {sql_operator} ?')
+            params.append(value)
+            break
+
+    return ' AND '.join(conditions) or '1', params
+
+def shift_months(day: date, months: int) -> date:
+    """
+    Moves a date by a number of months, keeping its day of the month where
+    possible.
+
+    Params:
+        day: The date to move.
+        months: The number of months to move it, negative to move it back.
+
+    Returns:
+        date: The moved date, on the last day of its month if the month is too
+            short for the original day.
+    """
+
+    index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(index, 12)
+    next_month = date(year + (month + 1) // 12, (month + 1) % 12 + 1, 1)
+
+    return date(year, month + 1, min(day.day, (next_month - timedelta(days=1)).day))
+
+def get_comparison_periods(
+    min_date: date|str,
+    max_date: date|str,
+    mode: str,
+    count: int
+) -> list[list[str]]:
+    """
+    Gets a date range and the equivalent periods before it. A range of whole
+    months is compared with the same number of whole months before it, so
+    March is compared with February rather than the 31 days before March.
+
+    Params:
+        min_date: The first day of the range.
+        max_date: The last day of the range.
+        mode: 'previous' for the periods immediately before the range, or
+            'year' for the same dates in the years before it.
+        count: The number of periods before the range.
+
+    Returns:
+        list: The first and last day of each period in "YYYY-MM-DD" format, the
+            range itself first and then each period further back.
+    """
+
+    start, end = date.fromisoformat(str(min_date)[:10]), date.fromisoformat(str(max_date)[:10])
+    after_end = end + timedelta(days=1)
+
+    # The number of months or days each period is moved back by
+    if mode == 'year':
+        months, days = 12, 0
+    elif start.day == 1 and after_end.day == 1:
+        months, days = (after_end.year - start.year) * 12 + after_end.month - start.month, 0
+    else:
+        months, days = 0, (end - start).days + 1
+
+    periods = []
+    for i in range(count + 1):
+        first = shift_months(start, -months * i) - timedelta(days=days * i)
+        last = shift_months(after_end, -months * i) - timedelta(days=days * i + 1)
+        periods.append([first.isoformat(), last.isoformat()])
+
+    return periods
+
+def compare_periods(totals: pd.DataFrame, count: int) -> pd.DataFrame:
+    """
+    Lays out the totals of several periods side by side and works out how the
+    latest period differs from the ones before it.
+
+    Params:
+        totals: A DataFrame with period, name and amount columns, where period 0
+            is the latest period and 1 to count are the periods before it.
+        count: The number of periods before the latest one.
+
+    Returns:
+        pd.DataFrame: A row per name with a period<i> column for the amount in
+            each period, the average of the earlier periods, and the change and
+            percentage change from the period before, largest change first.
+    """
+
+    amounts = totals.fillna({'name': 'Uncategorised'}).pivot_table(
+        index='name', columns='period', values='amount', aggfunc='sum', fill_value=0
+    ).reindex(columns=range(count + 1), fill_value=0)
+
+    comparison = amounts.rename(columns=lambda period: f'period{period}').rename_axis(columns=None)
+    comparison['average'] = amounts[list(range(1, count + 1))].mean(axis=1)
+    comparison['change'] = amounts[0] - amounts[1]
+    comparison['changePercent'] = (comparison['change'] / amounts[1].where(amounts[1] != 0) * 100).round(1)
+
+    comparison = comparison.round(2).reset_index()
+
+    return comparison.iloc[comparison['change'].abs().argsort()[::-1]].reset_index(drop=True)
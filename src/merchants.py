@@ -0,0 +1,176 @@
+"""
+This file contains the normalisation of transaction descriptions into merchants.
+The same merchant can appear under several descriptions, e.g. "Netflix" and
+"NETFLIX.COM", which would otherwise be split into separate slices of the
+charts.
+
+Each description is reduced to a key with precompiled patterns applied to the
+whole column at once, and every description with the same key is given the same
+canonical merchant name, which is the first description seen with that key. The
+mapping is stored in the Merchants table and the merchant of each transaction
+is written to the indexed merchant column of the Transactions table when it's
+inserted, so charts group on it directly. Recently used mappings are kept in an
+LRU in memory so most syncs don't need to read the Merchants table at all.
+"""
+
+import json
+import re
+import sqlite3
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+# Emojis and other pictographs
+EMOJI = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002500-\U00002BEF"  # chinese char
+    "\U00002702-\U000027B0"
+    "\U000024C2-\U0001F251"
+    "\U0001f926-\U0001f937"
+    "\U00010000-\U0010ffff"
+    "\u2640-\u2642"
+    "\u2600-\u2B55"
+    "\u200d"
+    "\u23cf"
+    "\u23e9"
+    "\u231a"
+    "\ufe0f"  # dingbats
+    "\u3030"
+    "]+",
+    re.UNICODE
+)
+
+# Payment processors which prefix the merchant's name, e.g. "SQ *CAFE"
+PAYMENT_PREFIX = re.compile(r'^(?:sq|sqr|zlr|zettle|paypal|pp|lsp|sp|smp|ezi)\s*\*\s*')
+
+# Web domains and company suffixes, e.g. "netflix.com" and "ticketek pty ltd"
+MERCHANT_SUFFIX = re.compile(r'\.(?:com|net|org)(?:\.au)?\b|\b(?:pty|ltd|limited|inc)\b')
+
+# Store numbers, references and punctuation which differ between payments to the
+# same merchant
+MERCHANT_NOISE = re.compile(r'[^a-z ]+|\s+')
+
+# Number of descriptions whose merchant is kept in memory per database
+CACHE_SIZE = 4096
+
+# LRU of description to merchant of each connection
+_CACHES = weakref.WeakKeyDictionary()
+
+def merchant_key(descriptions: pd.Series) -> pd.Series:
+    """
+    Normalises transaction descriptions so descriptions of the same merchant
+    have the same key.
+
+    Params:
+        descriptions: The descriptions of the transactions.
+
+    Returns:
+        pd.Series: The lower case descriptions with emojis, payment processor
+            prefixes, domains, company suffixes, digits, punctuation and
+            repeated whitespace removed. Descriptions with nothing left are
+            only lower cased.
+    """
+
+    lowered = descriptions.str.replace(EMOJI, '', regex=True).str.lower().str.strip()
+
+    keys = (
+        lowered
+        .str.replace("'", '', regex=False)
+        .str.replace(PAYMENT_PREFIX, '', regex=True)
+        .str.replace(MERCHANT_SUFFIX, ' ', regex=True)
+        .str.replace(MERCHANT_NOISE, ' ', regex=True)
+        .str.strip()
+    )
+
+    return keys.where(keys != '', descriptions.str.lower().str.strip())
+
+def get_cache(conn: sqlite3.Connection) -> OrderedDict:
+    """
+    Gets the LRU of merchants of a connection.
+
+    Params:
+        conn: The connection to the database.
+
+    Returns:
+        OrderedDict: The merchant of each description, least recently used first.
+    """
+
+    cache = _CACHES.get(conn)
+    if cache is None:
+        cache = _CACHES[conn] = OrderedDict()
+
+    return cache
+
+def get_merchants(cur: sqlite3.Cursor, descriptions: pd.Series) -> pd.Series:
+    """
+    Gets the canonical merchant of each description. Descriptions which haven't
+    been seen before are added to the Merchants table, under the merchant of any
+    description with the same key. This should be called with the write lock of
+    the connection held.
+
+    Params:
+        cur: A cursor of the connection being written to.
+        descriptions: The descriptions of the transactions.
+
+    Returns:
+        pd.Series: The merchant of each description, with the same index.
+    """
+
+    cache = get_cache(cur.connection)
+    merchants = {}
+
+    unique = descriptions.dropna().unique()
+    for description in unique:
+        if description in cache:
+            cache.move_to_end(description)
+            merchants[description] = cache[description]
+
+    missing = [description for description in unique if description not in merchants]
+    if missing:
+        # Every description is bound as one JSON parameter, so there is no limit
+        # on how many are looked up at once
+        cur.execute(
+            '''
+            SELECT description, merchant
+            FROM Merchants
+            WHERE description IN (SELECT value FROM json_each(?))
+            ''',
+            (json.dumps(missing),)
+        )
+        merchants.update(cur.fetchall())
+
+    new = pd.Series([description for description in missing if description not in merchants], dtype=object)
+    if not new.empty:
+        keys = merchant_key(new)
+
+        cur.execute(
+            '''
+            SELECT key, merchant
+            FROM Merchants
+            WHERE key IN (SELECT value FROM json_each(?))
+            ''',
+            (json.dumps(keys.unique().tolist()),)
+        )
+        known = dict(cur.fetchall())
+
+        # The first description of a new key names the merchant
+        names = new.str.replace(EMOJI, '', regex=True).str.strip()
+        for description, key, name in zip(new, keys, names):
+            merchants[description] = known.setdefault(key, name or description)
+
+        cur.executemany(
+            'INSERT INTO Merchants (description, key, merchant) VALUES (?, ?, ?)',
+            ((description, key, merchants[description]) for description, key in zip(new, keys))
+        )
+
+    for description in missing:
+        cache[description] = merchants[description]
+    while len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+    return descriptions.map(merchants)
@@ -0,0 +1,220 @@
+"""
+This file contains a lightweight instrumentation layer. It records latency
+histograms for named database queries, Dash callbacks, API requests and sync
+phases, counts API retries, and keeps a log of slow queries with their query
+plans. Everything is rendered in the Prometheus text format by render_metrics,
+which is served at /metrics.
+
+Metrics are only recorded when the METRICS environment variable is set, when it
+isn't every hook returns straight away. Each process keeps its own metrics.
+"""
+
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Iterator
+
+from config import get_config
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# Number of slow queries kept for /metrics
+SLOW_QUERY_LOG_SIZE = 50
+
+logger = logging.getLogger(__name__)
+
+class Histogram:
+    """
+    A cumulative latency histogram with fixed BUCKETS.
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+        self.count += 1
+        self.sum += seconds
+
+_LOCK = Lock()
+
+# (metric name, label) -> Histogram
+_HISTOGRAMS = {}
+
+# (metric name, label) -> count
+_COUNTERS = {}
+
+# Most recent slow queries, newest last
+SLOW_QUERIES = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+def enabled() -> bool:
+    """
+    Returns:
+        bool: Whether metrics are being recorded.
+    """
+
+    return get_config().metrics_enabled
+
+def observe(metric: str, label: str, seconds: float) -> None:
+    """
+    Records a latency in a histogram.
+
+    Params:
+        metric: The name of the histogram e.g. 'query_seconds'.
+        label: The name of the thing being timed e.g. the query name.
+        seconds: The latency to record.
+    """
+
+    with _LOCK:
+        histogram = _HISTOGRAMS.get((metric, label))
+        if histogram is None:
+            histogram = _HISTOGRAMS[(metric, label)] = Histogram()
+
+        histogram.observe(seconds)
+
+def increment(metric: str, label: str, amount: int=1) -> None:
+    """
+    Increments a counter.
+
+    Params:
+        metric: The name of the counter e.g. 'api_retries_total'.
+        label: The name of the thing being counted.
+        amount: The amount to increment by.
+    """
+
+    if not enabled():
+        return
+
+    with _LOCK:
+        _COUNTERS[(metric, label)] = _COUNTERS.get((metric, label), 0) + amount
+
+@contextmanager
+def timer(metric: str, label: str) -> Iterator[None]:
+    """
+    Context manager which records how long its body takes in a histogram.
+
+    Params:
+        metric: The name of the histogram.
+        label: The name of the thing being timed.
+    """
+
+    if not enabled():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(metric, label, time.perf_counter() - start)
+
+@contextmanager
+def query_timer(name: str|None, query: str, params: Any, conn: Any) -> Iterator[None]:
+    """
+    Context manager which times a database query. Queries slower than the
+    configured slow_query_ms are logged and, if explain_slow_queries is set,
+    their query plan is captured with EXPLAIN QUERY PLAN.
+
+    Params:
+        name: The name the query's latency is recorded under, queries without a
+            name are recorded as 'unnamed'.
+        query: The SQL of the query.
+        params: The parameters of the query.
+        conn: The connection the query is run on, used to explain the query,
+            or None if it isn't run on SQLite.
+    """
+
+    if not enabled():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe('query_seconds', name or 'unnamed', seconds)
+
+        config = get_config()
+        if seconds * 1000 >= config.slow_query_ms:
+            plan = None
+            if config.explain_slow_queries and conn is not None:
+                plan = [
+                    row[-1] for row in
+                    conn.execute(f'EXPLAIN QUERY PLAN {query}', params or []).fetchall()
+                ]
+
+            logger.warning('Slow query %s took %.1f ms', name or 'unnamed', seconds * 1000)
+            SLOW_QUERIES.append({
+                'name': name or 'unnamed',
+                'ms': round(seconds * 1000, 1),
+                'query': ' '.join(query.split()),
+                'plan': plan
+            })
+
+def instrument_callback(func: Callable) -> Callable:
+    """
+    Decorator which records the latency of a Dash callback. When metrics are
+    disabled the function is returned unchanged so there is no overhead at all.
+
+    Params:
+        func: The callback function.
+
+    Returns:
+        Callable: The timed function.
+    """
+
+    if not enabled():
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with timer('callback_seconds', func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+def render_metrics() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format, followed by
+    the slow query log as comments.
+
+    Returns:
+        str: The metrics.
+    """
+
+    with _LOCK:
+        histograms = sorted(_HISTOGRAMS.items())
+        counters = sorted(_COUNTERS.items())
+        slow_queries = list(SLOW_QUERIES)
+
+    lines = []
+    for (metric, label), histogram in histograms:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else bound
+            lines.append(f'{metric}_bucket{{name="{label}",le="{le}"}} {cumulative}')
+
+        lines.append(f'{metric}_sum{{name="{label}"}} {histogram.sum}')
+        lines.append(f'{metric}_count{{name="{label}"}} {histogram.count}')
+
+    for (metric, label), count in counters:
+        lines.append(f'{metric}{{name="{label}"}} {count}')
+
+    for query in slow_queries:
+        lines.append(f"# slow query {query['name']} {query['ms']} ms: {query['query']}")
+        for step in query['plan'] or []:
+            lines.append(f'#   {step}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,237 @@
+"""
+This file contains the profiles of the application. Each profile is a separate
+Up account with its own PAT and its own SQLite3 database, so the syncs of
+different profiles never wait on each other's write lock and can run at the
+same time.
+
+The default profile uses the PAT under "Up" in the secrets file and the
+configured db_file. Any other profile is listed under "profiles" in the secrets
+file in the same format, and is stored next to db_file with the profile's name
+appended, e.g. finance-alice.db:
+
+    {
+        "Up": {"PAT": "..."},
+        "profiles": {
+            "alice": {"Up": {"PAT": "..."}}
+        }
+    }
+
+Everything which reads or writes the database, or calls the API, does so for
+the profile set by use_profile. Views of every profile at once are built by
+merging the results of each profile with merge_profiles.
+"""
+
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Iterator
+
+import pandas as pd
+
+from config import get_config
+from database import Connection, connect, db_init, get_default_connection, use_database
+from handleSecrets import get_secret, load_secrets
+
+# Name of the profile using the configured db_file and the top level PAT
+DEFAULT_PROFILE = 'default'
+
+# Name which selects the merged view of every profile
+ALL_PROFILES = 'all'
+
+# Characters allowed in a profile name, which is used in file names
+PROFILE_NAME = re.compile(r'[A-Za-z0-9_-]+')
+
+# Connections to the databases of profiles other than the default one and the
+# id of the process which opened them
+_CONNECTIONS = {}
+_CONNECTIONS_PID = None
+_CONNECTIONS_LOCK = Lock()
+
+# Profile set by use_profile
+_PROFILE = ContextVar('profile', default=DEFAULT_PROFILE)
+
+def list_profiles() -> list[str]:
+    """
+    Gets the profiles in the secrets file.
+
+    Returns:
+        list: The names of the profiles, the default profile first.
+    """
+
+    return [DEFAULT_PROFILE] + sorted(load_secrets().get('profiles', {}))
+
+def check_profile(profile: str) -> None:
+    """
+    Checks a profile exists.
+
+    Params:
+        profile: The name of the profile.
+
+    Raises:
+        ValueError: If the profile isn't in the secrets file or its name isn't
+            allowed.
+    """
+
+    if profile not in list_profiles() or profile == ALL_PROFILES or not PROFILE_NAME.fullmatch(profile):
+        raise ValueError(f'Unknown profile {profile!r}')
+
+def get_pat(profile: str) -> str:
+    """
+    Gets the Up PAT of a profile.
+
+    Params:
+        profile: The name of the profile.
+
+    Returns:
+        str: The PAT from the secrets file.
+    """
+
+    if profile == DEFAULT_PROFILE:
+        return get_secret('Up', 'PAT')
+
+    return load_secrets()['profiles'][profile]['Up']['PAT']
+
+def get_db_file(profile: str|None=None) -> str:
+    """
+    Gets the database file of a profile.
+
+    Params:
+        profile: The name of the profile, defaults to the current profile.
+
+    Returns:
+        str: The configured db_file, with the profile's name appended unless
+            it's the default profile.
+    """
+
+    profile = profile or get_profile()
+    if profile == DEFAULT_PROFILE:
+        return get_config().db_file
+
+    root, extension = os.path.splitext(get_config().db_file)
+
+    return f'{root}-{profile}{extension}'
+
+def get_profile_connection(profile: str) -> Connection:
+    """
+    Gets the connection to a profile's database. The database of a profile
+    other than the default one is opened, and its tables created, on first use
+    in each process. Each has its own write lock.
+
+    Params:
+        profile: The name of the profile.
+
+    Returns:
+        Connection: The connection to the database.
+    """
+
+    global _CONNECTIONS, _CONNECTIONS_PID
+
+    if profile == DEFAULT_PROFILE:
+        return get_default_connection()
+
+    with _CONNECTIONS_LOCK:
+        if _CONNECTIONS_PID != os.getpid():
+            _CONNECTIONS, _CONNECTIONS_PID = {}, os.getpid()
+
+        if profile not in _CONNECTIONS:
+            check_profile(profile)
+            conn = connect(get_db_file(profile))
+            db_init(conn)
+            _CONNECTIONS[profile] = conn
+
+        return _CONNECTIONS[profile]
+
+def get_profile() -> str:
+    """
+    Returns:
+        str: The profile set by use_profile, or the default profile.
+    """
+
+    return _PROFILE.get()
+
+@contextmanager
+def use_profile(profile: str|None) -> Iterator[str]:
+    """
+    Context manager which makes everything called inside it, in the same
+    thread, use a profile's database and PAT. The merged view of every profile
+    has no database of its own, only functions decorated with merge_profiles
+    can be called in it.
+
+    Params:
+        profile: The name of the profile, ALL_PROFILES, or None for the default
+            profile.
+
+    Returns:
+        str: The profile being used.
+    """
+
+    profile = profile or DEFAULT_PROFILE
+
+    # The default profile keeps using any database set by use_database, unless
+    # it's switching from another profile's
+    switch = profile != ALL_PROFILES and (
+        profile != DEFAULT_PROFILE or get_profile() not in (DEFAULT_PROFILE, ALL_PROFILES)
+    )
+
+    token = _PROFILE.set(profile)
+    try:
+        if switch:
+            with use_database(get_profile_connection(profile)):
+                yield profile
+        else:
+            yield profile
+    finally:
+        _PROFILE.reset(token)
+
+def merge_profiles(merge: Callable[[dict[str, Any]], Any]) -> Callable:
+    """
+    Decorator which lets a function be called in the merged view of every
+    profile. In that view the function is called in each profile in turn and
+    the results are combined by merge, otherwise it's called as normal. This is
+    meant for functions which return aggregates, which can be combined cheaply,
+    rather than the raw tables.
+
+    Params:
+        merge: Combines the results, it's given the result of each profile by
+            the profile's name.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if get_profile() != ALL_PROFILES:
+                return func(*args, **kwargs)
+
+            results = {}
+            for profile in list_profiles():
+                with use_profile(profile):
+                    results[profile] = func(*args, **kwargs)
+
+            return merge(results)
+
+        return wrapper
+
+    return decorator
+
+def add_frames(by: str|list[str]) -> Callable[[dict[str, pd.DataFrame]], pd.DataFrame]:
+    """
+    Creates a merge for merge_profiles which adds up DataFrames of totals.
+
+    Params:
+        by: The columns identifying each total, e.g. the day or the merchant.
+
+    Returns:
+        Callable: The merge, which gives the sum of every other column for each
+            distinct value of the by columns in any profile.
+    """
+
+    def merge(results: dict[str, pd.DataFrame]) -> pd.DataFrame:
+        return pd.concat(results.values()).groupby(by, as_index=False, dropna=False).sum()
+
+    return merge
@@ -0,0 +1,62 @@
+"""
+This file contains the startup profiler, which reports how long each module takes
+to import so that cold start regressions can be tracked.
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+# Format of the lines Python writes to stderr when run with -X importtime
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def profile_imports(module: str='app') -> list[tuple[str, float, float]]:
+    """
+    Imports a module in a fresh interpreter with -X importtime and collects the
+    time taken to import it and each module it imports.
+
+    Params:
+        module: The name of the module to import, from the src directory.
+
+    Returns:
+        A list of (module, self_ms, cumulative_ms) tuples for every module which
+        was imported, sorted by cumulative time descending.
+    """
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=dict(os.environ, PYTHONPATH=src_dir),
+        capture_output=True,
+        text=True
+    )
+
+    timings = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            timings.append((match.group(4), int(match.group(1)) / 1000, int(match.group(2)) / 1000))
+
+    return sorted(timings, key=lambda timing: timing[2], reverse=True)
+
+def print_import_profile(module: str='app', top: int=30) -> None:
+    """
+    Prints a table of the slowest imports when importing a module.
+
+    Params:
+        module: The name of the module to import, from the src directory.
+        top: The number of modules to print.
+    """
+
+    timings = profile_imports(module)
+
+    print(f"{'module':<50} {'self ms':>10} {'cumulative ms':>15}")
+    for name, self_ms, cumulative_ms in timings[:top]:
+        print(f'{name:<50} {self_ms:>10.1f} {cumulative_ms:>15.1f}')
+
+    total = next((cumulative for name, self_ms, cumulative in timings if name == module), 0)
+    print(f'\nTotal time to import {module}: {total:.1f} ms')
+
+if __name__ == '__main__':
+    print_import_profile(*sys.argv[1:2])
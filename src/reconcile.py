@@ -0,0 +1,326 @@
+"""
+This file contains the reconciliation of the Transactions table with the Up
+banking API. The regular sync only rechecks transactions which are unsettled or
+uncategorised, so changes to any other transaction, or deleted transactions,
+are never picked up.
+
+Reconciliation compares a digest of the id, status, amount, category and
+settledAt of every transaction created in a month with the same digest computed
+from the API. Only the months whose digests differ are written to. The local
+digests are kept in the MonthDigests table and only recomputed for months with
+entries in the TransactionChanges log since they were stored.
+
+Run a reconciliation from the root of the repository with:
+
+    python src/reconcile.py --months 12
+    python src/reconcile.py --profile alice
+"""
+
+import argparse
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Iterable
+
+from api import get_pages, parse_transactions_json
+from balances import refresh_daily_balances
+from config import get_config
+from database import (
+    Connection,
+    delete_transactions,
+    get_connection,
+    get_latest_change_seq,
+    get_sync_state,
+    read_database,
+    refresh_category_totals,
+    refresh_daily_totals,
+    upsert_transactions
+)
+from metrics import timer
+from profiles import DEFAULT_PROFILE, use_profile
+from recurring import update_recurring
+
+# Offset used for the month windows requested from the API
+API_OFFSET = '+10:00'
+
+def digest_rows(rows: Iterable[tuple]) -> str:
+    """
+    Computes the digest of the transactions in a month.
+
+    Params:
+        rows: A (id, status, amount, category, settledAt) tuple for each
+            transaction, in any order.
+
+    Returns:
+        str: The hex digest, which is the same for the same set of rows.
+    """
+
+    lines = sorted(
+        '|'.join('' if value is None else str(value) for value in row)
+        for row in rows
+    )
+
+    return hashlib.sha256('\n'.join(lines).encode()).hexdigest()
+
+def remote_rows(transactions: list[dict[str, Any]]) -> list[tuple]:
+    """
+    Extracts the fields which are digested from transactions in the API format.
+
+    Params:
+        transactions: Transaction resources from the API.
+
+    Returns:
+        list: A (id, status, amount, category, settledAt) tuple per transaction.
+    """
+
+    return [
+        (
+            transaction['id'],
+            transaction['attributes']['status'],
+            transaction['attributes']['amount']['valueInBaseUnits'],
+            (transaction['relationships']['category']['data'] or {}).get('id'),
+            transaction['attributes']['settledAt']
+        )
+        for transaction in transactions
+    ]
+
+def month_bounds(month: str) -> tuple[str, str]:
+    """
+    Gets the range of createdAt strings of the transactions in a month.
+
+    Params:
+        month: A month in "YYYY-MM" format.
+
+    Returns:
+        tuple: The first month and the month after it in "YYYY-MM" format.
+    """
+
+    year, number = map(int, month.split('-'))
+    year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+
+    return month, f'{year:04d}-{number:02d}'
+
+def get_local_digests(months: list[str], conn: Connection|None=None) -> dict[str, str]:
+    """
+    Gets the digest of the local transactions in each month. Stored digests are
+    reused unless a transaction in that month has changed since.
+
+    Params:
+        months: The months in "YYYY-MM" format.
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        dict: The digest of each month.
+    """
+
+    conn = conn or get_connection()
+
+    stored_df = read_database(
+        'SELECT month, digest, seq FROM MonthDigests', conn=conn, name='month_digests'
+    ).set_index('month')
+
+    # The latest change to a transaction in each month since the oldest digest
+    changed_df = read_database(
+        '''
+        SELECT substr(Transactions.createdAt, 1, 7) AS month, MAX(TransactionChanges.seq) AS seq
+        FROM TransactionChanges
+        JOIN Transactions ON Transactions.id = TransactionChanges.transactionId
+        WHERE TransactionChanges.seq > ?
+        GROUP BY substr(Transactions.createdAt, 1, 7)
+        ''',
+        params=[int(stored_df['seq'].min()) if not stored_df.empty else 0],
+        conn=conn,
+        name='changed_months'
+    ).set_index('month')['seq']
+
+    seq = get_latest_change_seq(conn)
+    digests = {}
+    recomputed = []
+
+    for month in months:
+        if month in stored_df.index and changed_df.get(month, 0) <= stored_df.loc[month, 'seq']:
+            digests[month] = stored_df.loc[month, 'digest']
+            continue
+
+        first, last = month_bounds(month)
+        cur = conn.execute(
+            '''
+            SELECT id, status, amount, category, settledAt
+            FROM Transactions
+            WHERE createdAt >= ? AND createdAt < ?
+            ''',
+            (first, last)
+        )
+        rows = cur.fetchall()
+        digests[month] = digest_rows(rows)
+        recomputed.append((month, digests[month], len(rows), seq))
+
+    save_digests(recomputed, conn)
+
+    return digests
+
+def save_digests(digests: list[tuple], conn: Connection) -> None:
+    """
+    Stores the digests of months.
+
+    Params:
+        digests: A (month, digest, transactions, seq) tuple per month.
+        conn: The connection to the database.
+    """
+
+    with conn.write_lock:
+        conn.executemany(
+            '''
+            INSERT OR REPLACE INTO MonthDigests (month, digest, transactions, seq)
+            VALUES (?, ?, ?, ?)
+            ''',
+            digests
+        )
+        conn.commit()
+
+def get_months(conn: Connection|None=None) -> list[str]:
+    """
+    Gets every month from the first local transaction to the current month.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        list: The months in "YYYY-MM" format, oldest first.
+    """
+
+    first = read_database(
+        'SELECT substr(MIN(createdAt), 1, 7) FROM Transactions', conn=conn, name='first_month'
+    ).iloc[0][0]
+
+    if first is None:
+        return []
+
+    months = [first]
+    while months[-1] < date.today().strftime('%Y-%m'):
+        months.append(month_bounds(months[-1])[1])
+
+    return months
+
+def reconcile(months: list[str]|None=None, conn: Connection|None=None) -> dict[str, Any]:
+    """
+    Compares each month of transactions with the API and re-syncs the months
+    which differ: new transactions are inserted, changed ones updated and ones
+    which no longer exist in the API deleted.
+
+    Params:
+        months: The months to check in "YYYY-MM" format, defaults to every month
+            since the first transaction.
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        dict: The number of months checked, the months which differed and the
+            number of transactions inserted, updated and deleted.
+    """
+
+    conn = conn or get_connection()
+    months = months or get_months(conn)
+
+    local = get_local_digests(months, conn)
+    stats = {'months': len(months), 'mismatched': [], 'inserted': 0, 'updated': 0, 'deleted': 0}
+
+    for month in months:
+        # A day either side of the month so no offset can put a transaction
+        # outside the window, the extra days are filtered out below
+        first, last = month_bounds(month)
+        since = date.fromisoformat(f'{first}-01') - timedelta(days=1)
+        until = date.fromisoformat(f'{last}-01') + timedelta(days=1)
+
+        with timer('sync_phase_seconds', 'reconcile_pull'):
+            pages = get_pages('transactions', {
+                'page[size]': '100',
+                'filter[since]': f'{since}T00:00:00{API_OFFSET}',
+                'filter[until]': f'{until}T00:00:00{API_OFFSET}'
+            })
+
+        transactions = [
+            transaction
+            for page in pages
+            for transaction in page['data']
+            if transaction['attributes']['createdAt'][:7] == month
+        ]
+
+        digest = digest_rows(remote_rows(transactions))
+        if digest == local[month]:
+            continue
+
+        stats['mismatched'].append(month)
+
+        remote_df = parse_transactions_json({'data': transactions})
+        local_ids = set(read_database(
+            'SELECT id FROM Transactions WHERE createdAt >= ? AND createdAt < ?',
+            params=[first, last],
+            conn=conn,
+            name='month_ids'
+        )['id'])
+
+        existing = remote_df['id'].isin(local_ids)
+        deleted = list(local_ids - set(remote_df['id']))
+
+        if (~existing).any():
+            upsert_transactions(remote_df[~existing], True, conn)
+        if existing.any():
+            stats['updated'] += len(upsert_transactions(remote_df[existing], False, conn))
+        if deleted:
+            delete_transactions(deleted, conn)
+
+        stats['inserted'] += int((~existing).sum())
+        stats['deleted'] += len(deleted)
+
+        save_digests([(month, digest, len(transactions), get_latest_change_seq(conn))], conn)
+
+    # Rebuild everything derived from the months which changed
+    if stats['mismatched']:
+        since = str(date.fromisoformat(f"{stats['mismatched'][0]}-01") - timedelta(days=1))
+        refresh_daily_totals(since, conn)
+        refresh_category_totals(since, conn)
+        refresh_daily_balances(conn=conn)
+        update_recurring(True, conn)
+
+    with conn.write_lock:
+        conn.execute(
+            'INSERT OR REPLACE INTO SyncState (key, value) VALUES ("reconciled-at", ?)',
+            (datetime.now(timezone.utc).isoformat(timespec='seconds'),)
+        )
+        conn.commit()
+
+    return stats
+
+def reconcile_due(conn: Connection|None=None) -> bool:
+    """
+    Checks whether the configured reconcile_interval has passed since the last
+    reconciliation.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        bool: Whether a reconciliation should be run.
+    """
+
+    interval = get_config().reconcile_interval
+    if interval <= 0:
+        return False
+
+    last = get_sync_state('reconciled-at', conn)
+    if last is None:
+        return True
+
+    return datetime.now(timezone.utc) - datetime.fromisoformat(last) >= timedelta(seconds=interval)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--months', type=int, help='Only check this many of the most recent months')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, help='Profile whose database is reconciled')
+    args = parser.parse_args()
+
+    with use_profile(args.profile):
+        months = get_months()
+        if args.months:
+            months = months[-args.months:]
+
+        print(reconcile(months))
@@ -0,0 +1,218 @@
+"""
+This file contains the engine which detects recurring payments such as
+subscriptions and regular bills. Spending is grouped by merchant and the
+interval between payments and their amounts are summarised per merchant with a
+running count, mean and sum of squared differences. A merchant whose payments are
+evenly spaced and similarly sized is a recurring series.
+
+The summaries are stored in the RecurringMerchants table along with the last
+transaction they include, so each sync only adds the transactions created since
+then instead of rescanning the whole history.
+"""
+
+import numpy as np
+import pandas as pd
+
+from database import Connection, get_connection, get_sync_state, read_database
+from profiles import merge_profiles
+from timestamps import to_datetime, to_epoch_days
+
+# Fewest payments before a merchant can be a recurring series
+MIN_PAYMENTS = 3
+
+# Range of mean days between payments of a recurring series
+MIN_INTERVAL_DAYS = 6
+MAX_INTERVAL_DAYS = 400
+
+# Largest coefficient of variation of the intervals and amounts of a series
+MAX_INTERVAL_CV = 0.2
+MAX_AMOUNT_CV = 0.25
+
+# Names of periods by their length in days
+PERIODS = [
+    (7, 'Weekly'),
+    (14, 'Fortnightly'),
+    (30.4, 'Monthly'),
+    (91.3, 'Quarterly'),
+    (182.6, 'Half Yearly'),
+    (365.25, 'Yearly')
+]
+
+def merge_stats(
+    n_a: np.ndarray, mean_a: np.ndarray, m2_a: np.ndarray,
+    n_b: np.ndarray, mean_b: np.ndarray, m2_b: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Combines the count, mean and sum of squared differences from the mean of two
+    sets of values, using Chan's parallel algorithm, so the variance of all of the
+    values can be found without the values themselves.
+
+    Returns:
+        tuple: The count, mean and sum of squared differences of both sets.
+    """
+
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, mean_a + delta * n_b / n, 0)
+        m2 = np.where(n > 0, m2_a + m2_b + delta ** 2 * n_a * n_b / n, 0)
+
+    return n, mean, m2
+
+def update_recurring(full: bool=False, conn: Connection|None=None) -> None:
+    """
+    Adds the spending created since the last update to the summary of each
+    merchant in the RecurringMerchants table.
+
+    Params:
+        full: Whether to discard the summaries and rebuild them from the whole
+            history, e.g. after transactions have been changed or deleted.
+        conn: The connection to the database, defaults to get_connection().
+    """
+
+    conn = conn or get_connection()
+
+    watermark = None if full else get_sync_state('recurring-watermark', conn)
+
+    new_df = read_database(
+        '''
+        SELECT merchant, description, createdAt, -amount AS amount
+        FROM Transactions
+        WHERE createdAt > ?
+            AND amount < 0
+            AND isCategorizable = 1
+        ORDER BY createdAt
+        ''',
+        params=[watermark or ''],
+        conn=conn,
+        name='recurring_new_spending'
+    )
+
+    if new_df.empty:
+        return
+
+    state_df = read_database(
+        'SELECT * FROM RecurringMerchants', conn=conn, name='recurring_merchants'
+    ).set_index('merchant')
+    if full:
+        state_df = state_df.iloc[0:0]
+
+    new_df['day'] = to_epoch_days(new_df['createdAt'])
+
+    # Days since the previous payment to the same merchant, the first new payment
+    # of a merchant is measured from the last payment already summarised
+    new_df = new_df.sort_values(['merchant', 'day'], kind='stable')
+    previous = new_df.groupby('merchant')['day'].shift()
+    previous = previous.fillna(new_df['merchant'].map(state_df['lastDay']))
+    new_df['interval'] = new_df['day'] - previous
+
+    grouped = new_df.groupby('merchant')
+    batch_df = pd.DataFrame({
+        'description': grouped['description'].last(),
+        'firstSeen': grouped['createdAt'].first(),
+        'lastSeen': grouped['createdAt'].last(),
+        'lastDay': grouped['day'].last(),
+        'lastAmount': grouped['amount'].last(),
+        'payments': grouped['amount'].count(),
+        'amountMean': grouped['amount'].mean(),
+        'amountM2': grouped['amount'].var(ddof=0) * grouped['amount'].count(),
+        'intervals': grouped['interval'].count(),
+        'intervalMean': grouped['interval'].mean().fillna(0),
+        'intervalM2': (grouped['interval'].var(ddof=0) * grouped['interval'].count()).fillna(0)
+    })
+
+    # Merge the batch into the stored summaries of the same merchants
+    old_df = state_df.reindex(batch_df.index)
+    known = old_df['payments'].notna().values
+    old_df = old_df.fillna(0)
+
+    payments, amount_mean, amount_m2 = merge_stats(
+        old_df['payments'].values, old_df['amountMean'].values, old_df['amountM2'].values,
+        batch_df['payments'].values, batch_df['amountMean'].values, batch_df['amountM2'].values
+    )
+    intervals, interval_mean, interval_m2 = merge_stats(
+        old_df['intervals'].values, old_df['intervalMean'].values, old_df['intervalM2'].values,
+        batch_df['intervals'].values, batch_df['intervalMean'].values, batch_df['intervalM2'].values
+    )
+
+    batch_df['firstSeen'] = np.where(known, old_df['firstSeen'], batch_df['firstSeen'])
+    batch_df['payments'] = payments
+    batch_df['amountMean'] = amount_mean
+    batch_df['amountM2'] = amount_m2
+    batch_df['intervals'] = intervals
+    batch_df['intervalMean'] = interval_mean
+    batch_df['intervalM2'] = interval_m2
+
+    rows = batch_df.reset_index()[[
+        'merchant', 'description', 'firstSeen', 'lastSeen', 'lastDay', 'lastAmount',
+        'payments', 'amountMean', 'amountM2', 'intervals', 'intervalMean', 'intervalM2'
+    ]].astype(object)
+
+    with conn.write_lock:
+        cur = conn.cursor()
+        if full:
+            cur.execute('DELETE FROM RecurringMerchants')
+        cur.executemany(
+            '''
+            INSERT OR REPLACE INTO RecurringMerchants (
+                merchant, description, firstSeen, lastSeen, lastDay, lastAmount,
+                payments, amountMean, amountM2, intervals, intervalMean, intervalM2
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            rows.itertuples(index=False, name=None)
+        )
+        cur.execute(
+            'INSERT OR REPLACE INTO SyncState (key, value) VALUES ("recurring-watermark", ?)',
+            (new_df['createdAt'].max(),)
+        )
+        conn.commit()
+        cur.close()
+
+@merge_profiles(lambda results: pd.concat(results.values(), ignore_index=True).sort_values('nextExpected', ignore_index=True))
+def get_recurring_series(conn: Connection|None=None) -> pd.DataFrame:
+    """
+    Gets every merchant whose payments form a recurring series, along with when
+    the next payment is expected and how much it's expected to be.
+
+    Params:
+        conn: The connection to the database, defaults to get_connection().
+
+    Returns:
+        pd.DataFrame: A DataFrame with a row per series, with description,
+            period, interval (days), amount, lastSeen, nextExpected and
+            expectedAmount columns, ordered by nextExpected. Amounts are in
+            dollars.
+    """
+
+    series_df = read_database(
+        '''
+        SELECT *
+        FROM RecurringMerchants
+        WHERE payments >= ?
+            AND intervalMean BETWEEN ? AND ?
+        ''',
+        params=[MIN_PAYMENTS, MIN_INTERVAL_DAYS, MAX_INTERVAL_DAYS],
+        conn=conn,
+        name='recurring_candidates'
+    )
+
+    interval_cv = np.sqrt(series_df['intervalM2'] / series_df['intervals']) / series_df['intervalMean']
+    amount_cv = np.sqrt(series_df['amountM2'] / series_df['payments']) / series_df['amountMean']
+    series_df = series_df[(interval_cv <= MAX_INTERVAL_CV) & (amount_cv <= MAX_AMOUNT_CV)].copy()
+
+    # Name the period closest to the mean interval
+    lengths = np.array([length for length, _ in PERIODS])
+    closest = np.abs(np.log(series_df['intervalMean'].values[:, None] / lengths)).argmin(axis=1)
+    series_df['period'] = [PERIODS[i][1] for i in closest]
+
+    last_seen = to_datetime(series_df['lastSeen'])
+    series_df['nextExpected'] = (last_seen + pd.to_timedelta(series_df['intervalMean'], unit='D')).dt.strftime('%Y-%m-%d')
+    series_df['lastSeen'] = last_seen.dt.strftime('%Y-%m-%d')
+    series_df['interval'] = series_df['intervalMean'].round(1)
+    series_df['amount'] = series_df['lastAmount'] / 100
+    series_df['expectedAmount'] = (series_df['amountMean'] / 100).round(2)
+
+    return series_df.sort_values('nextExpected')[[
+        'description', 'period', 'interval', 'amount', 'lastSeen', 'nextExpected', 'expectedAmount'
+    ]].reset_index(drop=True)
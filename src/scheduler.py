@@ -0,0 +1,245 @@
+"""
+This file contains the scheduler which keeps the database in sync with the Up
+banking API in the background while the dashboard is running.
+"""
+
+import random
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from typing import Any, Callable
+
+from api import update_dataset, tables_to_csv
+from backup import backup, backup_due
+from cache import cache_get, cache_set
+from config import get_config
+from engines import export_tables
+from profiles import list_profiles, use_profile
+from reconcile import reconcile, reconcile_due
+
+# Key the scheduler status is stored under in the shared cache
+STATUS_KEY = 'sync-status'
+
+def sync_job() -> dict[str, int]:
+    """
+    The job run for each profile by the scheduler, this syncs the database with
+    the API, reconciles every month with the API and takes a snapshot of the
+    database when they're due, updates the Parquet export read by the DuckDB
+    query engine and writes the tables out to .csv files.
+
+    Returns:
+        dict: The number of transactions inserted, updated and deleted, and the
+            number refetched which hadn't changed.
+    """
+
+    stats = update_dataset()
+    stats['deleted'] = 0
+
+    if reconcile_due():
+        reconciled = reconcile()
+        for key in ('inserted', 'updated', 'deleted'):
+            stats[key] += reconciled[key]
+
+    export_tables()
+
+    if backup_due():
+        backup()
+
+    tables_to_csv()
+
+    return stats
+
+def sync_profile(profile: str) -> dict[str, Any]:
+    """
+    Runs sync_job for a profile.
+
+    Params:
+        profile: The name of the profile.
+
+    Returns:
+        dict: The stats returned by sync_job, or the error the sync failed with
+            under 'error'.
+    """
+
+    with use_profile(profile):
+        try:
+            return sync_job()
+        except Exception as e:
+            traceback.print_exc()
+            return {'error': f'{type(e).__name__}: {e}'}
+
+def sync_profiles() -> dict[str, Any]:
+    """
+    The default job run by the scheduler, this runs sync_job for every profile,
+    up to the configured sync_workers at a time. Each profile has its own
+    database, so their syncs don't wait on each other's writes.
+
+    Returns:
+        dict: The total number of transactions inserted, updated, deleted and
+            refetched without changes, the stats of each profile under
+            'profiles' and the error of each profile whose sync failed under
+            'errors'.
+    """
+
+    profiles = list_profiles()
+    with ThreadPoolExecutor(max_workers=max(1, min(get_config().sync_workers, len(profiles)))) as pool:
+        results = dict(zip(profiles, pool.map(sync_profile, profiles)))
+
+    stats = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'profiles': results, 'errors': {}}
+    for profile, result in results.items():
+        if 'error' in result:
+            stats['errors'][profile] = result['error']
+            continue
+
+        for key in ('inserted', 'updated', 'deleted', 'unchanged'):
+            stats[key] += result.get(key, 0)
+
+    return stats
+
+class SyncScheduler:
+    """
+    Runs a sync job on a background thread every interval seconds, plus or minus
+    a random jitter, and records the outcome of each run.
+    """
+
+    def __init__(
+        self,
+        interval: float|None=None,
+        jitter: float|None=None,
+        job: Callable[[], dict[str, Any]|None]=sync_profiles
+    ):
+        """
+        Params:
+            interval: The number of seconds between the start of each sync,
+                defaults to the configured sync_interval.
+            jitter: The maximum number of seconds each wait may be randomly
+                shortened or lengthened by, defaults to the configured
+                sync_jitter. This stops every instance of the dashboard hitting
+                the API at exactly the same time.
+            job: The function which performs the sync. It may return the
+                number of transactions it inserted, updated and deleted, if
+                it wrote nothing the data version isn't incremented. It may
+                also return the errors of the profiles which failed to sync
+                under 'errors', which puts the scheduler in the error state
+                without losing the changes of the other profiles.
+        """
+
+        self.interval = get_config().sync_interval if interval is None else interval
+        self.jitter = get_config().sync_jitter if jitter is None else jitter
+        self.job = job
+
+        self._thread = None
+        self._stop = Event()
+        self._wake = Event()
+        self._lock = Lock()
+        self._status = {
+            'state': 'idle',
+            'version': 0,
+            'lastAttempt': None,
+            'lastSuccess': None,
+            'lastError': None,
+            'lastStats': None,
+            'nextSync': None
+        }
+
+    def start(self) -> None:
+        """
+        Starts the background thread, the first sync is run immediately. Calling
+        this when the scheduler is already running does nothing.
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        # The cache outlives the process, so charts cached under the versions of
+        # an earlier run may still be in it. The version carries on from the
+        # last one published so none of them are reused
+        published = cache_get(STATUS_KEY)
+        if published is not None:
+            self._update_status(version=max(self._status['version'], published['version'] + 1))
+
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='sync-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background thread once any sync in progress has finished.
+        """
+
+        self._stop.set()
+        self._wake.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def sync_now(self) -> None:
+        """
+        Runs a sync as soon as possible rather than waiting for the next interval.
+        """
+
+        self._wake.set()
+
+    def status(self) -> dict[str, Any]:
+        """
+        Gets the status of the scheduler. When the scheduler isn't running in
+        this process, e.g. in a worker which isn't the one running syncs, the
+        status published to the shared cache by the running scheduler is used.
+
+        Returns:
+            A dictionary containing the current state ('idle', 'syncing' or
+            'error'), a version number which is incremented after every
+            successful sync which changed the data and when the scheduler is
+            started after an earlier run, the ISO format times of
+            the last attempted sync, the last successful sync and the next
+            scheduled sync, the stats returned by the last successful sync and
+            the message of the last error if the last sync failed.
+        """
+
+        with self._lock:
+            if self._thread is None:
+                return cache_get(STATUS_KEY, dict(self._status))
+
+            return dict(self._status)
+
+    def _update_status(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._status.update(kwargs)
+            cache_set(STATUS_KEY, self._status, timeout=365 * 24 * 60 * 60)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._update_status(
+                state='syncing',
+                lastAttempt=datetime.now().isoformat(timespec='seconds')
+            )
+
+            try:
+                stats = self.job()
+            except Exception as e:
+                traceback.print_exc()
+                self._update_status(state='error', lastError=f'{type(e).__name__}: {e}')
+            else:
+                # Cached charts are keyed on the version, so it's only changed
+                # when the data has
+                changed = stats is None or any(stats.get(key) for key in ('inserted', 'updated', 'deleted'))
+                errors = (stats or {}).get('errors')
+                self._update_status(
+                    state='error' if errors else 'idle',
+                    version=self.status()['version'] + (1 if changed else 0),
+                    lastStats=stats,
+                    lastSuccess=self.status()['lastSuccess'] if errors else datetime.now().isoformat(timespec='seconds'),
+                    lastError='; '.join(f'{profile}: {error}' for profile, error in errors.items()) if errors else None
+                )
+
+            wait = max(0, self.interval + random.uniform(-self.jitter, self.jitter))
+            self._update_status(
+                nextSync=(datetime.now() + timedelta(seconds=wait)).isoformat(timespec='seconds')
+            )
+
+            self._wake.wait(wait)
+            self._wake.clear()
+
+# The scheduler used by the application
+SCHEDULER = SyncScheduler()
@@ -0,0 +1,269 @@
+"""
+This file contains the handling of timestamps. The Up banking API gives every
+time as an ISO 8601 string with a UTC offset, e.g. "2023-04-16T10:00:00+10:00",
+and these strings are what is stored in the database.
+
+Single timestamps are parsed with datetime.fromisoformat, which is much faster
+than strptime, and the results are cached. Whole columns are converted at once
+with pandas. Days are always worked out in the configured local_tz, both here
+and in SQL through local_date_sql, rather than in the time zone of whichever
+machine happens to be running the app.
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from config import get_config
+
+# Nanoseconds in a day, for converting epoch nanoseconds to days
+NS_PER_DAY = 86_400 * 10 ** 9
+
+# Format of a timestamp without its UTC offset
+SECONDS_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+@lru_cache(maxsize=None)
+def get_local_tz() -> ZoneInfo:
+    """
+    Returns:
+        ZoneInfo: The configured local_tz.
+    """
+
+    return ZoneInfo(get_config().local_tz)
+
+@lru_cache(maxsize=None)
+def get_fixed_offset() -> int|None:
+    """
+    Gets the UTC offset of the local time zone if it never changes, i.e. it has
+    no daylight saving.
+
+    Returns:
+        int|None: The offset in minutes, or None if the offset changes during
+            the year.
+    """
+
+    tz = get_local_tz()
+    year = datetime.now().year
+    offsets = {
+        datetime(year, month, 1, tzinfo=tz).utcoffset()
+        for month in (1, 7)
+    }
+
+    if len(offsets) > 1:
+        return None
+
+    return int(offsets.pop().total_seconds() // 60)
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(timestamp: str) -> datetime:
+    """
+    Parses an ISO 8601 timestamp.
+
+    Params:
+        timestamp: A timestamp such as "2023-04-16T10:00:00+10:00".
+
+    Returns:
+        datetime: The time zone aware datetime.
+    """
+
+    return datetime.fromisoformat(timestamp)
+
+def format_timestamp(timestamp: datetime) -> str:
+    """
+    Formats a datetime the way the API does.
+
+    Params:
+        timestamp: A time zone aware datetime.
+
+    Returns:
+        str: The timestamp in "%Y-%m-%dT%H:%M:%S+HH:MM" format.
+    """
+
+    return timestamp.isoformat(timespec='seconds')
+
+def add_seconds(timestamp: str|None, seconds: float=1) -> str|None:
+    """
+    Adds a number of seconds to a timestamp, keeping its UTC offset.
+
+    Params:
+        timestamp: An ISO 8601 timestamp.
+        seconds: The number of seconds to add.
+
+    Returns:
+        str|None: The new timestamp, or None if timestamp is None.
+    """
+
+    if timestamp is None:
+        return None
+
+    return format_timestamp(parse_timestamp(timestamp) + timedelta(seconds=seconds))
+
+def local_date(timestamp: str|None) -> str|None:
+    """
+    Gets the day a timestamp falls on in the local time zone.
+
+    Params:
+        timestamp: An ISO 8601 timestamp.
+
+    Returns:
+        str|None: The day in "YYYY-MM-DD" format, or None if timestamp is None.
+    """
+
+    if timestamp is None:
+        return None
+
+    return parse_timestamp(timestamp).astimezone(get_local_tz()).date().isoformat()
+
+def local_datetime(timestamp: str|None) -> str|None:
+    """
+    Gets the local time of a timestamp, in the format of SQLite's datetime
+    function.
+
+    Params:
+        timestamp: An ISO 8601 timestamp.
+
+    Returns:
+        str|None: The time in "YYYY-MM-DD HH:MM:SS" format, or None if timestamp
+            is None.
+    """
+
+    if timestamp is None:
+        return None
+
+    return parse_timestamp(timestamp).astimezone(get_local_tz()).strftime('%Y-%m-%d %H:%M:%S')
+
+@lru_cache(maxsize=None)
+def parse_offset(offset: str) -> int:
+    """
+    Parses the UTC offset at the end of a timestamp.
+
+    Params:
+        offset: An offset such as "+10:00" or "Z".
+
+    Returns:
+        int: The offset in minutes.
+    """
+
+    return int(datetime.fromisoformat(f'2000-01-01T00:00:00{offset}').utcoffset().total_seconds() // 60)
+
+def to_utc(timestamps: pd.Series|np.ndarray|list) -> pd.Series:
+    """
+    Converts a column of ISO 8601 timestamps to UTC in one go. pandas parses
+    strings with UTC offsets one at a time, so the date and time are parsed
+    without the offset and the few distinct offsets are subtracted afterwards.
+
+    Params:
+        timestamps: The timestamps, missing values are allowed.
+
+    Returns:
+        pd.Series: The times as naive datetimes in UTC.
+    """
+
+    timestamps = pd.Series(timestamps, dtype=object)
+    present = timestamps.dropna()
+
+    # Fractional seconds or a missing offset aren't in the fixed format the API
+    # uses, so are left to pandas
+    if not present.str.len().eq(25).all():
+        return pd.to_datetime(timestamps, utc=True, format='ISO8601').dt.tz_localize(None)
+
+    offsets = timestamps.str[19:].map({offset: parse_offset(offset) for offset in present.str[19:].unique()})
+
+    return pd.to_datetime(timestamps.str[:19], format=SECONDS_FORMAT) - pd.to_timedelta(offsets, unit='m')
+
+def to_datetime(timestamps: pd.Series|np.ndarray|list) -> pd.Series:
+    """
+    Converts a column of ISO 8601 timestamps to local times in one go.
+
+    Params:
+        timestamps: The timestamps, missing values are allowed.
+
+    Returns:
+        pd.Series: The times as datetimes in the local time zone.
+    """
+
+    return to_utc(timestamps).dt.tz_localize('UTC').dt.tz_convert(get_local_tz())
+
+def to_local_dates(timestamps: pd.Series|np.ndarray|list) -> pd.Series:
+    """
+    Converts a column of ISO 8601 timestamps to the days they fall on in the
+    local time zone.
+
+    Params:
+        timestamps: The timestamps, without missing values.
+
+    Returns:
+        pd.Series: The days in "YYYY-MM-DD" format.
+    """
+
+    times = to_datetime(timestamps).dt.tz_localize(None)
+
+    return pd.Series(times.values.astype('datetime64[D]').astype(str), index=times.index)
+
+def to_epoch_days(timestamps: pd.Series|np.ndarray|list) -> np.ndarray:
+    """
+    Converts a column of ISO 8601 timestamps to fractional days since the Unix
+    epoch, which is convenient for measuring the time between them.
+
+    Params:
+        timestamps: The timestamps, without missing values.
+
+    Returns:
+        np.ndarray: The days since 1970-01-01T00:00:00Z.
+    """
+
+    return to_utc(timestamps).values.astype('datetime64[ns]').astype('int64') / NS_PER_DAY
+
+def local_date_sql(column: str) -> str:
+    """
+    Builds the SQL expression of the local day a timestamp column falls on,
+    which replaces date(column, "localtime"). Time zones without daylight saving
+    use SQLite's own date function with a fixed offset, otherwise the local_date
+    function registered on every connection is used.
+
+    Params:
+        column: The name of the column.
+
+    Returns:
+        str: The SQL expression, which gives days in "YYYY-MM-DD" format.
+    """
+
+    offset = get_fixed_offset()
+    if offset is None:
+        return f'local_date({column})'
+
+    return f'date({column}, "{offset:+d} minutes")'
+
+def local_datetime_sql(column: str) -> str:
+    """
+    Builds the SQL expression of the local time of a timestamp column, which
+    replaces datetime(column, "localtime").
+
+    Params:
+        column: The name of the column.
+
+    Returns:
+        str: The SQL expression, which gives times in "YYYY-MM-DD HH:MM:SS"
+            format.
+    """
+
+    offset = get_fixed_offset()
+    if offset is None:
+        return f'local_datetime({column})'
+
+    return f'datetime({column}, "{offset:+d} minutes")'
+
+def register_functions(conn: sqlite3.Connection) -> None:
+    """
+    Registers local_date and local_datetime as SQL functions on a connection.
+
+    Params:
+        conn: The connection to register them on.
+    """
+
+    conn.create_function('local_date', 1, local_date, deterministic=True)
+    conn.create_function('local_datetime', 1, local_datetime, deterministic=True)
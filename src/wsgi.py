@@ -0,0 +1,12 @@
+"""
+Production entry point for the FinanceTracker application. This exposes the WSGI
+server object for a multi-process server such as gunicorn, see gunicorn.conf.py
+and the readme for how to run it.
+"""
+
+from app import create_app
+
+app = create_app()
+
+# WSGI application
+server = app.server